@@ -0,0 +1,281 @@
+# DeadReckoning.py
+#
+# Dead-reckoned odometry of the glider from DVL and ocean current velocities.
+# At every ensemble the velocity over ground is taken from the first available
+# source of a configurable policy (i.e. bottom track before through water
+# velocity plus ocean current), and the position is integrated over a whole
+# dive at once. Near the surface, the position is reset to the GPS fixes of
+# the flight controller.
+
+import numpy as np
+import pandas as pd
+
+
+class DeadReckoning(object):
+    # velocity sources of the odometry
+    #   + BOTTOM_TRACK:  over ground velocity of the DVL bottom track
+    #   + WATER_CURRENT: through water velocity plus the ocean current
+    #   + WATER:         through water velocity only
+    #   + CURRENT:       ocean current only, i.e. the glider is drifting
+    BOTTOM_TRACK   = 'bottom_track'
+    WATER_CURRENT  = 'water_current'
+    WATER          = 'water'
+    CURRENT        = 'current'
+    DEFAULT_POLICY = (BOTTOM_TRACK, WATER_CURRENT, WATER, CURRENT)
+
+    def __init__(self, policy=DEFAULT_POLICY, near_surface_filter=10):
+        """Computes the dead-reckoned position of a dive.
+
+        Args:
+            policy: the velocity sources in order of preference. At each
+                ensemble the first source with a valid velocity is used, and
+                sources that are left out are never used. If no source is
+                valid, the position is held.
+            near_surface_filter: depth above which the glider is near the
+                surface [m]. Near the surface, the through water velocity is
+                measured by the DVL instead of the pressure sensor, and the
+                position is reset to the GPS fixes.
+
+        Raises:
+            ValueError if the policy holds an unknown velocity source.
+        """
+        unknown = [_ for _ in policy if _ not in self.DEFAULT_POLICY]
+        if unknown:
+            raise ValueError('bad velocity sources: %s' % (unknown,))
+        self._policy              = tuple(policy)
+        self._near_surface_filter = near_surface_filter
+
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def near_surface_filter(self):
+        return self._near_surface_filter
+
+
+    @staticmethod
+    def get_columns(df, *names):
+        """Returns the given variables of a time series as columns of floats.
+
+        Args:
+            df: DataFrame of a PathfinderTimeSeries, or a dictionary of its
+                variables to arrays.
+            names: the variables to return.
+        """
+        return np.column_stack([np.asarray(df[_], dtype=float) 
+                                for _ in names])
+
+
+    def get_through_water_velocities(self, df):
+        """Returns the through water velocity of every ensemble.
+
+        Below the near surface filter, the velocity derived from the pressure
+        sensor is used, and near the surface the velocity measured by the
+        DVL is used.
+
+        Args:
+            df: DataFrame of a PathfinderTimeSeries, or a dictionary of its
+                variables to arrays (i.e. of a single ensemble).
+
+        Returns:
+            array of shape (num_ensembles, 2) of the (u, v) velocities [m/s].
+        """
+        submerged = np.asarray(df['depth'], dtype=float) > \
+                    self.near_surface_filter
+        pressure  = self.get_columns(df, 'rel_vel_pressure_u', 
+                                         'rel_vel_pressure_v')
+        dvl       = self.get_columns(df, 'rel_vel_dvl_u', 'rel_vel_dvl_v')
+        return np.where(submerged[:,None], pressure, dvl)
+
+
+    def get_velocities(self, df, ocean_current=None):
+        """Returns the velocity over ground used for every ensemble.
+
+        Args:
+            df: DataFrame of a PathfinderTimeSeries, or a dictionary of its
+                variables to arrays (i.e. of a single ensemble).
+            ocean_current: optional array of shape (num_ensembles, 2) of the
+                (u, v) ocean current at every ensemble [m/s], with NaN where
+                no estimate is available. See get_ocean_currents.
+
+        Returns:
+            (velocities, sources) tuple of an array of shape
+            (num_ensembles, 2) of the (u, v) velocities [m/s], NaN where no
+            source is valid, and an array of the index in the policy of the
+            source used at every ensemble, -1 where no source is valid.
+        """
+        water      = self.get_through_water_velocities(df)
+        if ocean_current is None:
+            ocean_current = np.full(water.shape, np.nan)
+        candidates = {
+            self.BOTTOM_TRACK  : self.get_columns(df, 'abs_vel_btm_u', 
+                                                      'abs_vel_btm_v'),
+            self.WATER_CURRENT : water + ocean_current,
+            self.WATER         : water,
+            self.CURRENT       : np.asarray(ocean_current, dtype=float),
+        }
+
+        # select the first valid source of the policy at every ensemble
+        velocities = np.stack([candidates[_] for _ in self.policy])
+        valid      = ~np.isnan(velocities).any(axis=2)
+        sources    = np.where(valid.any(axis=0), valid.argmax(axis=0), -1)
+        rows       = np.arange(len(water))
+        return np.where((sources >= 0)[:,None], velocities[sources, rows],
+                        np.nan), sources
+
+
+    @staticmethod
+    def get_ocean_current(water_column, z, time_filter=900):
+        """Returns the ocean current estimate of a water column cell.
+
+        The estimate of a water column cell is the mean of the first ocean
+        current recorded in the cell and of every later one that is at least
+        time_filter after it, where currents larger than the voc_mag_filter
+        of the water column are left out.
+
+        Args:
+            water_column: VelocityShearPropagation.WaterColumn with the shear
+                nodes of the dive.
+            z: depth in the water column cell [m].
+            time_filter: minimum time between the first and any other
+                estimate that is averaged, in the units of the shear node
+                times (ShearNode.t).
+
+        Returns:
+            array of the (u, v) ocean current [m/s], NaN if no estimate is 
+            available.
+        """
+        good = [node for node in water_column.get_voc_at_depth(z)
+                if not node.voc.is_none() and
+                node.voc.mag < water_column.voc_mag_filter]
+        if not good:
+            return np.full(2, np.nan)
+        used = [good[0]] + [node for node in good[1:]
+                            if node.t - good[0].t > time_filter]
+        return np.mean([[_.voc.u, _.voc.v] for _ in used], axis=0)
+
+
+    def get_ocean_currents(self, df, water_column, time_filter=900):
+        """Returns the ocean current estimate at the depth of every ensemble.
+
+        The estimate only depends on the water column cell, so it is computed
+        once per cell, see get_ocean_current.
+
+        Args:
+            df: DataFrame of a PathfinderTimeSeries.
+            water_column: VelocityShearPropagation.WaterColumn with the shear
+                nodes of the dive.
+            time_filter: minimum time between the first and any other
+                estimate that is averaged, in the units of the shear node
+                times (ShearNode.t).
+
+        Returns:
+            array of shape (num_ensembles, 2) of the (u, v) ocean current
+            [m/s], NaN where no estimate is available.
+        """
+        depth  = df['depth'].to_numpy(dtype=float)
+        valid  = ~np.isnan(depth) & (depth < water_column.MAX_DEPTH)
+        z      = np.trunc(np.where(valid, depth, 0)).astype(int)
+        bins   = z - z % water_column.WC_BIN_LEN
+        voc    = np.full((len(df), 2), np.nan)
+        for wc_bin in np.unique(bins[valid]):
+            voc[valid & (bins == wc_bin)] = self.get_ocean_current(
+                water_column, wc_bin, time_filter)
+        return voc
+
+
+    def get_gps_resets(self, df, flight_controller, origin=None):
+        """Returns the GPS fix that the position is reset to at each ensemble.
+
+        Near the surface, the position is reset to the GPS fix of the first
+        flight controller cycle at or after the time of the ensemble, if
+        that cycle has a GPS fix (see get_next_gps_fix of the 
+        SlocumFlightController). Only the flight controller cycles during 
+        the dive are used.
+
+        Args:
+            df: DataFrame of a PathfinderTimeSeries.
+            flight_controller: SlocumFlightController on the same time base
+                as the time series (UTC).
+            origin: optional (x, y) position of the origin of the dive in
+                LMC [m]. By default the first dead-reckoned position
+                (m_x_lmc, m_y_lmc) of the flight controller during the dive.
+
+        Returns:
+            array of shape (num_ensembles, 2) of the (x, y) GPS fixes
+            relative to the origin [m], NaN where the position is not reset.
+        """
+        t = df['time'].to_numpy(dtype=float)
+        if origin is None:
+            df_dbd = flight_controller.df
+            t_dbd  = df_dbd['time'].to_numpy(dtype=float)
+            lmc    = df_dbd[['m_x_lmc', 'm_y_lmc']].to_numpy(dtype=float)
+            first  = np.flatnonzero((t_dbd >= t[0]) & (t_dbd <= t[-1]) & 
+                                    ~np.isnan(lmc[:,0]))
+            origin = lmc[first[np.argmin(t_dbd[first])]] if len(first) \
+                     else np.full(2, np.nan)
+
+        # look up the next flight controller cycle of every surface ensemble
+        resets  = np.full((len(df), 2), np.nan)
+        surface = df['depth'].to_numpy(dtype=float) < self.near_surface_filter
+        resets[surface] = flight_controller.get_next_gps_fix(t[surface], 
+                                                             end=t[-1])
+        return resets - origin
+
+
+    def compute_odometry(self, df, ocean_current=None, gps_resets=None):
+        """Computes the dead-reckoned position of every ensemble of a dive.
+
+        The first ensemble is the origin of the dive. The position of every
+        other ensemble is the previous position plus the velocity of the
+        ensemble (see get_velocities) times delta_t, unless the position is
+        reset to a GPS fix. Both are computed for the whole dive at once.
+
+        Args:
+            df: DataFrame of a PathfinderTimeSeries holding a single dive.
+            ocean_current: optional ocean current at every ensemble, see
+                get_velocities.
+            gps_resets: optional array of shape (num_ensembles, 2) of the
+                positions to reset to, NaN where the position is not reset.
+                See get_gps_resets.
+
+        Returns:
+            DataFrame with the index of the time series, with the position
+            (rel_pos_x, rel_pos_y, rel_pos_z), the displacement (delta_x,
+            delta_y), the velocity (vel_x, vel_y) and the velocity source
+            (index in the policy, -1 if none) of every ensemble.
+        """
+        num_rows = len(df)
+        velocities, sources = self.get_velocities(df, ocean_current)
+        delta_t = df['delta_t'].to_numpy(dtype=float)
+        delta   = np.where(np.isnan(velocities), 0, velocities)*delta_t[:,None]
+        delta[:1] = 0
+
+        # the dive is integrated in segments that start at the origin or at
+        # a GPS reset, and a NaN displacement is carried to the segment end
+        reset = np.zeros(num_rows, dtype=bool)
+        start = np.zeros((num_rows, 2))
+        if gps_resets is not None:
+            gps_resets = np.asarray(gps_resets, dtype=float)
+            reset[1:]  = ~np.isnan(gps_resets[1:,0])
+            start[reset] = gps_resets[reset]
+        reset[:1] = True
+        segment   = np.maximum.accumulate(np.where(reset, np.arange(num_rows),
+                                                   0))
+        missing   = np.cumsum(np.isnan(delta[:,0]))
+        total     = np.cumsum(np.nan_to_num(delta), axis=0)
+        position  = start[segment] + total - total[segment]
+        position[missing > missing[segment]] = np.nan
+
+        return pd.DataFrame({
+            'rel_pos_x'       : position[:,0],
+            'rel_pos_y'       : position[:,1],
+            'rel_pos_z'       : df['depth'].to_numpy(dtype=float),
+            'delta_x'         : delta[:,0],
+            'delta_y'         : delta[:,1],
+            'vel_x'           : velocities[:,0],
+            'vel_y'           : velocities[:,1],
+            'velocity_source' : sources,
+        }, index=df.index)
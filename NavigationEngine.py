@@ -0,0 +1,433 @@
+# NavigationEngine.py
+#
+# Real-time navigation of the glider from one DVL ensemble at a time. Every
+# ping updates the dead-reckoned odometry, the ocean currents of the water
+# column and the point cloud of the terrain-aided navigation (TAN), following
+# the offline processing of dvl-nav_testRun.py, and emits a position estimate.
+# Only the state needed for the next ping is kept, so the cost and memory of
+# a ping do not grow with the length of the mission.
+
+import numpy as np
+import MultiFactorTAN
+import VelocityShearPropagation
+from DeadReckoning import DeadReckoning
+
+
+class NavigationEngine(object):
+    # variables of the flight controller state used by the engine
+    #   + attitude in [rad], positions in LMC coordinates [m]
+    FLIGHT_VARS = ('time', 'm_pitch', 'm_roll', 'm_heading', 'm_x_lmc',
+                   'm_y_lmc', 'm_gps_x_lmc', 'm_gps_y_lmc')
+
+    # variables of the ensemble used by the odometry
+    ODOMETRY_VARS = ('depth', 'delta_t', 'rel_vel_pressure_u',
+                     'rel_vel_pressure_v', 'rel_vel_dvl_u', 'rel_vel_dvl_v',
+                     'abs_vel_btm_u', 'abs_vel_btm_v')
+
+    # tuning parameters of the default water column
+    PITCH_BIAS           = 8     # [deg]   mounting pitch bias of the bins
+    START_FILTER         = 2     # [bin #] avoid using the first bins
+    END_FILTER           = 2     # [bin #] avoid using the last bins
+    VOC_MAG_FILTER       = 1.0   # [m/s]   filter out ocean currents
+    VOC_DELTA_MAG_FILTER = 0.5   # [m/s]   filter out deltas between layers
+    MAX_DEPTH            = 1000  # [m]
+
+    # tuning parameters of the terrain-aided navigation
+    #   + the position uncertainty grows with the distance traveled and
+    #     shrinks with every match of the bathymetry factors in the map
+    DVL_ODO_DRIFT          = 0.15  # [m/m] growth of the uncertainty
+    TAN_RED_DRIFT          = 0.70  #       reduction after a TAN fix
+    TAU_DEPTH              = 2     # [m]   bathymetry depth tolerance
+    TAU_SLOPE              = 2     # [deg] bathymetry slope tolerance
+    TAN_WEIGHT             = 0.4   #       weight of a TAN fix
+    MIN_VALID_SLANT_RANGES = 3
+
+    # heading offsets of the four DVL beams (port, starboard, forward, aft)
+    BEAM_HEADING_OFFSETS = np.array([-90, 90, 0, 180])  # [deg]
+
+    def __init__(self, dead_reckoning=None, water_column=None, bathy_df=None,
+        origin_utm=(0, 0), grid_resolution=10, max_nodes_per_bin=100,
+        time_filter=900):
+        """Incremental navigation filter consuming DVL ensembles as they arrive.
+
+        Every call to update takes the next ensemble of the DVL and the
+        latest state of the flight controller, and costs the same regardless
+        of how many ensembles came before it. The water column only keeps the
+        most recent shear nodes of each cell and the point cloud is cleared
+        once its factors have been computed, so the memory is bounded too.
+
+        Args:
+            dead_reckoning: DeadReckoning that selects the velocity of every
+                ensemble. By default the default policy is used.
+            water_column: VelocityShearPropagation.WaterColumn to add the
+                shear nodes to. By default a water column is created from the
+                bin geometry of the first ensemble, see get_water_column.
+            bathy_df: optional DataFrame of the bathymetry map, with the UTM
+                position (utm_x_list, utm_y_list) and the depth (depth_list)
+                and slope (slope_list) factors of every cell. Without a map
+                the TAN position follows the odometry.
+            origin_utm: (x, y) UTM position of the origin of the LMC frame.
+            grid_resolution: resolution of the bathymetry map [m].
+            max_nodes_per_bin: number of shear nodes kept in each water
+                column cell, or None to keep every shear node. Older nodes
+                are detached from the propagation graph and dropped.
+            time_filter: minimum time between averaged ocean current
+                estimates [s], see DeadReckoning.get_ocean_current.
+        """
+        self._dead_reckoning    = dead_reckoning or DeadReckoning()
+        self._water_column      = water_column
+        self._point_cloud       = MultiFactorTAN.PointCloud(grid_resolution)
+        self._max_nodes_per_bin = max_nodes_per_bin
+        self._time_filter       = time_filter
+        self._profile_indices   = None
+
+        # positions of the map cells are kept relative to the origin
+        self._bathy_xy          = None
+        if bathy_df is not None:
+            self._bathy_xy     = bathy_df[['utm_x_list', 'utm_y_list']] \
+                                   .to_numpy(dtype=float) - origin_utm
+            self._bathy_depth  = bathy_df['depth_list'].to_numpy(dtype=float)
+            self._bathy_slope  = bathy_df['slope_list'].to_numpy(dtype=float)
+
+        # navigation state carried from one ping to the next
+        self._num_pings    = 0
+        self._flight_state = {}
+        self._origin       = None
+        self._position     = np.zeros(2)
+        self._tan_position = np.zeros(2)
+        self._tan_radius   = 0.0
+
+
+    @property
+    def dead_reckoning(self):
+        return self._dead_reckoning
+
+    @property
+    def water_column(self):
+        return self._water_column
+
+    @property
+    def point_cloud(self):
+        return self._point_cloud
+
+    @property
+    def max_nodes_per_bin(self):
+        return self._max_nodes_per_bin
+
+    @property
+    def num_pings(self):
+        return self._num_pings
+
+    @property
+    def flight_state(self):
+        return self._flight_state
+
+    @property
+    def origin(self):
+        return self._origin
+
+    @property
+    def position(self):
+        return self._position
+
+    @property
+    def tan_position(self):
+        return self._tan_position
+
+    @property
+    def tan_radius(self):
+        return self._tan_radius
+
+
+    def get_water_column(self, ensemble):
+        """Returns a water column for the bin geometry of an ensemble."""
+        scale = np.cos(self.PITCH_BIAS*ensemble.DEG_TO_RAD)
+        return VelocityShearPropagation.WaterColumn(
+            bin_len=scale*ensemble.depth_bin_length,
+            bin0_dist=scale*ensemble.bin0_distance,
+            max_depth=self.MAX_DEPTH,
+            start_filter=self.START_FILTER,
+            end_filter=self.END_FILTER,
+            voc_mag_filter=self.VOC_MAG_FILTER,
+            voc_delta_mag_filter=self.VOC_DELTA_MAG_FILTER,
+        )
+
+
+    def update_flight_state(self, flight_state):
+        """Keeps the latest valid value of every flight controller variable.
+
+        Args:
+            flight_state: dictionary (or pandas Series) of a cycle of the
+                flight controller, see FLIGHT_VARS. Missing and NaN values
+                keep the previous value.
+        """
+        for var in self.FLIGHT_VARS:
+            val = flight_state.get(var, np.nan)
+            if not np.isnan(val):
+                self._flight_state[var] = val
+
+        # the origin is the first dead-reckoned position of the glider
+        if self.origin is None and 'm_x_lmc' in self._flight_state and \
+            'm_y_lmc' in self._flight_state:
+            self._origin = np.array([self._flight_state['m_x_lmc'],
+                                     self._flight_state['m_y_lmc']])
+
+
+    def get_attitude(self, ensemble):
+        """Returns the (pitch, roll, heading) of the glider [deg].
+
+        The attitude of the flight controller is used when available, and
+        the attitude measured by the DVL otherwise.
+        """
+        attitude = [ensemble.pitch, ensemble.roll, ensemble.heading]
+        for i, var in enumerate(('m_pitch', 'm_roll', 'm_heading')):
+            if var in self.flight_state:
+                attitude[i] = self.flight_state[var]*ensemble.RAD_TO_DEG
+        return tuple(attitude)
+
+
+    def get_gps_reset(self, depth, flight_state):
+        """Returns the GPS fix to reset the position to, relative to the
+        origin, or None if the position is not reset.
+
+        The position is reset near the surface when the cycle of the flight
+        controller has a GPS fix, see DeadReckoning.get_gps_resets.
+        """
+        if flight_state is None or self.origin is None or \
+            not depth < self.dead_reckoning.near_surface_filter:
+            return None
+        fix = np.array([flight_state.get('m_gps_x_lmc', np.nan),
+                        flight_state.get('m_gps_y_lmc', np.nan)], dtype=float)
+        if np.isnan(fix).any():
+            return None
+        return fix - self.origin
+
+
+    def update_water_column(self, ensemble, vtw, pitch, roll):
+        """Adds the shear node of an ensemble to the water column.
+
+        Args:
+            ensemble: the PathfinderEnsemble of the ping.
+            vtw: array of the (u, v) through water velocity [m/s].
+            pitch: pitch of the glider [deg].
+            roll: roll of the glider [deg].
+        """
+        water_column = self.water_column
+        depth        = ensemble.depth
+        num_bins     = int(ensemble.num_good_vel_bins)
+
+        # extract the ocean current reference from bottom track if available
+        vog = np.array([ensemble.abs_vel_btm_u, ensemble.abs_vel_btm_v])
+        if not np.isnan(vog[0]):
+            voc_u, voc_v = vog - vtw
+            voc_ref = VelocityShearPropagation.OceanCurrent(voc_u, voc_v, 0)
+        else:
+            voc_ref = VelocityShearPropagation.OceanCurrent()
+
+        # skip shear nodes whose bins would fall outside of the water column
+        #   + bins are only used when there are more than the filtered bins
+        #   + the depth of a bin scales with the attitude of the glider
+        if num_bins <= water_column.START_FILTER + water_column.END_FILTER:
+            num_bins = 0
+            if voc_ref.is_none():
+                return
+        scale = np.cos(pitch*ensemble.DEG_TO_RAD) * \
+                np.cos(roll*ensemble.DEG_TO_RAD)
+        max_z = depth + water_column.BIN0_DIST + \
+                (num_bins + 1)*water_column.BIN_LEN + water_column.WC_BIN_LEN
+        if not (depth >= 0 and scale > 0 and max_z < water_column.MAX_DEPTH):
+            return
+
+        # shear between the through water velocity and every good bin
+        if self._profile_indices is None:
+            self._profile_indices = np.array([[ensemble.data_lookup[
+                ensemble.get_profile_var_name('velocity', i, beam)]
+                for beam in (0, 1)] for i in range(ensemble.NUM_BINS_EXP)])
+        dvl        = ensemble.data_array[self._profile_indices[:num_bins]]
+        shear_list = [VelocityShearPropagation.OceanCurrent(u, v, 0)
+                      for u, v in vtw + dvl]
+        direction  = 'descending' if ensemble.delta_z > 0 else 'ascending'
+        water_column.add_shear_node(
+            z_true=depth,
+            t=ensemble.time,
+            shear_list=shear_list,
+            voc_ref=voc_ref,
+            direction=direction,
+            pitch=pitch,
+            roll=roll,
+        )
+        if self.max_nodes_per_bin is not None:
+            self.prune_water_column(depth, max_z)
+
+
+    def prune_water_column(self, z_min, z_max):
+        """Drops all but the newest shear nodes of the cells in a depth range.
+
+        Dropped nodes are detached from their parent and children, so that
+        the propagation graph does not keep old nodes in memory.
+        """
+        water_column = self.water_column
+        z_max = min(z_max, water_column.MAX_DEPTH)
+        for z_bin in range(water_column.get_wc_bin(z_min), int(z_max),
+                           water_column.WC_BIN_LEN):
+            nodes = water_column.shear_node_dict[z_bin]
+            if len(nodes) <= self.max_nodes_per_bin:
+                continue
+            for node in nodes[:-self.max_nodes_per_bin]:
+                if node.parent is not None and node in node.parent.children:
+                    node.parent.children.remove(node)
+                node.parent   = None
+                node.children = []
+            del nodes[:-self.max_nodes_per_bin]
+
+
+    def update_point_cloud(self, ensemble, position, pitch, roll, heading,
+                           time_index=None):
+        """Adds the bottom contacts of an ensemble to the TAN point cloud.
+
+        Args:
+            ensemble: the PathfinderEnsemble of the ping.
+            position: (x, y, z) position of the glider [m].
+            pitch, roll, heading: attitude of the glider [deg].
+            time_index: index of the ping, the number of pings navigated so
+                far by default.
+
+        Returns:
+            (depth, slope, orient) factors of the bathymetry of the point
+            cloud, NaN when not enough bottom contacts have been collected.
+        """
+        cos_janus    = np.cos(ensemble.JANUS_ANGLE*ensemble.DEG_TO_RAD)
+        sin_janus    = np.sin(ensemble.JANUS_ANGLE*ensemble.DEG_TO_RAD)
+        slant_ranges = np.array([ensemble.btm_beam0_range,
+                                 ensemble.btm_beam1_range,
+                                 ensemble.btm_beam2_range,
+                                 ensemble.btm_beam3_range]) / cos_janus
+        beams        = np.flatnonzero(~np.isnan(slant_ranges))
+        if len(beams) < self.MIN_VALID_SLANT_RANGES:
+            return (np.nan, np.nan, np.nan)
+        if time_index is None:
+            time_index = self.num_pings
+
+        # bottom contacts in instrument coordinates, z positive upwards
+        r      = slant_ranges[beams]
+        offset = self.BEAM_HEADING_OFFSETS[beams]*ensemble.DEG_TO_RAD
+        inst   = np.vstack((r*sin_janus*np.sin(offset),
+                            r*sin_janus*np.cos(offset),
+                            -r*cos_janus))
+
+        # rotate into ship coordinates, z positive downwards
+        pc     = self.point_cloud
+        Q      = np.dot(pc.Qz((heading + ensemble.BIAS_HEADING) *
+                              ensemble.DEG_TO_RAD),
+                 np.dot(pc.Qy((roll    + ensemble.BIAS_ROLL)    *
+                              ensemble.DEG_TO_RAD),
+                        pc.Qx((pitch   + ensemble.BIAS_PITCH)   *
+                              ensemble.DEG_TO_RAD)))
+        ship   = np.dot(Q, inst)
+        for beam, (x, y, z) in zip(beams, ship.T):
+            pc.add_point(MultiFactorTAN.BottomTrackPoint(
+                time_index, beam, x, y, -z, *position))
+        return pc.get_factors()
+
+
+    def get_tan_fix(self, bathy_depth, bathy_slope, position, radius):
+        """Returns the position of the map cells matching the bathymetry.
+
+        Cells within the radius of the position are matched on both the depth
+        and slope factors, or on the depth factor alone if no cell matches
+        both.
+
+        Returns:
+            array of the (x, y) mean position of the matched cells relative
+            to the origin [m], NaN if no cell matches.
+        """
+        if self._bathy_xy is None:
+            return np.full(2, np.nan)
+        near  = np.hypot(*(self._bathy_xy - position).T) <= radius
+        depth = near & (np.abs(self._bathy_depth - bathy_depth) <=
+                        self.TAU_DEPTH)
+        both  = depth & (np.abs(self._bathy_slope - bathy_slope) <=
+                         self.TAU_SLOPE)
+        match = both if both.any() else depth
+        if not match.any():
+            return np.full(2, np.nan)
+        return self._bathy_xy[match].mean(axis=0)
+
+
+    def update(self, ensemble, flight_state=None):
+        """Updates the navigation with the next ensemble of the DVL.
+
+        Args:
+            ensemble: the next PathfinderEnsemble, parsed with the previous
+                one so that its derived variables are available.
+            flight_state: optional dictionary (or pandas Series) of the
+                latest cycle of the flight controller, see FLIGHT_VARS.
+
+        Returns:
+            dictionary of the position estimate of the ping: the odometry
+            (rel_pos_x, rel_pos_y, rel_pos_z) and its velocity_source (see
+            DeadReckoning.get_velocities), the ocean current (voc_u, voc_v),
+            the TAN position (tan_pos_x, tan_pos_y) and its uncertainty
+            (tan_pos_r), and the bathymetry factors of the point cloud.
+        """
+        if flight_state is not None:
+            self.update_flight_state(flight_state)
+        if self.water_column is None:
+            self._water_column = self.get_water_column(ensemble)
+        first = self.num_pings == 0
+        pitch, roll, heading = self.get_attitude(ensemble)
+        row = {var : [ensemble.get_data(var)] for var in self.ODOMETRY_VARS}
+        vtw = self.dead_reckoning.get_through_water_velocities(row)[0]
+
+        # update the water column and estimate the current at the glider
+        self.update_water_column(ensemble, vtw, pitch, roll)
+        depth = ensemble.depth
+        voc   = np.full(2, np.nan)
+        if depth < self.water_column.MAX_DEPTH:
+            voc = self.dead_reckoning.get_ocean_current(
+                self.water_column, depth, self._time_filter)
+
+        # dead-reckon the position unless it is reset to a GPS fix
+        velocities, sources = self.dead_reckoning.get_velocities(row, [voc])
+        delta = np.zeros(2) if first else \
+                np.nan_to_num(velocities[0])*ensemble.delta_t
+        reset = None if first else self.get_gps_reset(depth, flight_state)
+        self._position = self.position + delta if reset is None else reset
+        position = (self.position[0], self.position[1], depth)
+
+        # terrain-aided navigation, following the odometry between fixes
+        factors   = (np.nan, np.nan, np.nan)
+        prev_tan  = self.tan_position
+        prev_r    = self.tan_radius
+        odo_r     = prev_r + np.hypot(*delta)*self.DVL_ODO_DRIFT
+        if reset is not None:
+            self._tan_position = reset
+        elif not first:
+            self._tan_position = prev_tan + delta
+            self._tan_radius   = odo_r
+            factors = self.update_point_cloud(ensemble, position, pitch,
+                                              roll, heading)
+            if not np.isnan(factors[0]):
+                fix = self.get_tan_fix(factors[0], factors[1], prev_tan,
+                                       prev_r)
+                if not np.isnan(fix[0]):
+                    self._tan_position = (1 - self.TAN_WEIGHT)*(prev_tan +
+                                         delta) + self.TAN_WEIGHT*fix
+                    self._tan_radius   = prev_r*self.TAN_RED_DRIFT
+        self._num_pings += 1
+
+        return {
+            'time'            : ensemble.time,
+            'rel_pos_x'       : position[0],
+            'rel_pos_y'       : position[1],
+            'rel_pos_z'       : position[2],
+            'velocity_source' : sources[0],
+            'voc_u'           : voc[0],
+            'voc_v'           : voc[1],
+            'tan_pos_x'       : self.tan_position[0],
+            'tan_pos_y'       : self.tan_position[1],
+            'tan_pos_r'       : self.tan_radius,
+            'bathy_depth'     : factors[0],
+            'bathy_slope'     : factors[1],
+            'bathy_orient'    : factors[2],
+        }
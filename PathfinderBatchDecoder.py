@@ -0,0 +1,845 @@
+# PathfinderBatchDecoder.py
+#
+# Decodes every ensemble of a Pathfinder pd0 file in a single vectorized pass.
+# Produces the same variables as PathfinderEnsemble, laid out by label_list.
+
+import numpy as np
+import struct
+from datetime import datetime, timedelta
+from PathfinderDVL import PathfinderDVL
+from PathfinderChecksumError import PathfinderChecksumError
+
+
+class PathfinderBatchDecoder(PathfinderDVL):
+    def __init__(self):
+        """Batch decoder for Pathfinder DVL pd0 files.
+
+        PathfinderEnsemble parses one ensemble at a time with one call to
+        struct.unpack_from per variable and per bin/beam. The batch decoder
+        instead works on the whole file at once:
+
+        1. walk the chain of ensemble headers (7F7F) through the file.
+        2. validate the checksums of all ensembles.
+        3. group ensembles that share the same data type layout.
+        4. decode each data type of a group with np.frombuffer, using
+           structured dtypes built from the PathfinderDVL format tuples.
+        5. convert units, apply mounting bias rotations, and compute the
+           derived variables for all ensembles with array operations.
+
+        The resulting array has one row per ensemble and one column per
+        variable in label_list, matching the rows that PathfinderTimeSeries
+        collects from PathfinderEnsemble objects.
+        """
+        # use the parent constructor for defining Pathfinder DVL variables
+        super().__init__()
+
+        # map from byte id to data type name
+        self._data_id_names = {
+            0x0000: 'fixed_leader',
+            0x0080: 'variable_leader',
+            0x0100: 'velocity',
+            0x0200: 'correlation',
+            0x0300: 'echo_intensity',
+            0x0400: 'percent_good',
+            0x0600: 'bottom_track',
+        }
+
+        # structured dtypes for the fixed size data types
+        self._dtypes = {
+            'fixed_leader'    : self.get_dtype(self.fixed_leader_format),
+            'variable_leader' : self.get_dtype(self.variable_leader_format),
+            'bottom_track'    : self.get_dtype(self.bottom_track_format),
+        }
+
+        # byte offsets of the most recently decoded ensembles
+        self._ensemble_offsets = np.zeros(0, dtype=np.int64)
+
+
+    @property
+    def data_id_names(self):
+        return self._data_id_names
+
+    @property
+    def dtypes(self):
+        return self._dtypes
+
+    @property
+    def ensemble_offsets(self):
+        return self._ensemble_offsets
+
+
+    def get_dtype(self, format_tuples):
+        """Builds a structured NumPy dtype from PathfinderDVL format tuples.
+
+        The struct format strings used by PathfinderDVL (i.e. '<H' or 'B')
+        are valid NumPy type strings as well, so the dtype simply places each
+        variable at its byte offset. Gaps between variables act as padding.
+
+        Args:
+            format_tuples: tuple of variable format tuples, where each tuple
+                is of the form: (name <string>, format-string <char>,
+                offset <int>).
+        """
+        names   = [_[0] for _ in format_tuples]
+        formats = [np.dtype(_[1]) for _ in format_tuples]
+        offsets = [_[2] for _ in format_tuples]
+        size    = max(o + f.itemsize for o,f in zip(offsets, formats))
+        return np.dtype({'names'    : names,
+                         'formats'  : formats,
+                         'offsets'  : offsets,
+                         'itemsize' : size})
+
+
+    def decode(self, pd0_bytes):
+        """Decodes all ensembles from the given pd0 bytes.
+
+        Args:
+            pd0_bytes: bytes-like object holding one or more pd0 ensembles.
+
+        Returns:
+            Array of shape (num_ensembles, ensemble_size) where the columns
+            follow label_list.
+
+        Raises:
+            ValueError if a header id is incorrect or if the instrument
+                settings are not supported (see PathfinderEnsemble).
+            PathfinderChecksumError if an invalid checksum is found.
+        """
+        buf    = np.frombuffer(pd0_bytes, dtype=np.uint8)
+        starts = self.find_ensembles(buf)
+        self._ensemble_offsets = starts
+        return self.decode_ensembles(buf, starts)
+
+
+    def iter_decode(self, pd0_bytes, chunk_size, resync=False, stats=None):
+        """Decodes the given pd0 bytes in chunks of consecutive ensembles.
+
+        The ensemble chain is followed lazily, so the first chunk is available
+        before the rest of the buffer has been read. The last row of each 
+        chunk is used as the previous ensemble of the next chunk, so the 
+        derived variables are identical to decoding the buffer in one pass.
+
+        Args:
+            pd0_bytes: bytes-like object holding one or more pd0 ensembles.
+            chunk_size: maximum number of ensembles per chunk. 
+            resync: boolean flag for skipping damaged ensembles instead of 
+                raising an error (see iter_ensemble_offsets).
+            stats: optional dictionary that is updated with the statistics of
+                the skipped bytes when resync is used.
+
+        Yields:
+            Arrays of shape (<= chunk_size, ensemble_size).
+        """
+        buf      = np.frombuffer(pd0_bytes, dtype=np.uint8)
+        prev_row = None
+        starts   = []
+        for offset in self.iter_ensemble_offsets(buf, resync=resync, 
+                                                 stats=stats):
+            starts.append(offset)
+            if len(starts) == chunk_size:
+                data = self.decode_ensembles(buf, np.array(starts), prev_row)
+                prev_row = data[-1].copy()
+                starts   = []
+                yield data
+        if starts:
+            yield self.decode_ensembles(buf, np.array(starts), prev_row)
+
+
+    def decode_ensembles(self, buf, starts, prev_row=None):
+        """Decodes the ensembles that start at the given byte offsets.
+
+        Args:
+            buf: uint8 array holding the pd0 bytes.
+            starts: array of byte offsets of consecutive ensembles.
+            prev_row: decoded row of the ensemble preceding starts[0], or None
+                if starts[0] is the beginning of a dive.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        self.validate_checksums(buf, starts)
+
+        # decode each group of ensembles that share the same byte layout
+        data = np.zeros((len(starts), self.ensemble_size))
+        if len(starts) == 0:
+            return data
+        for rows, addresses in self.group_layouts(buf, starts):
+            for data_id, address in addresses:
+                if data_id not in self.data_id_names:
+                    print('  WARNING: no parser found for header %d' %
+                          (data_id,))
+                    continue
+                name = self.data_id_names[data_id]
+                section_starts = starts[rows] + address
+                if name == 'fixed_leader':
+                    self.decode_fixed_leader(buf, section_starts, data, rows)
+                elif name == 'variable_leader':
+                    self.decode_variable_leader(buf, section_starts, data,
+                                                rows)
+                elif name == 'velocity':
+                    self.decode_velocity(buf, section_starts, data, rows)
+                elif name == 'bottom_track':
+                    self.decode_bottom_track(buf, section_starts, data, rows)
+
+        # rotate velocities and compute derived variables over all ensembles
+        self.apply_mounting_bias_rotations(data)
+        self.compute_derived_variables(data, prev_row)
+        return data
+
+
+    def find_ensembles(self, buf):
+        """Returns the byte offset of every ensemble in the buffer.
+
+        Args:
+            buf: uint8 array holding the pd0 bytes.
+        """
+        return np.fromiter(self.iter_ensemble_offsets(buf), dtype=np.int64)
+
+
+    def iter_ensemble_offsets(self, buf, offset=0, resync=False, stats=None):
+        """Follows the chain of ensembles through the buffer.
+
+        Each ensemble header must start with the 7F7F flag, and the number of
+        bytes reported in the header gives the start of the next ensemble. 
+        Only the headers are touched, so walking the chain does not require 
+        any memory proportional to the size of the buffer.
+
+        In resync mode, damaged ensembles are skipped instead: the buffer is 
+        scanned block by block for candidate 7F7F headers, the checksums of 
+        all candidates in a block are validated at once, and the chain 
+        continues from the next candidate with a valid checksum. Serial 
+        dropouts, corrupted bytes and truncated tails then only cost the 
+        damaged ensembles rather than the whole file.
+
+        Args:
+            buf: uint8 array holding the pd0 bytes.
+            offset: byte offset of the first ensemble.
+            resync: boolean flag for skipping damaged ensembles.
+            stats: optional dictionary that is updated with the statistics of
+                the skipped bytes in resync mode:
+                    num_ensembles: number of valid ensembles found.
+                    num_skipped_bytes: total number of bytes skipped.
+                    skipped: list of (offset, num_bytes) skipped regions.
+
+        Yields:
+            The byte offset of each ensemble.
+
+        Raises:
+            ValueError if an ensemble does not start with a valid header or
+                if the last ensemble is truncated (unless resync is used).
+        """
+        HEADER_FLAG   = 0x7f
+        HEADER_FORMAT = '<BBH'
+        CHECKSUM_LEN  = 2
+        header_len    = struct.calcsize(HEADER_FORMAT)
+        if resync:
+            yield from self.iter_resync_offsets(buf, offset, stats)
+            return
+        while offset < len(buf):
+            if offset + header_len > len(buf):
+                raise ValueError('Truncated ensemble at byte %d' % (offset,))
+            flag, source, num_bytes = struct.unpack_from(HEADER_FORMAT, buf,
+                                                         offset)
+            if flag != HEADER_FLAG or source != HEADER_FLAG:
+                raise ValueError('Incorrect Header ID \
+                    \n  received: %s %s \n  expected: %s %s' %
+                    (flag, source, HEADER_FLAG, HEADER_FLAG))
+            if offset + num_bytes + CHECKSUM_LEN > len(buf):
+                raise ValueError('Truncated ensemble at byte %d' % (offset,))
+            yield offset
+            offset += num_bytes + CHECKSUM_LEN
+
+
+    def iter_resync_offsets(self, buf, offset=0, stats=None):
+        """Yields the offsets of valid ensembles, skipping damaged bytes.
+
+        See iter_ensemble_offsets for the arguments.
+        """
+        BLOCK_SIZE   = 1 << 16     # bytes scanned for candidates at a time
+        CHECKSUM_LEN = 2
+        if stats is None:
+            stats = {}
+        stats.setdefault('num_ensembles',     0)
+        stats.setdefault('num_skipped_bytes', 0)
+        stats.setdefault('skipped',           [])
+
+        # helper function for recording a skipped region
+        def skip(start, stop):
+            stats['num_skipped_bytes'] += stop - start
+            stats['skipped'].append((start, stop - start))
+
+        block_end = offset
+        while offset < len(buf):
+
+            # validate all candidate ensembles of the next block at once
+            if offset >= block_end:
+                block_end = min(offset + BLOCK_SIZE, len(buf))
+                candidates, num_bytes, valid = self.find_candidates(
+                    buf, offset, block_end)
+                good    = candidates[valid]
+                lengths = num_bytes[valid] + CHECKSUM_LEN
+
+            # continue the chain from the next valid ensemble in the block
+            i = np.searchsorted(good, offset)
+            if i == len(good):
+                skip(offset, block_end)
+                offset = block_end
+                continue
+            if good[i] > offset:
+                skip(offset, int(good[i]))
+            stats['num_ensembles'] += 1
+            yield int(good[i])
+            offset = int(good[i] + lengths[i])
+
+
+    def find_candidates(self, buf, start=0, stop=None):
+        """Finds and validates every candidate ensemble in buf[start:stop].
+
+        A candidate is any 7F7F pair of bytes. The candidate is valid if the 
+        ensemble it describes fits inside the buffer and its checksum is 
+        correct. The ensembles themselves may extend beyond stop.
+
+        Args:
+            buf: uint8 array holding the pd0 bytes.
+            start: first byte offset to search for candidates.
+            stop: byte offset to stop searching for candidates.
+
+        Returns:
+            (offsets, num_bytes, valid) arrays with one entry per candidate.
+        """
+        HEADER_FLAG  = 0x7f
+        HEADER_BYTES = 6
+        CHECKSUM_LEN = 2
+        if stop is None:
+            stop = len(buf)
+        block   = buf[start:stop+1]
+        offsets = start + np.flatnonzero((block[:-1] == HEADER_FLAG) & 
+                                         (block[1:]  == HEADER_FLAG))
+        offsets   = offsets[offsets + HEADER_BYTES <= len(buf)]
+        num_bytes = self.gather(buf, offsets+2, '<u2').astype(np.int64)
+        valid     = (num_bytes >= HEADER_BYTES) & \
+                    (offsets + num_bytes + CHECKSUM_LEN <= len(buf))
+        calc, given  = self.get_checksums(buf, offsets[valid])
+        valid[valid] = calc == given
+        return offsets, num_bytes, valid
+
+
+    def get_checksums(self, buf, starts):
+        """Computes the checksums of all ensembles at once.
+
+        The checksum is the sum of the ensemble bytes (excluding the checksum
+        itself) modulo 65536. The ensembles may overlap, which is the case 
+        when checking candidate headers in a damaged file.
+
+        Args:
+            buf: uint8 array holding the pd0 bytes.
+            starts: array of byte offsets of the ensembles.
+
+        Returns:
+            (calculated, given) arrays of checksums.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        if len(starts) == 0:
+            return np.zeros((2, 0), dtype=np.int64)
+        num_bytes = self.gather(buf, starts+2, '<u2').astype(np.int64)
+        ends      = starts + num_bytes
+        bounds    = np.column_stack((starts, ends)).ravel()
+        # the buffer is cut after the last checksum so that the final 
+        # (discarded) reduction does not run to the end of the file
+        buf       = buf[:ends.max()+2]
+        calc      = np.add.reduceat(buf, bounds, dtype=np.uint64)[::2]
+        calc      = (calc & 0xFFFF).astype(np.int64)
+        given     = self.gather(buf, ends, '<u2').astype(np.int64)
+        return calc, given
+
+
+    def validate_checksums(self, buf, starts):
+        """Validates the checksums of all ensembles at once.
+
+        Raises:
+            PathfinderChecksumError for the first invalid checksum found.
+        """
+        calc, given = self.get_checksums(buf, starts)
+        bad         = np.flatnonzero(calc != given)
+        if len(bad):
+            raise PathfinderChecksumError(calc[bad[0]], given[bad[0]])
+
+
+    def group_layouts(self, buf, starts):
+        """Groups ensembles by the layout of their data types.
+
+        Ensembles in the same file almost always share the same layout, in
+        which case a single group holding all ensembles is returned.
+
+        Returns:
+            List of (rows, addresses) tuples, where rows indexes into starts
+            and addresses is a tuple of (data_id, address offset) pairs.
+        """
+        HEADER_BYTES = 6
+        groups = []
+        num_data_types = buf[starts+5]
+        for num in np.unique(num_data_types):
+            subset = np.flatnonzero(num_data_types == num)
+            sub_starts = starts[subset]
+            address_starts = sub_starts[:,None] + HEADER_BYTES + \
+                             2*np.arange(num)[None,:]
+            addresses = self.gather(buf, address_starts, '<u2')
+            data_ids  = self.gather(buf, sub_starts[:,None] + addresses,'<u2')
+            layouts   = np.hstack((addresses, data_ids)).astype(np.int64)
+            unique, inverse = np.unique(layouts, axis=0, return_inverse=True)
+            for i, layout in enumerate(unique):
+                rows = subset[inverse.ravel() == i]
+                groups.append((rows, tuple(zip(layout[num:].tolist(),
+                                               layout[:num].tolist()))))
+        return groups
+
+
+    def gather(self, buf, starts, dtype):
+        """Reads one value of the given dtype at each of the start offsets.
+
+        Args:
+            buf: uint8 array holding the pd0 bytes.
+            starts: array of byte offsets (any shape).
+            dtype: NumPy dtype (scalar, structured, or sub-array) to read at 
+                each offset.
+
+        Returns:
+            Array with the shape of starts, followed by the sub-array shape.
+        """
+        dtype  = np.dtype(dtype)
+        starts = np.asarray(starts)
+        index  = starts[...,None] + np.arange(dtype.itemsize)
+        base, shape = dtype.subdtype if dtype.subdtype else (dtype, ())
+        return buf[index].view(base).reshape(starts.shape + shape)
+
+
+    def set_columns(self, data, rows, values):
+        """Copies decoded fields that appear in label_list into the array.
+
+        Args:
+            data: array of shape (num_ensembles, ensemble_size).
+            rows: indices of the ensembles that were decoded.
+            values: structured array of decoded values.
+        """
+        for name in values.dtype.names:
+            if name in self.label_set:
+                data[rows, self.data_lookup[name]] = values[name]
+
+
+    def convert_to_metric(self, data, rows, variable, multiplier):
+        """Converts a column to standard metric value using the multiplier."""
+        data[rows, self.data_lookup[variable]] *= multiplier
+
+
+    def decode_fixed_leader(self, buf, section_starts, data, rows):
+        """Decodes the fixed leader data type for a group of ensembles.
+
+        The pd0 fixed leader format is in the Pathfinder Manual on pg 174.
+        """
+        fixed_leader = self.gather(buf, section_starts,
+                                   self.dtypes['fixed_leader'])
+        self.set_columns(data, rows, fixed_leader)
+
+        # convert relevant fields to standard metric quantities
+        self.convert_to_metric(data, rows, 'depth_bin_length', self.CM_TO_M)
+        self.convert_to_metric(data, rows, 'blanking_distance', self.CM_TO_M)
+        self.convert_to_metric(data, rows, 'error_velocity_threshold',
+                               self.MM_TO_M)
+        self.convert_to_metric(data, rows, 'heading_alignment',
+                               self.HUNDRETH_TO_DEG)
+        self.convert_to_metric(data, rows, 'heading_bias',
+                               self.HUNDRETH_TO_DEG)
+        self.convert_to_metric(data, rows, 'bin0_distance', self.CM_TO_M)
+        self.convert_to_metric(data, rows, 'transmit_pulse_length',
+                               self.CM_TO_M)
+
+        # the array layout requires the expected number of bins and beams
+        num_bins  = fixed_leader['num_bins']
+        num_beams = fixed_leader['num_beams']
+        if np.any(num_bins != self.NUM_BINS_EXP):
+            raise ValueError('Too many bins: expected = %s, actual = %s'
+                % (self.NUM_BINS_EXP, num_bins[num_bins!=self.NUM_BINS_EXP][0]))
+        if np.any(num_beams != self.NUM_BEAMS_EXP):
+            raise ValueError('Incorrect # beams: expected = %s, actual = %s'
+                % (self.NUM_BEAMS_EXP,
+                   num_beams[num_beams!=self.NUM_BEAMS_EXP][0]))
+
+
+    def decode_variable_leader(self, buf, section_starts, data, rows):
+        """Decodes the variable leader data type for a group of ensembles.
+
+        The pd0 variable leader format is in the Pathfinder Manual on pg 180.
+        """
+        variable_leader = self.gather(buf, section_starts,
+                                      self.dtypes['variable_leader'])
+        self.set_columns(data, rows, variable_leader)
+
+        # compute ensemble number while accounting for ensemble roll over
+        data[rows, self.data_lookup['ensemble_number']] = \
+            variable_leader['ensemble_number'] + \
+            self.MAX_ENS_NUM*variable_leader['ensemble_rollover'].astype(int)
+
+        # convert data to metric values when applicable
+        for var, multiplier in (
+                ('depth',                    self.DM_TO_M),
+                ('heading',                  self.HUNDRETH_TO_DEG),
+                ('pitch',                    self.HUNDRETH_TO_DEG),
+                ('roll',                     self.HUNDRETH_TO_DEG),
+                ('temperature',              self.HUNDRETH_TO_DEG),
+                ('pitch_standard_deviation', self.TENTH_TO_DEG),
+                ('roll_standard_deviation',  self.TENTH_TO_DEG),
+                ('pressure',                 self.DAM_TO_M),
+                ('pressure_variance',        self.DAM_TO_M)):
+            self.convert_to_metric(data, rows, var, multiplier)
+
+        # store time information in data array
+        data[rows, self.data_lookup['time']] = self.get_timestamps(
+            variable_leader['rtc_year'],
+            variable_leader['rtc_month'],
+            variable_leader['rtc_day'],
+            variable_leader['rtc_hour'],
+            variable_leader['rtc_minute'],
+            variable_leader['rtc_second'],
+            variable_leader['rtc_hundredths'])
+
+
+    def get_timestamps(self, year, month, day, hour, minute, second,
+        hundredths):
+        """Converts the DVL real-time-clock fields into POSIX timestamps.
+
+        Matches PathfinderEnsemble, which builds a naive (local time) datetime
+        for each ensemble and passes the hundredths field as the microsecond
+        argument. The local UTC offset is looked up once per distinct minute
+        rather than once per ensemble.
+        """
+        # assumes data collected in the 2000's (not recorded by DVL)
+        RTC_MILLENIUM = 2000
+        EPOCH         = datetime(1970, 1, 1)
+        years  = year.astype(np.int64) + RTC_MILLENIUM - 1970
+        months = years.astype('datetime64[Y]').astype('datetime64[M]') + \
+                 (month.astype(np.int64) - 1).astype('timedelta64[M]')
+        days   = months.astype('datetime64[D]') + \
+                 (day.astype(np.int64) - 1).astype('timedelta64[D]')
+        naive  = days.astype(np.int64)*86400 + hour.astype(np.int64)*3600 + \
+                 minute.astype(np.int64)*60 + second.astype(np.int64)
+
+        # naive datetimes are interpreted in local time by datetime.timestamp
+        minutes = naive // 60
+        unique, inverse = np.unique(minutes, return_inverse=True)
+        offsets = np.array(
+            [int((EPOCH + timedelta(minutes=int(m))).timestamp()) - 60*int(m)
+             for m in unique], dtype=np.int64)
+        local = naive + offsets[inverse.ravel()]
+        return local.astype(float) + hundredths / 1e6
+
+
+    def decode_velocity(self, buf, section_starts, data, rows):
+        """Decodes the velocity water profiling data for a group of ensembles.
+
+        The water profiling format is in the Pathfinder Manual on pg 188.
+        Velocities are reported in [mm/s]. The correlation, echo intensity,
+        and percent good data types are not part of label_list and are not
+        decoded, in line with PathfinderEnsemble.parse_beams. They can be 
+        decoded on demand with decode_profiles.
+        """
+        ID_BYTE_LENGTH = 2
+        num_bins  = self.NUM_BINS_EXP
+        num_beams = self.NUM_BEAMS_EXP
+        profile_dtype = np.dtype(('<i2', (num_bins, num_beams)))
+        raw = self.gather(buf, section_starts + ID_BYTE_LENGTH, profile_dtype)
+
+        # filter out bad velocity values
+        bad      = raw == self.BAD_VELOCITY
+        velocity = np.where(bad, np.nan, raw*self.MM_TO_M)
+        vel_start = self.data_lookup[self.get_profile_var_name('velocity',0,0)]
+        data[rows, vel_start:vel_start+self.velocity_len] = \
+            velocity.reshape(len(rows), -1)
+
+        # the number of good bins is the first bin with a bad velocity value
+        bad_bins = bad.any(axis=2)
+        num_good = np.where(bad_bins.any(axis=1), bad_bins.argmax(axis=1), 0)
+        data[rows, self.data_lookup['num_good_vel_bins']] = num_good
+
+
+    def decode_profiles(self, buf, starts, var_type):
+        """Decodes a non-velocity water profiling data type of all ensembles.
+
+        The water profiling format is in the Pathfinder Manual on pg 190.
+        Each value is a single byte per bin and beam:
+
+        Correlation:    [0, 255]
+        Echo Intensity: [0.61 dB per count], converted to [dB]
+        Percent Good:   [0, 100]
+
+        Args:
+            buf: uint8 array holding the pd0 bytes.
+            starts: array of byte offsets of the ensembles.
+            var_type: 'correlation', 'echo_intensity', or 'percent_good'.
+
+        Returns:
+            Array of shape (num_ensembles, num_bins*num_beams) with columns 
+            ordered like get_profile_var_list(var_type). Ensembles without 
+            the data type are NaN.
+        """
+        ID_BYTE_LENGTH = 2
+        if var_type not in ('correlation', 'echo_intensity', 'percent_good'):
+            raise ValueError('bad profile variable type: %s' % (var_type,))
+        starts   = np.asarray(starts, dtype=np.int64)
+        size     = self.NUM_BINS_EXP*self.NUM_BEAMS_EXP
+        profiles = np.full((len(starts), size), np.nan)
+        if len(starts) == 0:
+            return profiles
+
+        # read the data type from each group of ensembles that reports it
+        for rows, addresses in self.group_layouts(buf, starts):
+            for data_id, address in addresses:
+                if self.data_id_names.get(data_id) == var_type:
+                    profiles[rows] = self.gather(
+                        buf, starts[rows] + address + ID_BYTE_LENGTH, 
+                        np.dtype(('u1', (size,))))
+        if var_type == 'echo_intensity':
+            profiles *= self.COUNT_TO_DB
+        return profiles
+
+
+    def decode_bottom_track(self, buf, section_starts, data, rows):
+        """Decodes the bottom track data type for a group of ensembles.
+
+        The pd0 bottom track format is in the Pathfinder Manual on pg 194.
+        """
+        bottom_track = self.gather(buf, section_starts,
+                                   self.dtypes['bottom_track'])
+        self.set_columns(data, rows, bottom_track)
+
+        # convert special values to NaN and the rest to metric quantities
+        def convert_special_to_metric(var, flag, multiplier):
+            col  = self.data_lookup[var]
+            vals = data[rows, col]
+            data[rows, col] = np.where(vals == flag, np.nan, vals*multiplier)
+
+        for beam in range(self.NUM_BEAMS_EXP):
+            convert_special_to_metric('btm_beam%d_velocity' % beam,
+                                      self.BAD_VELOCITY, self.MM_TO_M)
+            convert_special_to_metric('btm_beam%d_range' % beam,
+                                      self.BAD_BT_RANGE, self.CM_TO_M)
+        self.convert_to_metric(data, rows, 'btm_max_error_velocity',
+                               self.MM_TO_M)
+        for beam in range(self.NUM_BEAMS_EXP):
+            self.convert_to_metric(data, rows, 'btm_beam%d_rssi' % beam,
+                                   self.COUNT_TO_DB)
+
+
+    def apply_mounting_bias_rotations(self, data, inverse=False):
+        """Rotates velocity bins and bottom track velocity for mounting bias.
+
+        Same rotation as PathfinderEnsemble.apply_mounting_bias_rotations,
+        applied to all bins of all ensembles with a single einsum.
+
+        Args:
+            data: array of shape (num_ensembles, ensemble_size), updated in 
+                place.
+            inverse: boolean flag for undoing the rotation instead, which 
+                recovers the velocities reported by the instrument.
+        """
+        R = self.get_mounting_bias_rotation(
+                data[:, self.data_lookup['heading']])
+        if inverse:
+            R = R.swapaxes(-1, -2)
+
+        # velocity bins: the error velocity beam is not rotated
+        vel_start = self.data_lookup[self.get_profile_var_name('velocity',0,0)]
+        velocity  = data[:, vel_start:vel_start+self.velocity_len].reshape(
+                        len(data), self.NUM_BINS_EXP, self.NUM_BEAMS_EXP)
+        velocity[:,:,:3] = np.einsum('nij,nbj->nbi', R, velocity[:,:,:3])
+        data[:, vel_start:vel_start+self.velocity_len] = \
+            velocity.reshape(len(data), -1)
+
+        # bottom track velocity
+        btm_cols = [self.data_lookup['btm_beam%d_velocity' % _]
+                    for _ in range(3)]
+        data[:, btm_cols] = np.einsum('nij,nj->ni', R, data[:, btm_cols])
+
+
+    def compute_derived_variables(self, data, prev_row=None):
+        """Computes the derived variables for consecutive ensembles.
+
+        Array version of PathfinderEnsemble.parse_derived_variables, where
+        every ensemble uses the ensemble in the row above it as its previous
+        ensemble. 
+
+        Args:
+            data: array of shape (num_ensembles, ensemble_size), updated in 
+                place.
+            prev_row: row of the ensemble preceding data[0]. If None, the 
+                first row is treated as the start of a dive.
+
+        Raises:
+            ValueError if the DVL is not reporting data in earth coordinates.
+        """
+        EARTH_FRAME = 'Earth Coords'
+        col = lambda var: data[:, self.data_lookup[var]]
+
+        # check that the DVL is reporting data in earth coordinates
+        frame_bits = (col('coordinate_transformation').astype(int) >> 3) & 3
+        if np.any(frame_bits != 3):
+            bits = frame_bits[frame_bits != 3][0]
+            coord_frame = {0b00 : 'Beam Coords',
+                           0b01 : 'Instrument Coords',
+                           0b10 : 'Ship Coords'}[bits]
+            raise ValueError('Bad coord frame: expected = %s, actual = %s' %
+                             (EARTH_FRAME, coord_frame))
+
+        # assume zero angle of attack
+        data[:, self.data_lookup['angle_of_attack']] = 0
+
+        # the first ensemble of a dive only has its origin set
+        if prev_row is None:
+            data[0, self.data_lookup['origin_x']] = 0
+            data[0, self.data_lookup['origin_y']] = 0
+            self.compute_derived_variables_from_prev(data)
+
+        # otherwise continue from the previous ensemble as the first row
+        else:
+            full = np.vstack((prev_row, data))
+            self.compute_derived_variables_from_prev(full)
+            data[:] = full[1:]
+
+
+    def compute_derived_variables_from_prev(self, data):
+        """Computes derived variables of data[1:], given data[0] as the start.
+
+        Positions are integrated starting from the relative position and 
+        origin stored in data[0], which are left unchanged.
+        """
+        col = lambda var: data[:, self.data_lookup[var]]
+        def set_col(var, val):
+            data[1:, self.data_lookup[var]] = val
+        if len(data) < 2:
+            return
+
+        time    = col('time')
+        depth   = col('depth')
+        pitch   = col('pitch')[1:]
+        heading = col('heading')[1:]
+
+        # compute through water velocity from pressure method
+        delta_t          = np.diff(time)
+        delta_z_pressure = np.diff(depth)
+        set_col('delta_t',          delta_t)
+        set_col('delta_z_pressure', delta_z_pressure)
+        set_col('delta_pitch',      np.diff(col('pitch')))
+
+        # horizontal velocity in relative frame, avoiding division by zero
+        valid = (np.abs(pitch) > self.MIN_PITCH) & \
+                (np.abs(delta_z_pressure) > self.EPSILON)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel_vel_w = delta_z_pressure/delta_t
+            rel_vel_h = rel_vel_w / np.tan(-pitch*self.DEG_TO_RAD)
+        set_col('rel_vel_pressure_u', np.where(valid,
+            rel_vel_h*np.sin(heading*self.DEG_TO_RAD), np.nan))
+        set_col('rel_vel_pressure_v', np.where(valid,
+            rel_vel_h*np.cos(heading*self.DEG_TO_RAD), np.nan))
+        set_col('rel_vel_pressure_w', np.where(valid, rel_vel_w, np.nan))
+
+        # select DVL bin for through-water velocity
+        #   + first two bins are less accurate in steady state conditions
+        #   + bins further away are more likely to have random outliers
+        #   + velocities stay zero if no bin is valid
+        rel_vel_dvl = np.zeros((len(data)-1, 3))
+        selected    = np.zeros(len(data)-1, dtype=bool)
+        for bin_num in [2,1,0]:
+            uvw = np.column_stack([
+                col(self.get_profile_var_name('velocity', bin_num, beam))[1:]
+                for beam in range(3)])
+            with np.errstate(invalid='ignore'):
+                good = ~np.isnan(uvw[:,0]) & ~selected & \
+                       (np.linalg.norm(uvw, axis=1) < self.MAX_SPEED)
+            rel_vel_dvl[good] = uvw[good] * np.array([-1,-1,1])
+            selected |= good
+        set_col('rel_vel_dvl_u', rel_vel_dvl[:,0])
+        set_col('rel_vel_dvl_v', rel_vel_dvl[:,1])
+        set_col('rel_vel_dvl_w', rel_vel_dvl[:,2])
+
+        # set bottom-track velocities (even if NaN)
+        abs_vel_btm = np.column_stack((-col('btm_beam0_velocity')[1:],
+                                       -col('btm_beam1_velocity')[1:],
+                                        col('btm_beam2_velocity')[1:]))
+        set_col('abs_vel_btm_u', abs_vel_btm[:,0])
+        set_col('abs_vel_btm_v', abs_vel_btm[:,1])
+        set_col('abs_vel_btm_w', abs_vel_btm[:,2])
+
+        # update relative position using bottom track velocity or DVL velocity
+        valid_btm = ~np.isnan(col('btm_beam0_velocity')[1:])
+        velocity  = np.where(valid_btm[:,None], abs_vel_btm, rel_vel_dvl)
+        delta     = delta_t[:,None]*velocity
+        set_col('delta_x', delta[:,0])
+        set_col('delta_y', delta[:,1])
+        set_col('delta_z', delta[:,2])
+        def integrate(var, deltas):
+            return np.cumsum(np.concatenate(([data[0,self.data_lookup[var]]],
+                                             deltas)))
+        rel_pos_x = integrate('rel_pos_x_dvl_dr', delta[:,0])
+        rel_pos_y = integrate('rel_pos_y_dvl_dr', delta[:,1])
+        rel_pos_z = integrate('rel_pos_z_dvl_dr', delta_z_pressure)
+        set_col('rel_pos_x_dvl_dr', rel_pos_x[1:])
+        set_col('rel_pos_y_dvl_dr', rel_pos_y[1:])
+        set_col('rel_pos_z_dvl_dr', rel_pos_z[1:])
+
+        # origin is carried over from the previous ensemble
+        #   + PathfinderEnsemble copies the previous relative y position into
+        #     origin_y, which is reproduced here to keep the outputs identical
+        set_col('origin_x', data[0, self.data_lookup['origin_x']])
+        set_col('origin_y', rel_pos_y[:-1])
+
+        # compute three factors of bathymetry: depth, slope, and orient
+        depth_factor, slope_factor, orient_factor = self.get_bathy_factors(
+            *[col('btm_beam%d_range' % _)[1:] for _ in range(4)],
+            depth[1:], pitch, col('roll')[1:], heading)
+        set_col('bathy_factor_depth',  depth_factor)
+        set_col('bathy_factor_slope',  slope_factor)
+        set_col('bathy_factor_orient', orient_factor)
+
+
+    def get_bathy_factors(self, range0, range1, range2, range3, depth, pitch,
+        roll, heading):
+        """Computes three factors of bathymetry: depth, slope, & orientation.
+
+        Array version of PathfinderEnsemble.get_bathy_factors. Beams without
+        a valid range contribute an all-zero row to the least squares problem,
+        which leaves the fit of the remaining beams unchanged.
+        """
+        MIN_VALID_SLANT_RANGES = 3
+        sin_janus = np.sin(self.JANUS_ANGLE*self.DEG_TO_RAD)
+        cos_janus = np.cos(self.JANUS_ANGLE*self.DEG_TO_RAD)
+        slant = np.column_stack((range0, range1, range2, range3)) / cos_janus
+        valid = ~np.isnan(slant)
+        slant = np.where(valid, slant, 0)
+
+        # bottom contact positions in instrument coordinate frame
+        z = slant*cos_janus
+        h = slant*sin_janus
+        inst = np.zeros(slant.shape + (3,))
+        inst[:,0,0] = -h[:,0]
+        inst[:,1,0] =  h[:,1]
+        inst[:,2,1] =  h[:,2]
+        inst[:,3,1] = -h[:,3]
+        inst[:,:,2] = -z
+
+        # rotate instrument coordinates into the world frame using Euler angles
+        R = self.Qz((heading + self.BIAS_HEADING) * self.DEG_TO_RAD) @ \
+            self.Qy((roll    + self.BIAS_ROLL)    * self.DEG_TO_RAD) @ \
+            self.Qx((pitch   + self.BIAS_PITCH)   * self.DEG_TO_RAD)
+        earth = np.einsum('nij,nkj->nki', R, inst)
+
+        # least squares planar fit z = ax + by + c for each ensemble
+        A = np.concatenate((earth[:,:,:2], np.ones(slant.shape + (1,))),
+                           axis=2) * valid[:,:,None]
+        b = earth[:,:,2] * valid
+        fit = np.einsum('nij,nj->ni', np.linalg.pinv(A), b)
+        a, b, c = fit[:,0], fit[:,1], fit[:,2]
+
+        enough = valid.sum(axis=1) >= MIN_VALID_SLANT_RANGES
+        bathy_depth  = np.where(enough, depth - c, np.nan)
+        bathy_slope  = np.where(enough,
+            np.arctan((a**2 + b**2)**0.5)*self.RAD_TO_DEG, np.nan)
+        bathy_orient = np.where(enough,
+            np.arctan2(-a, -b)*self.RAD_TO_DEG, np.nan)
+        return bathy_depth, bathy_slope, bathy_orient
@@ -17,7 +17,37 @@ from PathfinderChecksumError import PathfinderChecksumError
 
 
 class PathfinderEnsemble(PathfinderDVL):
-    def __init__(self, pd0_bytes, prev_ensemble=None, gps_fix=None):
+    # ensembles only store the data array and parsing information, so that 
+    # many ensembles can be kept in memory without a dictionary per ensemble
+    #   + each variable of the data array is available as a read-only 
+    #     attribute (i.e. ensemble.pitch), see the accessors generated below 
+    __slots__ = (
+        '_data_array',
+        '_prev_ensemble',
+        '_gps_fix',
+        '_address_offsets',
+        '_var_byte_sizes',
+        '_mounting_rotation',
+        'header_id',
+        'header_data_source',
+        'num_data_types',
+        'num_bytes',
+        'var_byte_sizes_expected',
+    )
+
+    # map from byte id to the name of the data type and its parsing function 
+    _data_id_parsers = {
+        0x0000: ('fixed_leader',    'parse_fixed_leader'),
+        0x0080: ('variable_leader', 'parse_variable_leader'),
+        0x0100: ('velocity',        'parse_water_profiling_data'),
+        0x0200: ('correlation',     'parse_water_profiling_data'),
+        0x0300: ('echo_intensity',  'parse_water_profiling_data'),
+        0x0400: ('percent_good',    'parse_water_profiling_data'),
+        0x0600: ('bottom_track',    'parse_bottom_track'),
+    }
+
+    def __init__(self, pd0_bytes, prev_ensemble=None, gps_fix=None, 
+        data_array=None):
         """Constructor for a Doppler Velocity Log (DVL) Ensemble object. 
 
         The 'Pathfinder Doppler Velocity Log (DVL) 600 kHz' user manual was 
@@ -33,13 +63,20 @@ class PathfinderEnsemble(PathfinderDVL):
         (https://docs.python.org/3/library/struct.html)
 
         Args: 
-            pd0_bytes: pd0 bytes to be parsed into a DVL ensemble.
+            pd0_bytes: pd0 bytes to be parsed into a DVL ensemble. Any buffer 
+                that starts at the ensemble header is accepted, such as a 
+                memoryview into a memory-mapped file, and bytes past the end 
+                of the ensemble are ignored. The buffer is not copied.
             prev_ensemble: previously collected PathfinderEnsemble. The 
                 previous ensemble is used for deducing Pathfinder 
             gps_fix: (x,y) GPS location, used to update the position of the  
                 relative frame. As a result, every dive (both start of mission
                 and every subsequent surfacing) will have a different relative
                 frame of reference.
+            data_array: optional array of length ensemble_size to store the 
+                parsed variables in, for example a row of a preallocated 2D 
+                array holding many ensembles. The ensemble is then only a 
+                view into that row. By default a new array is allocated.
 
         Returns:
             A new Ensemble that has been parsed from the given pd0 bytes, or 
@@ -53,22 +90,20 @@ class PathfinderEnsemble(PathfinderDVL):
         super().__init__()
 
         # initialize Micron Ensemble data array based on number of variables
-        self._data_array = np.zeros(self.ensemble_size)
+        if data_array is None:
+            self._data_array = np.zeros(self.ensemble_size)
+        else:
+            if data_array.shape != (self.ensemble_size,):
+                raise ValueError('bad data array shape: expected = %s, '
+                                 'actual = %s' % ((self.ensemble_size,), 
+                                                  data_array.shape))
+            data_array[:]    = 0
+            self._data_array = data_array
 
         # store the previous ensemble and GPS fix information
         self._prev_ensemble = prev_ensemble
         self._gps_fix = gps_fix
-
-        # map from byte id to parsing function 
-        self._data_id_parsers = {
-            0x0000: ('fixed_leader',    self.parse_fixed_leader),
-            0x0080: ('variable_leader', self.parse_variable_leader),
-            0x0100: ('velocity',        self.parse_water_profiling_data),
-            0x0200: ('correlation',     self.parse_water_profiling_data),
-            0x0300: ('echo_intensity',  self.parse_water_profiling_data),
-            0x0400: ('percent_good',    self.parse_water_profiling_data),
-            0x0600: ('bottom_track',    self.parse_bottom_track),
-        }
+        self._mounting_rotation = None
 
         # parse array given pd0 bytes
         self.parse_ensemble(pd0_bytes)
@@ -111,12 +146,11 @@ class PathfinderEnsemble(PathfinderDVL):
             return self.data_array[self.data_lookup[var]]
 
 
-    def set_data(self, var, val, attribute=True):
+    def set_data(self, var, val):
         """Setter method for a variable-value pair to be put in the array"""
         if (var not in self.label_set):
             raise ValueError("bad variable for: set(%s, %s)" % (var, str(val)))
         self._data_array[self.data_lookup[var]] = val 
-        if attribute: setattr(self, var, val)    
 
 
     def parse_ensemble(self, pd0_bytes):
@@ -147,7 +181,7 @@ class PathfinderEnsemble(PathfinderDVL):
             header_id = struct.unpack_from(HEADER_ID, pd0_bytes, address)[0]
             if header_id in self.data_id_parsers:
                 name      = self.data_id_parsers[header_id][0]
-                parser    = self.data_id_parsers[header_id][1]
+                parser    = getattr(self, self.data_id_parsers[header_id][1])
                 data_dict = parser(pd0_bytes, name, address)
             else:
                 print('  WARNING: no parser found for header %d' %(header_id,))
@@ -156,14 +190,14 @@ class PathfinderEnsemble(PathfinderDVL):
         self.parse_derived_variables()
 
 
-    def unpack_bytes(self, pd0_bytes, format_tuples, offset=0):
+    def unpack_bytes(self, pd0_bytes, codec, offset=0):
         """Unpacks pd0 bytes into data format types.
 
         Args:
             pd0_bytes: bytes to be parsed into specified data types.
-            format_tuples: tuple of variable format tuples,
-                where each variable format tuple is of the form:
-                (name <string>, format-string <char>, offset <int>).
+            codec: (struct, names) tuple for the data type, compiled from the 
+                variable format tuples by PathfinderDVL.compile_format. The 
+                struct unpacks every variable of the data type in one call.
             offset: byte offset to start reading the pd0 bytes.
 
         Returns:
@@ -186,16 +220,8 @@ class PathfinderEnsemble(PathfinderDVL):
             Q       unsigned long long  8 
         (taken from: https://docs.python.org/3/library/struct.html)
         """
-        data = {}
-        for format_tuple in format_tuples:
-            var_name        = format_tuple[0]
-            var_format      = format_tuple[1]
-            var_size        = struct.calcsize(var_format)
-            var_offset      = offset + format_tuple[2]
-            data[var_name]  = struct.unpack_from(var_format,
-                                                 pd0_bytes,
-                                                 var_offset)[0]
-        return(data)
+        var_struct, var_names = codec
+        return(dict(zip(var_names, var_struct.unpack_from(pd0_bytes, offset))))
 
 
     def parse_header(self, pd0_bytes):
@@ -216,7 +242,7 @@ class PathfinderEnsemble(PathfinderDVL):
         ADDRESS_FORMAT = '<H'    # format string of the header addresses
 
         # unpack the header bytes from the byte array
-        header_dict = self.unpack_bytes(pd0_bytes, self.header_format)
+        header_dict = self.unpack_bytes(pd0_bytes, self.header_codec)
 
         # check that header has the correct ID
         if (header_dict['id']          != HEADER_FLAG or 
@@ -232,16 +258,11 @@ class PathfinderEnsemble(PathfinderDVL):
         self.num_data_types     = header_dict['num_data_types']
         self.num_bytes          = header_dict['num_bytes']
 
-        # parse the address offsets given 
-        address_size    = struct.calcsize(ADDRESS_FORMAT)
-        address_end     = HEADER_BYTES + self.num_data_types*address_size
-        address_offsets = []
-
-        # parse the address offset for each data type 
-        for start in range(HEADER_BYTES, address_end, address_size):
-            address = struct.unpack_from(ADDRESS_FORMAT, pd0_bytes, start)[0]
-            address_offsets.append(address)
-        self._address_offsets = address_offsets
+        # parse the address offset for each data type in a single call
+        address_format  = '<%d%s' % (self.num_data_types, ADDRESS_FORMAT[1:])
+        address_offsets = struct.unpack_from(address_format, pd0_bytes, 
+                                             HEADER_BYTES)
+        self._address_offsets = list(address_offsets)
 
         # determine the byte sizes of each variable type
         sizes = self.address_offsets.copy()
@@ -263,7 +284,7 @@ class PathfinderEnsemble(PathfinderDVL):
             offset: byte offset to start parsing the fixed leader. 
         """
         fixed_leader = self.unpack_bytes(pd0_bytes,
-                                         self.fixed_leader_format,
+                                         self.fixed_leader_codec,
                                          offset)
 
         # add relevant fixed leader values to the data array
@@ -296,14 +317,16 @@ class PathfinderEnsemble(PathfinderDVL):
         # compute expected sizes of each data type for diagnostic purposes
         #   + according to the Pathfinder manual pg 171
         #   + compare this against self.var_byte_sizes
+        num_bins  = int(self.num_bins)
+        num_beams = int(self.num_beams)
         self.var_byte_sizes_expected = [
             6 + 2*self.num_data_types,          # header
             58,                                 # fixed leader
             77,                                 # variable leader
-            2+2*self.num_beams*self.num_bins,   # velocity 
-            2 + self.num_beams*self.num_bins,   # correlation
-            2 + self.num_beams*self.num_bins,   # echo intensity
-            2 + self.num_beams*self.num_bins,   # percent good,
+            2 + 2*num_beams*num_bins,           # velocity 
+            2 + num_beams*num_bins,             # correlation
+            2 + num_beams*num_bins,             # echo intensity
+            2 + num_beams*num_bins,             # percent good,
             81                                  # bottom track
         ]            
 
@@ -322,7 +345,7 @@ class PathfinderEnsemble(PathfinderDVL):
         # assumes data collected in the 2000's (not recorded by DVL)
         RTC_MILLENIUM = 2000 
         variable_leader = self.unpack_bytes(pd0_bytes, 
-                                            self.variable_leader_format, 
+                                            self.variable_leader_codec, 
                                             offset)
         
         # add relevant variable leader values to the data array
@@ -380,8 +403,9 @@ class PathfinderEnsemble(PathfinderDVL):
         if name == 'velocity': profiling_format = '<h'
         else:                  profiling_format = 'B'
         offset  += ID_BYTE_LENGTH
-        profile  = self.parse_beams(pd0_bytes, offset, self.num_bins,
-                                    self.num_beams, profiling_format, name)
+        profile  = self.parse_beams(pd0_bytes, offset, int(self.num_bins),
+                                    int(self.num_beams), profiling_format, 
+                                    name)
 
 
     def parse_bottom_track(self, pd0_bytes, name, offset):
@@ -400,7 +424,7 @@ class PathfinderEnsemble(PathfinderDVL):
         label_v = 'btm_beam1_velocity'
         label_w = 'btm_beam2_velocity'
         bottom_track = self.unpack_bytes(pd0_bytes,
-                                         self.bottom_track_format,
+                                         self.bottom_track_codec,
                                          offset)
 
         # add relevant bottom track values to the data array
@@ -453,9 +477,6 @@ class PathfinderEnsemble(PathfinderDVL):
         """
         # check that the DVL is reporting data in earth coordinates
         EARTH_FRAME = 'Earth Coords'
-        MIN_PITCH   = 0.001
-        EPSILON     = 0.001
-        MAX_SPEED   = 1.3 
 
         coordinate_frame = self.parse_coordinate_transformation(verbose=False)
         if coordinate_frame != EARTH_FRAME:
@@ -534,8 +555,8 @@ class PathfinderEnsemble(PathfinderDVL):
 
         # computer horizontal velocity in relative frame 
         #   + avoid division by zero
-        if (np.abs(self.pitch) > MIN_PITCH) and \
-            (np.abs(self.get_data('delta_z_pressure')) > EPSILON):
+        if (np.abs(self.pitch) > self.MIN_PITCH) and \
+            (np.abs(self.get_data('delta_z_pressure')) > self.EPSILON):
             
             # through water velocity from change in pressure and compass
             self.set_data('rel_vel_pressure_w', 
@@ -560,7 +581,7 @@ class PathfinderEnsemble(PathfinderDVL):
         #   + first two bins are less accurate in steady state conditions
         #   + bins further away are more likely to have random outliers
         for i in [2,1,0]:
-            if valid_bin_num(i) and self.get_speed(i) < MAX_SPEED:
+            if valid_bin_num(i) and self.get_speed(i) < self.MAX_SPEED:
                 set_dvl_rel_velocities(i)
                 break           
 
@@ -588,30 +609,6 @@ class PathfinderEnsemble(PathfinderDVL):
         self.get_bathy_factors()
 
 
-    def Qx(self, phi):
-        """Orthogonal rotation matrix about x-axis by angle phi
-        """
-        return(np.array([[           1,            0,            0],
-                         [           0,  np.cos(phi), -np.sin(phi)],
-                         [           0,  np.sin(phi),  np.cos(phi)]]))
-
-
-    def Qy(self, phi):
-        """Orthogonal rotation matrix about y-axis by angle phi
-        """
-        return(np.array([[ np.cos(phi),            0,  np.sin(phi)],
-                         [           0,            1,            0],
-                         [-np.sin(phi),            0,  np.cos(phi)]]))
-
-
-    def Qz(self, phi):
-        """Orthogonal rotation matrix about z-axis by angle phi
-        """
-        return(np.array([[ np.cos(phi), -np.sin(phi),            0],
-                         [ np.sin(phi),  np.cos(phi),            0],
-                         [           0,            0,            1]]))
-
-
     def get_speed(self, bin_num):
         """Returns the magnitude of velocity given a bin number
 
@@ -625,45 +622,45 @@ class PathfinderEnsemble(PathfinderDVL):
         return(np.linalg.norm([u,v,w]))
 
 
-    def convert_to_metric(self, variable, multiplier, attribute=True):
+    def convert_to_metric(self, variable, multiplier):
         """Converts variable to standard metric value using the multiplier"""
         value = self.get_data(variable) 
-        self.set_data(variable, value * multiplier, attribute)
+        self.set_data(variable, value * multiplier)
         
 
     def validate_checksum(self, pd0_bytes):
         """Validates the checksum for the ensemble.
+
+        The checksum is the sum of the ensemble bytes (excluding the checksum
+        itself) modulo 65536. The bytes are summed by NumPy without copying.
         """
-        calc_checksum  = sum([c for c in pd0_bytes[:self.num_bytes]]) & 0xFFFF
+        ensemble_bytes = np.frombuffer(pd0_bytes, dtype=np.uint8, 
+                                       count=self.num_bytes)
+        calc_checksum  = int(ensemble_bytes.sum()) & 0xFFFF
         given_checksum = struct.unpack_from('<H', pd0_bytes, self.num_bytes)[0]
         if calc_checksum != given_checksum:
             raise PathfinderChecksumError(calc_checksum, given_checksum)
 
 
     def apply_mounting_bias_rotations(self, velocity0):
-        """Rotates velocity vector to account for mounting bias.
+        """Rotates velocity vectors to account for mounting bias.
 
-        Assumes that velocity data is in Earth Coordinate frame.
+        Assumes that velocity data is in Earth Coordinate frame. The rotation
+        matrix only depends on the heading, so it is computed once for the 
+        ensemble and applied to the velocity of every bin in a single product.
 
         Args:
-            velocity0: (u0,v0,w0) velocity vector recorded by instrument.
+            velocity0: (u0,v0,w0) velocity vector recorded by instrument, or
+                an array of shape (num_bins,3) with one vector per bin.
 
-        Returns: (u,v,w) velocity vector in desired coordinate frame.
+        Returns: velocity vector(s) in desired coordinate frame, with the 
+            same shape as velocity0.
         """
-        u0,v0,w0     = velocity0
-        V_earth0     = np.array([[u0],[v0],[w0]])
-
-        # rotate from Earth Coords <E,N,U> to Ship Coords <S,F,U>
-        heading           =  self.heading*self.DEG_TO_RAD
-        heading_bias      = (self.heading-self.BIAS_HEADING)*self.DEG_TO_RAD
-        pitch_bias        =  self.BIAS_PITCH*self.DEG_TO_RAD        
-        roll_bias         =  self.BIAS_ROLL*self.DEG_TO_RAD
-        V_ship            = np.dot(self.Qz( heading),      V_earth0)
-        V_ship_pitch      = np.dot(self.Qx( pitch_bias),   V_ship)
-        V_ship_pitch_roll = np.dot(self.Qy( roll_bias),    V_ship_pitch)
-        V_earth           = np.dot(self.Qz(-heading_bias), V_ship_pitch_roll)
-        u,v,w             = V_earth.flatten()
-        return(u,v,w)
+        if self._mounting_rotation is None:
+            self._mounting_rotation = \
+                self.get_mounting_bias_rotation(self.heading)
+        return np.dot(np.asarray(velocity0, dtype=float), 
+                      self._mounting_rotation.T)
 
 
     def get_bathy_factors(self):
@@ -744,54 +741,30 @@ class PathfinderEnsemble(PathfinderDVL):
         # assumes that last beam is an error velocity, meaning velocity is not
         # reported in beam coordinates 
         ERROR_BEAM_NUM = 3
-        beam_u = 0
-        beam_v = 1
-        beam_w = 2
-        var_size  = struct.calcsize(var_format)
-        velocity0 = []
-        num_good_vel_bins_flag = False
 
         # only parse velocity water profile data to save processing time
-        if var_name == 'velocity':
-
-            # parse data for each depth cell 
-            for bin_num in range(num_bins):
-                bin_start = offset + bin_num*num_beams*var_size
-
-                # parse data for each beam for a given depth cell 
-                velocity0  = []
-                for beam_num in range(num_beams):
-                    beam_start = bin_start + beam_num*var_size
-                    data_val   = struct.unpack_from(var_format, 
-                                                    pd0_bytes, 
-                                                    beam_start)[0]
-
-                    # compute labels and array index 
-                    label = self.get_profile_var_name(var_name, 
-                                                      bin_num, 
-                                                      beam_num)
-
-                    # filter out bad velocity values 
-                    if (var_name == 'velocity'):
-                        if (data_val == self.BAD_VELOCITY):
-                            self.set_data(label, np.NaN)
-                            if not num_good_vel_bins_flag:
-                                self.set_data('num_good_vel_bins', bin_num)
-                                num_good_vel_bins_flag = True
-                        elif (beam_num != ERROR_BEAM_NUM):
-                            velocity0.append(data_val*self.MM_TO_M)
-                        else: 
-                            self.set_data(label, data_val*self.MM_TO_M)
-
-                # rotate velocity vector to account for pitch bias
-                if velocity0:
-                    u,v,w  = self.apply_mounting_bias_rotations(velocity0)
-                    xlabel = self.get_profile_var_name(var_name,bin_num,beam_u)
-                    ylabel = self.get_profile_var_name(var_name,bin_num,beam_v)
-                    zlabel = self.get_profile_var_name(var_name,bin_num,beam_w)
-                    self.set_data(xlabel, u)
-                    self.set_data(ylabel, v)
-                    self.set_data(zlabel, w)
+        if var_name != 'velocity':
+            return
+
+        # parse data for all depth cells and beams at once 
+        velocity0 = np.frombuffer(pd0_bytes, dtype=var_format, 
+                                  count=num_bins*num_beams, 
+                                  offset=offset).reshape(num_bins, num_beams)
+
+        # filter out bad velocity values 
+        bad_velocity = (velocity0 == self.BAD_VELOCITY)
+        velocity     = np.where(bad_velocity, np.NaN, velocity0*self.MM_TO_M)
+        bad_bins     = bad_velocity.any(axis=1)
+        if bad_bins.any():
+            self.set_data('num_good_vel_bins', int(bad_bins.argmax()))
+
+        # rotate velocity vectors to account for pitch bias
+        velocity[:,:ERROR_BEAM_NUM] = \
+            self.apply_mounting_bias_rotations(velocity[:,:ERROR_BEAM_NUM])
+
+        # velocity labels are stored bin by bin in the data array
+        start = self.data_lookup[self.get_profile_var_name(var_name, 0, 0)]
+        self._data_array[start:start+num_bins*num_beams] = velocity.ravel()
 
 
     def parse_system_configuration(self, verbose=True):
@@ -800,7 +773,7 @@ class PathfinderEnsemble(PathfinderDVL):
         Requires that system_configuration is in base 10 number format.
         """
         # convert base-10 to binary string
-        sys_str       = bin(self.system_configuration)[2:][::-1]
+        sys_str       = bin(int(self.system_configuration))[2:][::-1]
         lagging_zeros = 16 - len(sys_str)
         sys_str      += '0'*lagging_zeros
 
@@ -872,7 +845,7 @@ class PathfinderEnsemble(PathfinderDVL):
         Requires that coordinate_transformation is in base 10 number format.
         """
         # convert base-10 number to binary string 
-        ctf_str = bin(self.coordinate_transformation)[2:][::-1]
+        ctf_str = bin(int(self.coordinate_transformation))[2:][::-1]
         lagging_zeros = 8 - len(ctf_str)
         ctf_str += '0'*lagging_zeros
 
@@ -912,3 +885,15 @@ class PathfinderEnsemble(PathfinderDVL):
 
         return coord_frame_set
 
+
+def get_data_accessor(var, index):
+    """Returns a read-only property for a variable of the data array."""
+    def getter(self):
+        return self._data_array[index]
+    return property(getter, doc="'%s' variable of the data array" % (var,))
+
+
+# generate the named accessors once, from the shared data lookup table
+for var, index in PathfinderEnsemble._data_lookup.items():
+    setattr(PathfinderEnsemble, var, get_data_accessor(var, index))
+del var, index
@@ -0,0 +1,275 @@
+# PathfinderStream.py
+#
+# Reads Pathfinder DVL ensembles from a live pd0 byte stream (i.e. a serial
+# port, a TCP socket or a pipe) with asyncio. The bytes arrive in arbitrary
+# chunks, so ensembles are framed across chunk boundaries, damaged bytes are
+# skipped like the resync mode of PathfinderBatchDecoder, and every parsed
+# ensemble is handed to the queues of the subscribers without waiting on them.
+
+import asyncio
+import numpy as np
+import os
+import struct
+from PathfinderChecksumError import PathfinderChecksumError
+from PathfinderEnsemble import PathfinderEnsemble
+
+
+class PathfinderStream(object):
+    # constants of the pd0 ensemble framing
+    HEADER       = b'\x7f\x7f'
+    HEADER_BYTES = 6
+    CHECKSUM_LEN = 2
+
+    # an ensemble with every data type and 40 bins of 4 beams is ~1 kB, so
+    # headers reporting more bytes are treated as damaged rather than waited
+    # for, which would hold back the ensembles that follow
+    MAX_ENSEMBLE_BYTES = 4096
+
+    # number of bytes requested from the stream at a time
+    READ_SIZE  = 1 << 16
+
+    # default number of ensembles queued for each subscriber
+    QUEUE_SIZE = 256
+
+    def __init__(self, max_ensemble_bytes=MAX_ENSEMBLE_BYTES):
+        """Frames and parses pd0 ensembles from a live byte stream.
+
+        Bytes are appended to a buffer with feed (or read from a stream with
+        read), and every complete ensemble with a valid checksum is parsed
+        into a PathfinderEnsemble, with the previous ensemble of the stream,
+        and put in the queue of every subscriber. Bytes that are not part of
+        a valid ensemble are skipped, and parsing continues from the next
+        7F7F header, so serial dropouts only cost the damaged ensembles.
+
+        Dispatching never waits on a subscriber: when a queue is full, its
+        oldest ensemble is dropped to make room for the newest one. When the
+        stream ends, None is put in every queue.
+
+        Args:
+            max_ensemble_bytes: largest number of bytes of a valid ensemble.
+        """
+        self._max_ensemble_bytes = max_ensemble_bytes
+        self._buffer             = bytearray()
+        self._prev_ensemble      = None
+        self._subscribers        = []
+        self._stats              = {
+            'num_ensembles'     : 0,
+            'num_skipped_bytes' : 0,
+            'num_bad_checksums' : 0,
+            'num_parse_errors'  : 0,
+            'num_dropped'       : 0,
+        }
+
+
+    @property
+    def max_ensemble_bytes(self):
+        return self._max_ensemble_bytes
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    @property
+    def stats(self):
+        return self._stats
+
+
+    def subscribe(self, maxsize=QUEUE_SIZE):
+        """Returns a new asyncio.Queue that receives the parsed ensembles.
+
+        Args:
+            maxsize: number of ensembles kept in the queue before the oldest
+                ones are dropped.
+        """
+        queue = asyncio.Queue(maxsize)
+        self._subscribers.append(queue)
+        return queue
+
+
+    def unsubscribe(self, queue):
+        """Stops putting ensembles in the queue of a subscriber."""
+        self._subscribers.remove(queue)
+
+
+    def frame(self, data):
+        """Appends bytes to the buffer and returns the complete ensembles.
+
+        An ensemble starts with the 7F7F header followed by its number of
+        bytes, and ends with a checksum. Ensembles that have not been fully
+        received yet (including a header split over two chunks) are kept in
+        the buffer until the next call. Candidate headers with a bad length
+        or checksum are skipped one byte at a time.
+
+        Args:
+            data: the next bytes of the stream.
+
+        Returns:
+            list of the bytes of every complete ensemble with a valid
+            checksum, including the checksum.
+        """
+        buf    = self._buffer
+        stats  = self._stats
+        frames = []
+        pos    = 0
+        buf   += data
+        while True:
+            start = buf.find(self.HEADER, pos)
+
+            # keep a trailing 7F, which can be the first byte of a header
+            if start < 0:
+                start = len(buf) - 1 if buf.endswith(self.HEADER[:1]) \
+                        else len(buf)
+                stats['num_skipped_bytes'] += max(0, start - pos)
+                pos = max(pos, start)
+                break
+            stats['num_skipped_bytes'] += start - pos
+            pos = start
+
+            # wait for the number of bytes and for the rest of the ensemble
+            if len(buf) < start + 4:
+                break
+            num_bytes = struct.unpack_from('<H', buf, start + 2)[0]
+            if not self.HEADER_BYTES <= num_bytes <= self.max_ensemble_bytes:
+                stats['num_skipped_bytes'] += 1
+                pos = start + 1
+                continue
+            end = start + num_bytes + self.CHECKSUM_LEN
+            if len(buf) < end:
+                break
+
+            # the checksum is the sum of the ensemble bytes modulo 65536
+            #   + checked here even though PathfinderEnsemble checks it again,
+            #     since a 7F7F inside the data of an ensemble is only told
+            #     apart from a header by its checksum, and a false header
+            #     must not consume the num_bytes after it
+            #   + the sum costs ~5 us per ensemble, ~2% of parsing it
+            ensemble = bytes(buf[start:end])
+            calc     = int(np.frombuffer(ensemble, dtype=np.uint8,
+                                         count=num_bytes).sum()) & 0xFFFF
+            given    = struct.unpack_from('<H', ensemble, num_bytes)[0]
+            if calc != given:
+                stats['num_bad_checksums'] += 1
+                stats['num_skipped_bytes'] += 1
+                pos = start + 1
+                continue
+            frames.append(ensemble)
+            pos = end
+
+        # drop the consumed bytes once per chunk
+        del buf[:pos]
+        return frames
+
+
+    def dispatch(self, ensemble_bytes):
+        """Parses an ensemble and puts it in the queue of every subscriber.
+
+        Returns:
+            the PathfinderEnsemble, or None if it could not be parsed.
+        """
+        try:
+            ensemble = PathfinderEnsemble(ensemble_bytes, self._prev_ensemble)
+        except (ValueError, PathfinderChecksumError, struct.error):
+            self._stats['num_parse_errors'] += 1
+            return None
+
+        # the previous ensemble is only needed while parsing, see
+        # PathfinderTimeSeries.iter_ensembles
+        if self._prev_ensemble is not None:
+            self._prev_ensemble._prev_ensemble = None
+        self._prev_ensemble = ensemble
+        self._stats['num_ensembles'] += 1
+        self.put(ensemble)
+        return ensemble
+
+
+    def put(self, item):
+        """Puts an item in every queue, dropping the oldest item if full."""
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self._stats['num_dropped'] += 1
+            queue.put_nowait(item)
+
+
+    def feed(self, data):
+        """Frames, parses and dispatches the ensembles of the next bytes.
+
+        Returns:
+            the number of ensembles dispatched.
+        """
+        ensembles = [self.dispatch(_) for _ in self.frame(data)]
+        return sum(_ is not None for _ in ensembles)
+
+
+    def close(self):
+        """Ends the stream, putting None in the queue of every subscriber.
+        Bytes of an incomplete ensemble left in the buffer are skipped."""
+        self._stats['num_skipped_bytes'] += len(self._buffer)
+        self._buffer.clear()
+        self._prev_ensemble = None
+        self.put(None)
+
+
+    async def read(self, reader):
+        """Reads ensembles from an asyncio.StreamReader until the end of the
+        stream, and then closes the stream."""
+        try:
+            while True:
+                data = await reader.read(self.READ_SIZE)
+                if not data:
+                    break
+                self.feed(data)
+        finally:
+            self.close()
+
+
+    async def read_tcp(self, host, port):
+        """Reads ensembles from a TCP connection, i.e. to a serial server."""
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            await self.read(reader)
+        finally:
+            writer.close()
+
+
+    async def read_device(self, device):
+        """Reads ensembles from a serial port, pseudo-terminal or pipe.
+
+        Terminals are put in raw mode while reading, so that the pd0 bytes
+        are not changed by the line discipline, and their settings are
+        restored afterwards. Other settings of a serial port (i.e. the baud
+        rate) are kept, and can be set beforehand with stty. The device is
+        closed when reading ends, and a device opened from its path is also
+        closed when reading fails to start.
+
+        Args:
+            device: path of the device, or a binary file object of it.
+        """
+        opened = isinstance(device, str)
+        if opened:
+            device = open(device, 'rb', buffering=0)
+        fd        = device.fileno()
+        attrs     = None
+        transport = None
+        try:
+            # the tty and termios modules are only available on Unix
+            if os.isatty(fd):
+                import termios
+                import tty
+                attrs = termios.tcgetattr(fd)
+                tty.setraw(fd)
+            loop     = asyncio.get_running_loop()
+            reader   = asyncio.StreamReader(limit=self.READ_SIZE)
+            protocol = asyncio.StreamReaderProtocol(reader)
+            transport, _ = await loop.connect_read_pipe(lambda: protocol,
+                                                        device)
+            await self.read(reader)
+        finally:
+            # restore the terminal settings while the device is still open,
+            # the transport closes it after the loop's next iteration
+            if attrs is not None:
+                termios.tcsetattr(fd, termios.TCSADRAIN, attrs)
+            if transport is not None:
+                transport.close()
+            elif opened:
+                device.close()
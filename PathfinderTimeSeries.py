@@ -5,18 +5,39 @@
 #   2020-05-05  zduguid@mit.edu         reorganized code with DVL superclass 
 
 import csv
+import mmap
 import numpy as np 
+import os
 import pandas as pd
 import struct
 import sys
 import time
+import parse_cache
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from PathfinderDVL import PathfinderDVL
 from PathfinderEnsemble import PathfinderEnsemble
+from PathfinderBatchDecoder import PathfinderBatchDecoder
 from PathfinderChecksumError import PathfinderChecksumError
+from TimeSeriesBuffer import TimeSeriesBuffer
 
 
 class PathfinderTimeSeries(PathfinderDVL):
+    # version of the parsed output, used to invalidate cached time series
+    #   + increment whenever a change to the parser changes the parsed values
+    PARSER_VERSION = 1
+
+    # time zone of the DataFrame index (i.e. 'UTC')
+    #   + None keeps naive local times, as given by datetime.fromtimestamp
+    TIME_ZONE = None
+
+    # PathfinderDVL constants that the parsed values depend on, which are part
+    # of the key of cached time series
+    #   + i.e. changing the mounting bias angles misses the cache
+    CACHE_PARAMETERS = ('BIAS_PITCH', 'BIAS_ROLL', 'BIAS_HEADING', 
+                        'JANUS_ANGLE', 'MAX_SPEED', 'MIN_PITCH', 'EPSILON')
+
     def __init__(self, name=datetime.now().strftime("%Y-%m-%d %H:%M:%S")):
         """Constructor of a Pathfinder DVL time series of ensembles.
 
@@ -41,9 +62,15 @@ class PathfinderTimeSeries(PathfinderDVL):
         super().__init__()
 
         # initialize the DataFrame and ensemble list parameters 
-        self._name          = name
-        self._df            = None
-        self._ensemble_list = []
+        self._name           = name
+        self._df             = None
+        self._ensemble_list  = []
+        self._buffer         = None
+        self._resync_stats   = {}
+        self._sources        = []
+        self._source_lengths = []
+        self._source_order   = None
+        self._profiles       = {}
 
 
     @property
@@ -58,6 +85,29 @@ class PathfinderTimeSeries(PathfinderDVL):
     def df(self):
         return self._df
 
+    @property
+    def resync_stats(self):
+        return self._resync_stats
+
+    @property
+    def sources(self):
+        return self._sources
+
+    @property
+    def source_lengths(self):
+        return self._source_lengths
+
+    @property
+    def label_groups(self):
+        return {
+            'time'            : ('time',),
+            'fixed_leader'    : self.fixed_leader_vars_short,
+            'variable_leader' : self.variable_leader_vars_short,
+            'derived'         : self.derived_vars,
+            'velocity'        : self.velocity_vars,
+            'bottom_track'    : self.bottom_track_vars_short,
+        }
+
 
     def add_ensemble(self, ensemble):
         """Adds a DVL Pathfinder ensemble to the growing list of ensembles.
@@ -68,15 +118,27 @@ class PathfinderTimeSeries(PathfinderDVL):
         self._ensemble_list.append(ensemble.data_array)
 
 
+    def add_ensembles(self, data_array):
+        """Adds a block of ensembles to the growing list of ensembles.
+
+        Args: 
+            data_array: array of shape (num_ensembles, ensemble_size), for 
+                example the output of PathfinderBatchDecoder.decode().
+        """
+        self._ensemble_list.extend(data_array)
+
+
     def to_dataframe(self):
         """Converts the current list of ensembles into a DataFrame.
 
-        Note: calling this function will invoke pd.concat(), which creates a 
-        copy of the whole DataFrame in memory. As a result, if this function 
-        is called many times, there will be significant slowdown. Instead,
-        consider collecting ensembles into the ensemble_list until a suitable 
-        number of ensembles have been collected, and then intermittently call 
-        the to_dataframe function.
+        The ensembles are appended to a TimeSeriesBuffer and the DataFrame 
+        is a view of the filled rows of the buffer, so that calling this 
+        function often (i.e. after every few ensembles in real-time use) only
+        costs time proportional to the number of new ensembles. If the 
+        DataFrame has been replaced or edited since the last call (i.e. a 
+        column was assigned), the buffer is first rebuilt from the DataFrame.
+        Columns added to the DataFrame are kept, and are NaN for the new 
+        ensembles.
         """
         # convert available ensembles to DataFrame
         if self.ensemble_list:
@@ -84,14 +146,17 @@ class PathfinderTimeSeries(PathfinderDVL):
             cols    = self.label_list
             t_index = self.data_lookup['time']
             t       = ts[:,t_index]
-            index   = pd.DatetimeIndex([datetime.fromtimestamp(v) for v in t])
-            new_df  = pd.DataFrame(data=ts, index=index, columns=cols)
+            index   = TimeSeriesBuffer.get_datetime_index(t, self.TIME_ZONE)
 
-            # concatenate new ensembles with existing DataFrame if possible
+            # append the new ensembles to the rows of the existing DataFrame
             if self.df is None:
-                self._df = new_df
-            else:
-                self._df = pd.concat([self.df, new_df])
+                self._buffer = TimeSeriesBuffer(cols, tz=self.TIME_ZONE)
+            elif self._buffer is None or not self._buffer.is_view(self.df):
+                extra_cols   = [_ for _ in self.df.columns if _ not in cols]
+                self._buffer = TimeSeriesBuffer.from_dataframe(
+                    self.df.reindex(columns=list(cols) + extra_cols))
+            self._buffer.append(ts, index)
+            self._df = self._buffer.to_dataframe()
 
             # reset the ensemble list once added to the DataFrame
             self._ensemble_list = []
@@ -99,8 +164,167 @@ class PathfinderTimeSeries(PathfinderDVL):
             print("WARNING: No ensembles to add to DataFrame.")
 
 
+    @staticmethod
+    @contextmanager
+    def open_pd0(filepath):
+        """Opens a pd0 file as a read-only, memory-mapped buffer.
+
+        The file is not read into memory up front; pages are loaded by the 
+        operating system as the parser touches them. Views into the buffer 
+        (i.e. slices of the memoryview) must not outlive the with-block.
+
+        Args: 
+            filepath: the file location of the pd0 file.
+
+        Yields:
+            memoryview of the file contents.
+        """
+        with open(filepath, 'rb') as f:
+            # empty files cannot be memory-mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                yield memoryview(b'')
+                return
+            mm   = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mm)
+            try:
+                yield view
+            finally:
+                # views can outlive the block when an exception is raised 
+                # while parsing (the traceback references them), in which 
+                # case the map is closed once they are garbage collected
+                try:
+                    view.release()
+                    mm.close()
+                except BufferError:
+                    pass
+
+
     @classmethod
-    def from_pd0(cls, filepath, save, verbose=True):
+    def iter_pd0(cls, filepath, chunk_size=None, batch=False, as_array=False,
+        resync=False, stats=None):
+        """Iterates over the ensembles of a pd0 file with bounded memory.
+
+        The file is memory-mapped and parsed as the generator is consumed, so
+        results are available before the whole file has been read and only 
+        the current ensemble (or chunk) is held in memory. The previous 
+        ensemble needed for the derived variables is carried across chunk 
+        boundaries, so the concatenated chunks are identical to from_pd0.
+
+        Note: to keep memory bounded, the link from an ensemble to its own 
+        previous ensemble is dropped once the next ensemble has been parsed.
+
+        Args: 
+            filepath: the file location of the pd0 to be parsed.
+            chunk_size: if None, PathfinderEnsemble objects are yielded one at 
+                a time. Otherwise chunks of up to chunk_size ensembles are 
+                yielded as DataFrames (or arrays, see as_array).
+            batch: boolean flag for decoding with the PathfinderBatchDecoder.
+                Batch decoding always yields chunks; if chunk_size is None 
+                the whole file is decoded as a single chunk.
+            as_array: boolean flag for yielding chunks as arrays of shape 
+                (num_ensembles, ensemble_size) instead of DataFrames.
+            resync: boolean flag for skipping damaged ensembles (i.e. bad 
+                checksums, serial dropouts or a truncated tail) instead of 
+                raising an error. Parsing continues from the next valid 
+                ensemble header.
+            stats: optional dictionary that is updated with the statistics of
+                the skipped bytes when resync is used, see 
+                PathfinderBatchDecoder.iter_ensemble_offsets.
+
+        Yields:
+            PathfinderEnsemble objects, DataFrames, or arrays.
+        """
+        name = filepath.split('/')[-1].split('.')[0]
+
+        # helper function for converting a chunk of ensembles
+        def to_chunk(data):
+            if as_array:
+                return data
+            chunk = cls(name)
+            chunk.add_ensembles(data)
+            chunk.to_dataframe()
+            return chunk.df
+
+        with cls.open_pd0(filepath) as pd0_file:
+
+            # decode chunks of ensembles at once
+            if batch:
+                decoder = PathfinderBatchDecoder()
+                for data in decoder.iter_decode(pd0_file, chunk_size, 
+                                                resync, stats):
+                    if len(data):
+                        yield to_chunk(data)
+                return
+
+            # otherwise parse one ensemble at a time
+            rows = []
+            for ensemble in cls.iter_ensembles(pd0_file, resync, stats):
+                if chunk_size is None:
+                    yield ensemble
+                    continue
+                rows.append(ensemble.data_array)
+                if len(rows) == chunk_size:
+                    yield to_chunk(np.array(rows))
+                    rows = []
+            if rows:
+                yield to_chunk(np.array(rows))
+
+
+    @staticmethod
+    def iter_ensembles(pd0_file, resync=False, stats=None, data_array=None):
+        """Parses consecutive ensembles from a pd0 buffer.
+
+        Args: 
+            pd0_file: bytes-like object (i.e. memoryview) holding the pd0 data.
+            resync: boolean flag for skipping damaged ensembles.
+            stats: optional dictionary of statistics on the skipped bytes.
+            data_array: optional preallocated array of shape (num_ensembles, 
+                ensemble_size). The i-th ensemble is parsed into the i-th row 
+                and is only a view into it, which keeps the memory footprint 
+                of many ensembles low. Parsing stops once the array is full.
+
+        Yields:
+            PathfinderEnsemble objects, each parsed with the previous one.
+        """
+        offset        = 0
+        prev_ensemble = None
+        count         = 0
+
+        # the batch decoder locates the valid ensembles when resynchronizing
+        if resync:
+            buf     = np.frombuffer(pd0_file, dtype=np.uint8)
+            offsets = PathfinderBatchDecoder().iter_ensemble_offsets(
+                buf, resync=True, stats=stats)
+            offset  = next(offsets, len(pd0_file))
+
+        while offset < len(pd0_file):
+            # select the row of the preallocated array to parse into
+            row = None
+            if data_array is not None:
+                if count == len(data_array):
+                    return
+                row = data_array[count]
+            ensemble = PathfinderEnsemble(pd0_file[offset:], prev_ensemble,
+                                          data_array=row)
+            count   += 1
+
+            # the previous ensemble is only needed while parsing, so the 
+            # chain of ensembles is cut here to allow garbage collection
+            if prev_ensemble is not None:
+                prev_ensemble._prev_ensemble = None
+
+            # move the cursor past the ensemble we just parsed
+            if resync:
+                offset = next(offsets, len(pd0_file))
+            else:
+                offset += ensemble.num_bytes + 2
+            prev_ensemble = ensemble
+            yield ensemble
+
+
+    @classmethod
+    def from_pd0(cls, filepath, save, verbose=True, batch=False, 
+        resync=False, cache_dir=None, columns=None):
         """Parses DVL Time Series from given pd0 file. 
 
         Args: 
@@ -108,11 +332,22 @@ class PathfinderTimeSeries(PathfinderDVL):
                 file located at filepath is a valid pd0 file
             save: boolean flag for saving the resulting time-series or not
             verbose: boolean flag for printing file information while parsing
+            batch: boolean flag for decoding all ensembles at once with the 
+                PathfinderBatchDecoder instead of one PathfinderEnsemble at a 
+                time. Both methods produce the same variables.
+            resync: boolean flag for skipping damaged ensembles instead of 
+                raising an error. Statistics on the skipped bytes are stored
+                in the resync_stats attribute of the time series.
+            cache_dir: optional directory of the parse cache. If the cache 
+                holds an entry for the contents of the file (and the current 
+                PARSER_VERSION and CACHE_PARAMETERS), the time series is 
+                loaded from the cache instead of parsing the file. Otherwise 
+                the parsed time series is stored in the cache. 
+            columns: optional list of variables to keep in the DataFrame. 
+                When loading from the cache, only these columns are read.
         """
         PRINT_INTERVAL = 200 
 
-        # open the file 
-        pd0_file = open(filepath, 'rb').read()
         filename = filepath.split('/')[-1]
         count = 0
         if verbose:
@@ -124,28 +359,56 @@ class PathfinderTimeSeries(PathfinderDVL):
         # initialize the time series object
         name          = filepath.split('/')[-1].split('.')[0]
         time_series   = cls(name)
-        prev_ensemble = None
+        stats         = time_series.resync_stats if resync else None
+        time_series._sources.append((filepath, resync))
+
+        # look up the cache entry for the contents of the file
+        cache_path = None
+        if cache_dir is not None:
+            parameters = {name.lower() : getattr(cls, name) 
+                          for name in cls.CACHE_PARAMETERS}
+            cache_path = parse_cache.get_cache_path(
+                cache_dir, filepath, cls.PARSER_VERSION, resync=resync, 
+                tz=cls.TIME_ZONE, **parameters)
+        loaded = cache_path is not None and os.path.isfile(cache_path)
+
+        # load the parsed time series from the cache when possible
+        if loaded:
+            time_series._df, meta = parse_cache.load_frame(cache_path, 
+                                                           columns)
+            time_series.resync_stats.update(meta['resync_stats'])
+            count = len(time_series.df)
+
+        # decode all ensembles at once when using the batch decoder
+        elif batch:
+            for data in cls.iter_pd0(filepath, batch=True, as_array=True,
+                                     resync=resync, stats=stats):
+                time_series.add_ensembles(data)
+                count += len(data)
 
         # parse ensembles until the end of the pd0 file is reached    
-        while len(pd0_file) > 0:
-
-            # parse an ensemble from the pd0 file and add it to the time series
-            ensemble = PathfinderEnsemble(pd0_file, prev_ensemble)
-            time_series.add_ensemble(ensemble)
-
-            # chop off the ensemble we just parsed and added to the time series
-            ensemble_len  = ensemble.num_bytes + 2
-            pd0_file      = pd0_file[ensemble_len:]
-            count        += 1
-            prev_ensemble = ensemble
-
-            # print number of ensembles parsed periodically 
-            if verbose:
-                if (count % PRINT_INTERVAL == 0):
-                    print('    # ensembles:  %5d' % (count,))
-
-        # convert to data-frame once all ensembles are collected
-        time_series.to_dataframe()
+        else:
+            for ensemble in cls.iter_pd0(filepath, resync=resync, 
+                                         stats=stats):
+                time_series.add_ensemble(ensemble)
+                count += 1
+
+                # print number of ensembles parsed periodically 
+                if verbose:
+                    if (count % PRINT_INTERVAL == 0):
+                        print('    # ensembles:  %5d' % (count,))
+
+        # convert to data-frame once all ensembles are collected and store 
+        # the full time series in the cache 
+        if not loaded:
+            time_series.to_dataframe()
+            if cache_path is not None and time_series.df is not None:
+                parse_cache.save_frame(cache_path, time_series.df, 
+                    groups=time_series.label_groups, 
+                    meta={'resync_stats' : time_series.resync_stats})
+            if columns is not None and time_series.df is not None:
+                time_series._df = time_series.df[list(columns)]
+        time_series._source_lengths.append(count)
         
         # parsing completed 
         if verbose:
@@ -153,6 +416,11 @@ class PathfinderTimeSeries(PathfinderDVL):
             print('- Parsing Complete ---------------------')
             print('    # ensembles:  %5d'    % (count))
             print('    parsing time:  %f'    % (parse_stop - parse_start))
+            if loaded:
+                print('    loaded from:   %s'    % (cache_path,))
+            if resync:
+                print('    skipped bytes: %5d in %d region(s)' % 
+                      (stats['num_skipped_bytes'], len(stats['skipped'])))
 
         # save the file to .csv format
         if save:
@@ -170,13 +438,330 @@ class PathfinderTimeSeries(PathfinderDVL):
                 print('    output file:   %s'    % (name+'.CSV'))
 
         # parse the configurations for diagnostic purposes
-        if verbose:
+        #   + the first valid ensemble is used, which is not at the start of 
+        #     the file when damaged bytes are skipped
+        if verbose and count:
+            with cls.open_pd0(filepath) as pd0_file:
+                ensemble = next(cls.iter_ensembles(pd0_file, resync))
             ensemble.parse_system_configuration()
             ensemble.parse_coordinate_transformation()
      
         return(time_series)
 
 
+    @classmethod
+    def from_directory(cls, directory, workers=None, by_dive=False, 
+        batch=False, resync=False, verbose=False):
+        """Parses every pd0 file in a directory, one file per worker process.
+
+        Each file (i.e. each dive) is parsed independently, so the previous 
+        ensemble used for the derived variables is only carried over within 
+        a file. The files are parsed in parallel by a pool of processes and 
+        the results are collected in a deterministic order, sorted by the 
+        time of the ensembles.
+
+        Args: 
+            directory: directory containing the .pd0 files to be parsed.
+            workers: number of worker processes. By default one worker per 
+                CPU is used, and with workers=1 the files are parsed in the 
+                current process.
+            by_dive: boolean flag for returning a dictionary from the name of 
+                each file to its time series, instead of a single time series.
+            batch: boolean flag for decoding with the PathfinderBatchDecoder.
+            resync: boolean flag for skipping damaged ensembles.
+            verbose: boolean flag for printing progress while parsing.
+
+        Returns:
+            A PathfinderTimeSeries with the ensembles of all files, or a 
+            dictionary of PathfinderTimeSeries ordered by start time. 
+        """
+        if verbose:
+            print('>> Parsing folder of PD0 Files')
+        file_list = sorted(os.path.join(directory, f) 
+                           for f in os.listdir(directory) 
+                           if f.lower().endswith('.pd0') and 
+                           os.path.isfile(os.path.join(directory, f)))
+        args = [(f, batch, resync) for f in file_list]
+
+        # parse each file in a separate process (results keep the file order)
+        if workers == 1:
+            frames = [cls.parse_file(_) for _ in args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                frames = list(executor.map(cls.parse_file, args))
+
+        # order the dives by the time of their first ensemble 
+        names  = [f.split('/')[-1].split('.')[0] for f in file_list]
+        sources = {name : (f, resync) for name, f in zip(names, file_list)}
+        dives  = [(df.index[0], name, df) for name, df in zip(names, frames) 
+                  if df is not None and len(df)]
+        dives.sort(key=lambda _: _[:2])
+        if verbose:
+            print('>> Finished Parsing!')
+
+        # return each dive separately
+        if by_dive:
+            time_series = {}
+            for _, name, df in dives:
+                time_series[name]          = cls(name)
+                time_series[name]._df      = df
+                time_series[name]._sources = [sources[name]]
+                time_series[name]._source_lengths = [len(df)]
+            return time_series
+
+        # otherwise concatenate all dives into a single time series 
+        name        = os.path.basename(os.path.normpath(directory))
+        time_series = cls(name)
+        time_series._sources = [sources[_[1]] for _ in dives]
+        time_series._source_lengths = [len(_[2]) for _ in dives]
+        if dives:
+            df    = pd.concat([_[2] for _ in dives])
+            order = np.argsort(df.index.values, kind='mergesort')
+            time_series._df = df.iloc[order]
+            time_series._source_order = order
+        return time_series
+
+
+    @classmethod
+    def parse_file(cls, args):
+        """Parses a single pd0 file for from_directory.
+
+        Args: 
+            args: (filepath, batch, resync) tuple.
+
+        Returns:
+            The DataFrame of the parsed file, or None if it has no ensembles.
+        """
+        filepath, batch, resync = args
+        return cls.from_pd0(filepath, save=False, verbose=False, batch=batch,
+                            resync=resync).df
+
+
+    def get_profiles(self, var_type):
+        """Returns the correlation, echo intensity or percent good profiles.
+
+        These water profiling data types are not parsed with the rest of the 
+        ensemble, so that navigation-only processing does not pay for them.
+        Instead, they are decoded in bulk from the source pd0 files the first
+        time they are requested. The ensembles are located again by walking 
+        the chain of ensemble headers, which only reads the headers, and the
+        result is kept for subsequent calls.
+
+        Args:
+            var_type: 'correlation', 'echo_intensity', or 'percent_good'.
+
+        Returns:
+            DataFrame with the same index as df and one column per bin and 
+            beam (i.e. cor_bin0_beam0).
+
+        Raises:
+            ValueError if the time series was not parsed from pd0 files, or if
+                a source file no longer matches the parsed ensembles.
+        """
+        if var_type in self._profiles:
+            return self._profiles[var_type]
+        if not self.sources or self.df is None:
+            raise ValueError('profiles require a time series parsed from pd0')
+
+        # decode the profiles of each source file 
+        decoder = PathfinderBatchDecoder()
+        frames  = []
+        for filepath, resync in self.sources:
+            with self.open_pd0(filepath) as pd0_file:
+                buf      = np.frombuffer(pd0_file, dtype=np.uint8)
+                starts   = np.fromiter(decoder.iter_ensemble_offsets(
+                    buf, resync=resync), dtype=np.int64)
+                profiles = decoder.decode_profiles(buf, starts, var_type)
+                del buf
+            frames.append(profiles)
+        profiles = np.vstack(frames)
+        if len(profiles) != len(self.df):
+            raise ValueError('source files do not match the time series: '
+                             '%d ensembles, expected %d' % 
+                             (len(profiles), len(self.df)))
+
+        # order the ensembles like the DataFrame (see from_directory)
+        if self._source_order is not None:
+            profiles = profiles[self._source_order]
+        cols       = self.get_profile_var_list(var_type)
+        profile_df = pd.DataFrame(profiles, index=self.df.index, columns=cols)
+        self._profiles[var_type] = profile_df
+        return profile_df
+
+
+    def get_dive_rows(self):
+        """Returns the rows of the DataFrame that belong to each dive.
+
+        Every source file is a separate dive, whose first ensemble has no 
+        previous ensemble. A time series that was not parsed from pd0 files
+        is treated as a single dive.
+
+        Returns:
+            list of integer arrays of row numbers, one per dive, in order.
+        """
+        if not self.source_lengths:
+            return [np.arange(len(self.df))]
+        dive_ids = np.repeat(np.arange(len(self.source_lengths)), 
+                             self.source_lengths)
+        if self._source_order is not None:
+            dive_ids = dive_ids[self._source_order]
+        return [np.flatnonzero(dive_ids == i) 
+                for i in range(len(self.source_lengths))]
+
+
+    def get_batch_decoder(self):
+        """Returns a PathfinderBatchDecoder that uses the navigation 
+        parameters (i.e. MAX_SPEED and BIAS_PITCH) of the time series.
+
+        Raises:
+            ValueError if the DataFrame does not hold every variable.
+        """
+        if self.df is None or list(self.df.columns) != list(self.label_list):
+            raise ValueError('navigation requires all parsed variables')
+        decoder = PathfinderBatchDecoder()
+        for param in ['MAX_SPEED', 'MIN_PITCH', 'EPSILON', 'BIAS_PITCH',
+                      'BIAS_ROLL', 'BIAS_HEADING', 'JANUS_ANGLE']:
+            setattr(decoder, param, getattr(self, param))
+        return decoder
+
+
+    def compute_derived_variables(self, max_speed=None, min_pitch=None, 
+        epsilon=None):
+        """Recomputes the derived variables from the parsed variables.
+
+        The derived variables (i.e. delta_t, through water velocities, and 
+        dead-reckoned position) are computed for every dive at once with the
+        array engine of the PathfinderBatchDecoder, without parsing the pd0 
+        files again. This makes it cheap to study the effect of the dead
+        reckoning parameters on navigation. The results are identical to 
+        parsing with the same parameters.
+
+        Args:
+            max_speed: optional new value of MAX_SPEED [m/s].
+            min_pitch: optional new value of MIN_PITCH [deg].
+            epsilon: optional new value of EPSILON [m].
+
+        Raises:
+            ValueError if the DataFrame does not hold every variable.
+        """
+        # update the parameters of the time series 
+        if max_speed is not None: self.MAX_SPEED = max_speed
+        if min_pitch is not None: self.MIN_PITCH = min_pitch
+        if epsilon   is not None: self.EPSILON   = epsilon
+        decoder = self.get_batch_decoder()
+
+        # each dive is integrated from its own first ensemble
+        data = self.df.to_numpy(dtype=float, copy=True)
+        for rows in self.get_dive_rows():
+            if len(rows):
+                dive = data[rows]
+                decoder.compute_derived_variables(dive)
+                data[rows] = dive
+        self._df = pd.DataFrame(data, index=self.df.index, 
+                                columns=self.df.columns)
+
+
+    def reproject(self, bias_pitch=None, bias_roll=None, bias_heading=None):
+        """Recomputes the navigation variables for new mounting bias angles.
+
+        The velocities in the DataFrame were rotated for the mounting bias 
+        while parsing. The rotation is orthogonal, so the velocities reported
+        by the instrument are recovered exactly by the inverse rotation with 
+        the current bias angles, and then rotated with the new ones. The 
+        bathymetry factors and the dead-reckoned position are recomputed 
+        afterwards (see compute_derived_variables). The results are identical
+        to parsing with the new bias angles, without parsing the pd0 files.
+
+        Args:
+            bias_pitch: optional new value of BIAS_PITCH [deg].
+            bias_roll: optional new value of BIAS_ROLL [deg].
+            bias_heading: optional new value of BIAS_HEADING [deg].
+
+        Raises:
+            ValueError if the DataFrame does not hold every variable.
+        """
+        decoder = self.get_batch_decoder()
+        data    = self.df.to_numpy(dtype=float, copy=True)
+        decoder.apply_mounting_bias_rotations(data, inverse=True)
+
+        # rotate with the new bias angles of the time series 
+        if bias_pitch   is not None: self.BIAS_PITCH   = bias_pitch
+        if bias_roll    is not None: self.BIAS_ROLL    = bias_roll
+        if bias_heading is not None: self.BIAS_HEADING = bias_heading
+        self.get_batch_decoder().apply_mounting_bias_rotations(data)
+        self._df = pd.DataFrame(data, index=self.df.index, 
+                                columns=self.df.columns)
+        self.compute_derived_variables()
+
+
+    @staticmethod
+    def interpolate(t, t_source, values, circular=False):
+        """Linearly interpolates a sampled variable at the given times.
+
+        Samples with NaN values are left out, so that each time is between 
+        the closest valid samples. Times before the first or after the last 
+        valid sample take the value of that sample, and at repeated sample 
+        times the last sample is used.
+
+        Args:
+            t: array of the times to interpolate at [s].
+            t_source: array of the sample times in increasing order [s].
+            values: array of the sampled values.
+            circular: boolean flag for angles in [0, 2pi) (i.e. heading), 
+                which are interpolated along the shorter arc, so that 
+                interpolating between 359 deg and 1 deg gives 0 deg. 
+
+        Returns:
+            array of the interpolated values, which is NaN everywhere if no
+            sample is valid.
+        """
+        t        = np.asarray(t, dtype=float)
+        t_source = np.asarray(t_source, dtype=float)
+        values   = np.asarray(values, dtype=float)
+        valid    = ~np.isnan(values) & ~np.isnan(t_source)
+        if not valid.any():
+            return np.full(t.shape, np.nan)
+        t_source = t_source[valid]
+        values   = values[valid]
+        if circular:
+            values = np.unwrap(values)
+        synced = np.interp(t, t_source, values)
+        return np.mod(synced, 2*np.pi) if circular else synced
+
+
+    def sync_flight_controller(self, flight_controller, 
+        variables=('m_pitch', 'm_roll', 'm_heading')):
+        """Returns flight controller variables at the times of the ensembles.
+
+        The flight controller and the DVL log at different times, so each 
+        variable is linearly interpolated between the two valid samples of
+        the flight controller around the time of every ensemble (see 
+        interpolate). All ensembles are synchronized at once, and heading 
+        variables of the flight controller are interpolated along the 
+        shorter arc.
+
+        Args:
+            flight_controller: SlocumFlightController with a 'time' variable
+                that is on the same time base as the time series (UTC).
+            variables: the flight controller variables to synchronize.
+
+        Returns:
+            DataFrame with the index of the time series and a column of the
+            synchronized values for each variable, in the units of the 
+            flight controller.
+        """
+        df_dbd = flight_controller.df
+        t_dbd  = df_dbd['time'].to_numpy(dtype=float)
+        order  = np.argsort(t_dbd, kind='mergesort')
+        t      = self.df['time'].to_numpy(dtype=float)
+        synced = {var : self.interpolate(t, t_dbd[order], 
+                     df_dbd[var].to_numpy(dtype=float)[order], 
+                     circular=var in flight_controller.CIRCULAR_VARIABLES)
+                  for var in variables}
+        return pd.DataFrame(synced, index=self.df.index, 
+                            columns=list(variables))
+
+
     def save_as_csv(self, name=None, directory='./'):
         """Saves the DataFrame to csv file. 
 
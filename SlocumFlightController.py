@@ -3,15 +3,37 @@
 # Class for parsing .dbd files 
 #   2020-05-22  zduguid@mit.edu         initial implementation
 
+import hashlib
+import os
 import pandas as pd
 import numpy as np
 import time 
+import parse_cache
+import struct
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from os import listdir
 from os.path import isfile, join
+from TimeSeriesBuffer import TimeSeriesBuffer
 
 
 class SlocumFlightController(object):
+    # version of the parsed output, used to invalidate cached flight logs
+    #   + increment whenever a change to the parser changes the parsed values
+    PARSER_VERSION = 1
+
+    # time zone of the DataFrame index (i.e. 'UTC')
+    #   + None keeps naive local times, as given by datetime.fromtimestamp
+    TIME_ZONE = None
+
+    # angle variables in [0, 2pi) that wrap around when interpolated
+    #   + see PathfinderTimeSeries.sync_flight_controller
+    CIRCULAR_VARIABLES = ('m_heading', 'c_heading')
+
+    # known bytes cycle of binary flight logs, used to detect the byte order
+    #   + tag, 2-byte integer, 4-byte float, 8-byte float
+    DBD_KNOWN_BYTES = (b'sa', 0x1234, 123.456, 123456789.12345)
+
     def __init__(self, name=datetime.now().strftime("%Y-%m-%d %H:%M:%S")):
         """Represents a Slocum Glider flight log. 
         
@@ -104,6 +126,8 @@ class SlocumFlightController(object):
         self._data_lookup   = {self.label_list[i]:i 
             for i in range(self.ensemble_size)}
         self._ensemble_list = []
+        self._buffer        = None
+        self._gps_index     = None
 
 
     @property
@@ -175,6 +199,91 @@ class SlocumFlightController(object):
         self._ensemble_list.append(ensemble) 
 
 
+    def add_ensembles(self, data_array):
+        """Adds a block of ensembles to the ensemble list.
+
+        Args: 
+            data_array: array of shape (num_ensembles, ensemble_size).
+        """
+        self._ensemble_list.extend(data_array)
+
+
+    @staticmethod
+    def get_name_hash(name):
+        """Returns a hash of a file or mission name that fits in a float.
+
+        Unlike the built-in hash, the value is the same in every process, so
+        that logs parsed by different processes (or loaded from the parse 
+        cache) can be compared.
+        """
+        NUM_BYTES = 6
+        digest = hashlib.blake2b(name.encode(), digest_size=NUM_BYTES)
+        return int.from_bytes(digest.digest(), 'little')
+
+
+    def get_gps_index(self, x_var='m_gps_x_lmc', y_var='m_gps_y_lmc'):
+        """Returns the GPS fix index of the flight log.
+
+        The index holds the times of all cycles of the flight controller in
+        increasing order, and the GPS fix of each cycle (NaN if the cycle has
+        no fix). It is built the first time it is needed, and kept while the
+        time and GPS fix columns hold the same values. The columns are 
+        compared on every call, which is linear in the number of cycles, so
+        that assigning a column (i.e. after converting the fixes to LMC) or
+        replacing the DataFrame rebuilds the index.
+
+        Args:
+            x_var: variable of the x position of the GPS fixes [m].
+            y_var: variable of the y position of the GPS fixes [m].
+
+        Returns:
+            (time, xy) tuple of the times of the cycles [s] and an array of 
+            shape (num_cycles, 2) of their GPS fixes [m].
+        """
+        columns = [self.df[_].to_numpy(dtype=float) 
+                   for _ in ('time', x_var, y_var)]
+        if self._gps_index is None or self._gps_index[0] != (x_var, y_var) or \
+            not all(np.array_equal(a, b, equal_nan=True) 
+                    for a, b in zip(columns, self._gps_index[1])):
+            time  = columns[0]
+            order = np.argsort(time, kind='mergesort')
+            xy    = np.column_stack(columns[1:])[order]
+            self._gps_index = ((x_var, y_var), [_.copy() for _ in columns],
+                               (time[order], xy))
+        return self._gps_index[2]
+
+
+    def get_next_gps_fix(self, t, end=None, x_var='m_gps_x_lmc', 
+        y_var='m_gps_y_lmc'):
+        """Returns the GPS fix of the first cycle at or after each time.
+
+        This is the fix that the navigation resets to when the glider is at
+        the surface. Each time is looked up in the GPS fix index (see 
+        get_gps_index) by binary search, without copying the flight log.
+
+        Args:
+            t: time or array of times [s].
+            end: optional time of the last cycle that is considered [s], 
+                i.e. the end of the dive.
+            x_var: variable of the x position of the GPS fixes [m].
+            y_var: variable of the y position of the GPS fixes [m].
+
+        Returns:
+            array of shape (2,), or (len(t), 2) for an array of times, of the
+            (x, y) GPS fix [m]. The fix is NaN if the next cycle has no GPS 
+            fix, or if there is no next cycle before the end.
+        """
+        time, xy  = self.get_gps_index(x_var, y_var)
+        times     = np.atleast_1d(np.asarray(t, dtype=float))
+        num_cycle = len(time) if end is None else \
+                    np.searchsorted(time, end, side='right')
+        cycle     = np.searchsorted(time[:num_cycle], times, side='left')
+        found     = cycle < num_cycle
+        fixes     = np.full((len(times), 2), np.nan)
+        fixes[found] = xy[cycle[found]]
+        return fixes if np.ndim(t) else fixes[0]
+
+
     def get_utm_coords(m_lat, m_lon): 
         """TODO
         """
@@ -194,12 +303,14 @@ class SlocumFlightController(object):
     def to_dataframe(self):
         """Converts the current list of ensembles into a DataFrame.
 
-        Note: calling this function will invoke pd.concat(), which creates a 
-        copy of the whole DataFrame in memory. As a result, if this function 
-        is called many times, there will be significant slowdown. Instead,
-        consider collecting ensembles into the ensemble_list until a suitable 
-        number of ensembles have been collected, and then intermittently call 
-        the to_dataframe function.
+        The ensembles are appended to a TimeSeriesBuffer and the DataFrame 
+        is a view of the filled rows of the buffer, so that calling this 
+        function often (i.e. after every few ensembles in real-time use) only
+        costs time proportional to the number of new ensembles. If the 
+        DataFrame has been replaced or edited since the last call (i.e. a 
+        column was assigned), the buffer is first rebuilt from the DataFrame.
+        Columns added to the DataFrame are kept, and are NaN for the new 
+        ensembles.
         """
         # convert available ensembles to DataFrame
         if self.ensemble_list:
@@ -207,14 +318,17 @@ class SlocumFlightController(object):
             cols    = self.label_list
             t_index = self.data_lookup['time']
             t       = ts[:,t_index]
-            index   = pd.DatetimeIndex([datetime.fromtimestamp(v) for v in t])
-            new_df  = pd.DataFrame(data=ts, index=index, columns=cols)
+            index   = TimeSeriesBuffer.get_datetime_index(t, self.TIME_ZONE)
 
-            # concatenate new ensembles with existing DataFrame if possible
+            # append the new ensembles to the rows of the existing DataFrame
             if self.df is None:
-                self._df = new_df
-            else:
-                self._df = pd.concat([self.df, new_df])
+                self._buffer = TimeSeriesBuffer(cols, tz=self.TIME_ZONE)
+            elif self._buffer is None or not self._buffer.is_view(self.df):
+                extra_cols   = [_ for _ in self.df.columns if _ not in cols]
+                self._buffer = TimeSeriesBuffer.from_dataframe(
+                    self.df.reindex(columns=list(cols) + extra_cols))
+            self._buffer.append(ts, index)
+            self._df = self._buffer.to_dataframe()
 
             # reset the ensemble list once added to the DataFrame
             self._ensemble_list = []
@@ -222,24 +336,260 @@ class SlocumFlightController(object):
             print("  WARNING: No ensembles to add to DataFrame.")
     
     
+    def add_log_rows(self, block, names):
+        """Adds the rows of a flight log to the ensemble list.
+
+        Args:
+            block: array of shape (num_rows, len(names)) of the values of the
+                logged variables, where NaN marks a variable not updated.
+            names: the variable of each column of the block. Variables in the
+                label list that are not in names are NaN.
+
+        Returns:
+            The number of rows added.
+        """
+        TIME_ZONE_OFFSET = 5     # [hours]
+        SECS_IN_HOUR     = 3600
+        count = len(block)
+
+        # add selected variables to ensembles, other variables are NaN
+        ensembles = np.full((count, self.ensemble_size), np.nan)
+        for col, var in enumerate(names):
+            if var in self.label_set:
+                ensembles[:, self.data_lookup[var]] = block[:, col]
+
+        # add user defined variables to ensembles 
+        ensembles[:, self.data_lookup['m_filename_hash']] = \
+            self.get_name_hash(self.header['filename'])
+
+        # filename changes with dive number, not mission 
+        #   + important because LMC coordinates reset each mission
+        mission = self.header['filename'].rsplit('-',1)[0]
+        ensembles[:, self.data_lookup['m_mission_hash']] = \
+            self.get_name_hash(mission)
+
+        # convert time from EDT to UTC for all ensembles at once
+        ensembles[:, self.data_lookup['time']] = \
+            ensembles[:, self.data_lookup['m_present_time']] + \
+            TIME_ZONE_OFFSET*SECS_IN_HOUR
+        if count:
+            self.add_ensembles(ensembles)
+        return count
+
+
+    def read_asc(self, filepath):
+        """Reads the header and the selected variables of an .asc file.
+
+        The header is read line by line, and the data block is then read in 
+        bulk with the C parser of pandas, keeping only the columns of the 
+        variables in the label list. 
+
+        Args:
+            filepath: the file location of the .asc file, which is a binary 
+                flight log converted to ascii (i.e. by dbd2asc)
+
+        Returns:
+            (block, names) tuple, see add_log_rows.
+        """
+        HEADER_LEN = 14
+        header     = {}
+        with open(filepath, 'r') as f:
+            # parse the fixed file header in formation 
+            for i in range(HEADER_LEN):
+                head_line = f.readline().split(': ')
+                header[head_line[0]] = head_line[1].split('\n')[0]
+            self._header = header
+
+            # parse the variables names, sizes
+            self._var_names = f.readline().split(' ')[:-1]
+            self._var_units = f.readline().split(' ')[:-1]
+            self._var_sizes = f.readline().split(' ')[:-1]
+            self._var_dict  = {_ : self.var_names.index(_) 
+                               for _ in self.label_list if _ in self.var_names}
+
+            # read the selected columns of the data block in one pass, which
+            # skips the unused columns
+            usecols = sorted(self.var_dict.values())
+            try:
+                block = pd.read_csv(f, sep=' ', header=None, usecols=usecols,
+                                    dtype=float, engine='c').to_numpy()
+            except pd.errors.EmptyDataError:
+                block = np.zeros((0, len(usecols)))
+        return block, [self.var_names[col] for col in usecols]
+
+
+    def read_dbd(self, filepath, sensor_cache_dir=None):
+        """Reads the header and the selected variables of a binary flight log.
+
+        Binary flight logs (.dbd, .ebd, .sbd, ...) start with ascii header 
+        tags and the list of sensors, followed by a known bytes cycle that 
+        gives the byte order. Each data cycle then holds a two bit state per
+        sensor (not updated, updated with the same value, or updated with a
+        new value) followed by the new values only. The cycles are located
+        with one pass over the state bytes, and the values of the selected 
+        sensors are then decoded at once for all cycles. As in the .asc 
+        files, a sensor updated with the same value repeats its last value, 
+        and a sensor that is not updated is NaN.
+
+        Args:
+            filepath: the file location of the binary flight log.
+            sensor_cache_dir: directory of the sensor list cache (.cac) files,
+                only required for logs whose sensor list is factored out.
+
+        Returns:
+            (block, names) tuple, see add_log_rows.
+
+        Raises:
+            ValueError if the file is not a valid binary flight log, or if the
+                factored sensor list is not in the sensor cache.
+        """
+        STATE_SAME  = 1
+        STATE_NEW   = 2
+        CYCLE_TAG   = ord('d')
+        END_TAG     = ord('X')
+        CHUNK_SIZE  = 4096      # cycles decoded at a time
+        TYPES       = {1 : 'i1', 2 : 'i2', 4 : 'f4', 8 : 'f8'}
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        data = np.frombuffer(raw, dtype=np.uint8)
+
+        # parse the ascii header tags, the number of tags is the third tag
+        pos, header, num_tags = 0, {}, None
+        while num_tags is None or len(header) < num_tags:
+            end  = raw.find(b'\n', pos)
+            line = raw[pos:end].decode('ascii', 'replace')
+            if end < 0 or ':' not in line:
+                raise ValueError('bad header line at byte %d' % (pos,))
+            key, value  = [_.strip() for _ in line.split(':', 1)]
+            header[key] = value
+            if key == 'num_ascii_tags':
+                num_tags = int(value)
+            pos = end + 1
+        self._header = header
+
+        # the sensor list follows the header, or is stored in the cache
+        if header.get('sensor_list_factored') == '1':
+            crc = header['sensor_list_crc'].lower()
+            if sensor_cache_dir is None or not os.path.isfile(
+                os.path.join(sensor_cache_dir, crc + '.cac')):
+                raise ValueError('sensor list %s not in sensor cache' % (crc,))
+            with open(os.path.join(sensor_cache_dir, crc + '.cac'), 'rb') as f:
+                lines = f.read().splitlines()
+        else:
+            lines = []
+            while raw.startswith(b's:', pos):
+                end = raw.index(b'\n', pos)
+                lines.append(raw[pos:end])
+                pos = end + 1
+
+        # sensors are stored in the order of their output index
+        #   + line format: s: <T|F> <index> <output index> <size> <name> <units>
+        sensors = sorted((int(_[3]), _[5], _[6], _[4]) for _ in 
+                         (line.decode('ascii').split() for line in lines 
+                          if line.startswith(b's:')) if _[1] == 'T')
+        self._var_names = [_[1] for _ in sensors]
+        self._var_units = [_[2] for _ in sensors]
+        self._var_sizes = [_[3] for _ in sensors]
+        self._var_dict  = {_ : self.var_names.index(_) 
+                           for _ in self.label_list if _ in self.var_names}
+        if len(sensors) != int(header['sensors_per_cycle']):
+            raise ValueError('bad sensor list: expected = %s, actual = %d' % 
+                             (header['sensors_per_cycle'], len(sensors)))
+
+        # known bytes cycle gives the byte order of the values
+        tag, short, single, double = self.DBD_KNOWN_BYTES
+        for order in '><':
+            if raw.startswith(tag, pos) and \
+                struct.unpack_from(order + 'h', raw, pos + 2)[0] == short:
+                break
+        else:
+            raise ValueError('bad known bytes cycle at byte %d' % (pos,))
+        if struct.unpack_from(order + 'fd', raw, pos + 4) != \
+            (np.float32(single), double):
+            raise ValueError('bad known bytes cycle at byte %d' % (pos,))
+        pos += 16
+
+        # bytes of new values for each state byte position and value
+        sizes       = np.array([int(_) for _ in self.var_sizes])
+        num_sensors = len(sizes)
+        num_states  = (num_sensors + 3)//4
+        padded      = np.zeros(4*num_states, dtype=np.int64)
+        padded[:num_sensors] = sizes
+        states      = (np.arange(256)[:,None] >> np.array([6,4,2,0])) & 3
+        new_bytes   = ((states == STATE_NEW)[None,:,:] * 
+                       padded.reshape(-1,1,4)).sum(axis=2)
+        positions   = np.arange(num_states)
+
+        # locate the cycles, a truncated last cycle is left out
+        starts = []
+        while pos < len(raw) and raw[pos] != END_TAG:
+            if raw[pos] != CYCLE_TAG:
+                raise ValueError('bad cycle tag %r at byte %d' % 
+                                 (raw[pos:pos+1], pos))
+            if pos + 1 + num_states > len(raw):
+                break
+            stop = pos + 1 + num_states + \
+                   new_bytes[positions, data[pos+1:pos+1+num_states]].sum()
+            if stop > len(raw):
+                break
+            starts.append(pos + 1)
+            pos = stop
+        starts = np.array(starts, dtype=np.int64)
+
+        # decode the states and the value offsets of the selected sensors 
+        cols    = sorted(self.var_dict.values())
+        state   = np.empty((len(starts), len(cols)), dtype=np.uint8)
+        offsets = np.empty((len(starts), len(cols)), dtype=np.int64)
+        for i in range(0, len(starts), CHUNK_SIZE):
+            chunk   = starts[i:i+CHUNK_SIZE]
+            state_bytes  = data[chunk[:,None] + positions]
+            chunk_states = ((state_bytes[:,:,None] >> np.array([6,4,2,0],
+                dtype=np.uint8)) & 3).reshape(len(chunk), -1)[:,:num_sensors]
+            lengths = np.where(chunk_states == STATE_NEW, sizes, 0)
+            first   = np.cumsum(lengths, axis=1) - lengths
+            state[i:i+CHUNK_SIZE]   = chunk_states[:, cols]
+            offsets[i:i+CHUNK_SIZE] = chunk[:,None] + num_states + \
+                                      first[:, cols]
+
+        # decode the new values of each selected sensor at once, and repeat 
+        # the last new value for sensors updated with the same value
+        block = np.full((len(starts), len(cols)), np.nan)
+        rows  = np.arange(len(starts))
+        for j, col in enumerate(cols):
+            new   = state[:,j] == STATE_NEW
+            dtype = np.dtype(TYPES[sizes[col]]).newbyteorder(order)
+            value = data[offsets[new,j][:,None] + np.arange(sizes[col])]
+            block[new,j] = np.ascontiguousarray(value).view(dtype)[:,0]
+            last  = np.maximum.accumulate(np.where(new, rows, -1))
+            same  = (state[:,j] == STATE_SAME) & (last >= 0)
+            block[same,j] = block[last[same],j]
+        return block, [self.var_names[col] for col in cols]
+
+
     @classmethod
-    def from_asc(cls, filepath, save, verbose=True, interval=True):
-        """Parses DBD (flight controller file) from the Slocum Glider.
+    def from_log(cls, filepath, save, verbose=True, cache_dir=None, 
+        sensor_cache_dir=None):
+        """Parses a flight log (flight controller file) of the Slocum Glider.
+
+        Logs converted to ascii (.asc) are read with read_asc and binary logs
+        are read with read_dbd. Only the variables in the label list are 
+        kept, and variables in the label list that are not in the log are 
+        NaN.
 
         Args: 
-            filepath: the file location of the pd0 to be parsed, requires that 
-                file located at filepath is a valid pd0 file
+            filepath: the file location of the .asc file or of the binary 
+                flight log (i.e. .dbd) to be parsed
             save: boolean flag for saving the resulting time-series or not
             verbose: boolean flag for printing file information while parsing
+            cache_dir: optional directory of the parse cache. If the cache 
+                holds an entry for the contents of the file (and the current 
+                PARSER_VERSION), the flight log is loaded from the cache 
+                instead of parsing the file. Otherwise the parsed flight log
+                is stored in the cache. 
+            sensor_cache_dir: directory of the sensor list cache, see 
+                read_dbd.
         """
-        PRINT_INTERVAL = 200 
-        HEADER_LEN = 14
-        TIME_ZONE_OFFSET = 5
-
-        # open the file 
-        asc_file = open(filepath, 'rb').read()
         filename = filepath.split('/')[-1]
-        count = 0
         if verbose:
             print('________________________________________')
             print('  Parsing Flight Controller ------------')
@@ -249,64 +599,49 @@ class SlocumFlightController(object):
         # initialize the time series object
         name   = filepath.split('/')[-1].split('.')[0]
         ts     = cls(name)
-        header = {}
-
-        # parse the ASC file 
-        with open(filepath, 'r') as f:
-            # parse the fixed file header in formation 
-            for i in range(HEADER_LEN):
-                head_line = f.readline().split(': ')
-                header[head_line[0]] = head_line[1].split('\n')[0]
-            ts._header = header
 
-            # parse the variables names, sizes
-            ts._var_names = f.readline().split(' ')[:-1]
-            ts._var_units = f.readline().split(' ')[:-1]
-            ts._var_sizes = f.readline().split(' ')[:-1]
-            ts._var_dict  = {_ : ts.var_names.index(_) for _ in ts.label_list if _ in ts.var_names}
-
-            # parse ensembles until the file is empty 
-            line = [float(_) for _ in f.readline().split(' ')[:-1]]
-            while line:
-                count += 1
-
-                # add selected variables to ensemble 
-                ensemble = np.zeros(ts.ensemble_size)
-                for var in ts.label_list:
-                    if var in ts.var_dict:
-                        val = line[ts.var_dict[var]]
-                        ts.set_data(ensemble, var, val)
-
-                # add user defined variables to ensemble 
-                ts.set_data(ensemble, 'm_filename_hash', 
-                    hash(header['filename']))
-
-                # filename changes with dive number, not mission 
-                #   + important because LMC coordinates reset each mission
-                mission = header['filename'].rsplit('-',1)[0]
-                ts.set_data(ensemble, 'm_mission_hash', hash(mission))
-
-                # convert time from EDT to UTC
-                EDT_time = ts.get_data(ensemble, 'm_present_time')
-                UTC_time = datetime.fromtimestamp(EDT_time) + \
-                    pd.Timedelta("%d hours" % TIME_ZONE_OFFSET)
-                ts.set_data(ensemble, 'time', UTC_time.timestamp())
-                ts.add_ensemble(ensemble)
-
-                # print number of ensembles parsed periodically 
-                if verbose and interval:
-                    if (count % PRINT_INTERVAL == 0):
-                        print('    # ensembles:  %5d' % (count,))
-
-                line = [float(_) for _ in f.readline().split(' ')[:-1]]
+        # look up the cache entry for the contents of the file
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = parse_cache.get_cache_path(
+                cache_dir, filepath, cls.PARSER_VERSION, tz=cls.TIME_ZONE)
+        loaded = cache_path is not None and os.path.isfile(cache_path)
+
+        # load the parsed flight log and its header from the cache 
+        if loaded:
+            ts._df, meta  = parse_cache.load_frame(cache_path)
+            ts._header    = meta['header']
+            ts._var_names = meta['var_names']
+            ts._var_units = meta['var_units']
+            ts._var_sizes = meta['var_sizes']
+            ts._var_dict  = {_ : ts.var_names.index(_) for _ in ts.label_list
+                             if _ in ts.var_names}
+            count = len(ts.df)
+
+        # otherwise parse the log and store the result in the cache 
+        else:
+            if filename.split('.')[-1].lower() == 'asc':
+                block, names = ts.read_asc(filepath)
+            else:
+                block, names = ts.read_dbd(filepath, sensor_cache_dir)
+            count = ts.add_log_rows(block, names)
+            ts.to_dataframe()
+            if cache_path is not None and ts.df is not None:
+                parse_cache.save_frame(cache_path, ts.df, 
+                    groups={'flight' : list(ts.df.columns)},
+                    meta={'header'    : ts.header,
+                          'var_names' : ts.var_names,
+                          'var_units' : ts.var_units,
+                          'var_sizes' : ts.var_sizes})
 
         # parsing completed 
-        ts.to_dataframe()
         if verbose:
             parse_stop = time.time()
             print('  Parsing Complete ---------------------')
             print('    # ensembles:  %5d'    % (count))
             print('    parsing time:  %f'    % (parse_stop - parse_start))
+            if loaded:
+                print('    loaded from:   %s'    % (cache_path,))
 
         # save the file to .csv format
         if save:
@@ -327,18 +662,110 @@ class SlocumFlightController(object):
 
 
     @classmethod
-    def from_directory(cls, directory, save=None, name=None, verbose=False):
-        """Constructor of flight controllers log from directory of .asc files 
+    def from_asc(cls, filepath, save, verbose=True, interval=True, 
+        cache_dir=None):
+        """Parses DBD (flight controller file) from the Slocum Glider.
+
+        Args: 
+            filepath: the file location of the .asc file to be parsed, which
+                is a DBD file converted to ascii (i.e. by dbd2asc)
+            save: boolean flag for saving the resulting time-series or not
+            verbose: boolean flag for printing file information while parsing
+            interval: unused, the number of ensembles is printed once the 
+                whole data block has been read
+            cache_dir: optional directory of the parse cache, see from_log.
+        """
+        return cls.from_log(filepath, save, verbose=verbose, 
+                            cache_dir=cache_dir)
+
+
+    @classmethod
+    def from_dbd(cls, filepath, save, verbose=True, cache_dir=None, 
+        sensor_cache_dir=None):
+        """Parses a binary flight log (.dbd, .ebd, .sbd, ...) directly.
+
+        Gives the same time series as from_asc on the output of dbd2asc, 
+        without converting the log to ascii first.
+
+        Args: 
+            filepath: the file location of the binary flight log.
+            save: boolean flag for saving the resulting time-series or not
+            verbose: boolean flag for printing file information while parsing
+            cache_dir: optional directory of the parse cache, see from_log.
+            sensor_cache_dir: directory of the sensor list cache, see 
+                read_dbd.
+        """
+        return cls.from_log(filepath, save, verbose=verbose, 
+                            cache_dir=cache_dir, 
+                            sensor_cache_dir=sensor_cache_dir)
+
+
+    @classmethod
+    def from_directory(cls, directory, save=None, name=None, verbose=False,
+        workers=None, cache_dir=None, extension='asc', sensor_cache_dir=None):
+        """Constructor of flight controllers log from directory of log files 
+
+        The files are parsed in parallel by a pool of processes. With a parse
+        cache, only the files that are new (or changed) since the last call
+        are parsed, and the other files are loaded from the cache.
+
+        Args:
+            directory: directory containing the flight logs to be parsed.
+            save: unused.
+            name: unused.
+            verbose: boolean flag for printing file information while parsing
+            workers: number of worker processes. By default one worker per 
+                CPU is used, and with workers=1 the files are parsed in the 
+                current process.
+            cache_dir: optional directory of the parse cache, see from_log.
+            extension: extension of the flight logs to parse, i.e. 'asc' for
+                logs converted to ascii or 'dbd' for binary logs.
+            sensor_cache_dir: directory of the sensor list cache, see 
+                read_dbd.
+
+        Returns:
+            A SlocumFlightController with the ensembles of all files, sorted 
+            by time.
         """
-        print('>> Parsing folder of ASC Files')
-        # acquire a list of all files in the provided directory 
-        file_list = [f for f in listdir(directory) if 
-                     isfile(join(directory,f)) and f.split('.')[-1] == 'asc']
-        frames    = [cls.from_asc(directory+f, save=False, verbose=verbose,
-                     interval=False).df for f in file_list]
+        if verbose:
+            print('>> Parsing folder of %s Files' % (extension.upper(),))
+        # acquire a sorted list of all files in the provided directory 
+        file_list = sorted(join(directory, f) for f in listdir(directory) if 
+                           isfile(join(directory, f)) and 
+                           f.split('.')[-1].lower() == extension.lower())
+        args      = [(f, cache_dir, sensor_cache_dir, verbose) 
+                     for f in file_list]
+
+        # parse each file in a separate process (results keep the file order)
+        if workers == 1:
+            frames = [cls.parse_file(_) for _ in args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                frames = list(executor.map(cls.parse_file, args))
+        frames    = [df for df in frames if df is not None and len(df)]
+
+        # the stable sort keeps the file order of ensembles with equal times
         ts        = cls()
-        ts._df    = pd.concat(frames)
-        ts._df.sort_index(inplace=True)
-        print('>> Finished Parsing!')
+        if frames:
+            ts._df = pd.concat(frames)
+            ts._df.sort_index(inplace=True, kind='mergesort')
+        if verbose:
+            print('>> Finished Parsing!')
         return ts
 
+
+    @classmethod
+    def parse_file(cls, args):
+        """Parses a single flight log for from_directory.
+
+        Args: 
+            args: (filepath, cache_dir, sensor_cache_dir, verbose) tuple.
+
+        Returns:
+            The DataFrame of the parsed file, or None if it has no ensembles.
+        """
+        filepath, cache_dir, sensor_cache_dir, verbose = args
+        return cls.from_log(filepath, save=False, verbose=verbose,
+                            cache_dir=cache_dir, 
+                            sensor_cache_dir=sensor_cache_dir).df
+
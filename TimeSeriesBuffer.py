@@ -0,0 +1,209 @@
+# TimeSeriesBuffer.py
+#
+# Append-optimized storage for the rows of a time series DataFrame.
+
+import numpy as np
+import pandas as pd
+import time
+
+
+class TimeSeriesBuffer(object):
+    # capacity of an empty buffer, and the factor by which a full buffer grows
+    INITIAL_CAPACITY = 1024
+    GROWTH_FACTOR    = 2
+
+    # local time is looked up once per block of seconds, see get_utc_offsets
+    OFFSET_BLOCK     = 900  # [s]
+
+    def __init__(self, columns, capacity=None, tz=None):
+        """Growable column-major array holding the rows of a time series.
+
+        Building a DataFrame by concatenating new rows to the existing
+        DataFrame copies every existing row on each call, which is quadratic
+        in the number of rows when a fresh DataFrame is needed every few
+        rows. The buffer instead collects the rows in a preallocated
+        column-major array whose capacity grows geometrically whenever it is
+        full, so appending rows costs amortized O(new rows). The DataFrame of
+        the filled rows is a view into the array and is created without
+        copying any data.
+
+        Note: a DataFrame returned by to_dataframe shares memory with the
+        buffer, but only the rows that were filled when it was created.
+
+        Args:
+            columns: the column labels of the time series.
+            capacity: initial number of rows to allocate.
+            tz: time zone of the index, or None for naive local times.
+        """
+        capacity       = capacity or self.INITIAL_CAPACITY
+        self._tz       = tz
+        self._columns  = pd.Index(columns)
+        self._data     = np.empty((capacity, len(self._columns)), order='F')
+        self._index    = np.empty(capacity, dtype='datetime64[ns]')
+        self._num_rows = 0
+
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def tz(self):
+        return self._tz
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    @property
+    def num_rows(self):
+        return self._num_rows
+
+    def __len__(self):
+        return self._num_rows
+
+
+    def reserve(self, capacity):
+        """Grows the buffer to hold at least the given number of rows.
+
+        The filled rows are copied into a new array once per growth step,
+        which keeps the cost of appending amortized O(new rows).
+        """
+        if capacity <= self.capacity:
+            return
+        new_capacity = self.capacity
+        while new_capacity < capacity:
+            new_capacity *= self.GROWTH_FACTOR
+        data  = np.empty((new_capacity, len(self.columns)), order='F')
+        index = np.empty(new_capacity, dtype='datetime64[ns]')
+        data[:self.num_rows]  = self._data[:self.num_rows]
+        index[:self.num_rows] = self._index[:self.num_rows]
+        self._data  = data
+        self._index = index
+
+
+    def append(self, rows, index):
+        """Appends rows to the end of the time series.
+
+        Args:
+            rows: array of shape (num_rows, num_columns). Rows may hold only
+                the values of the first columns, in which case the remaining
+                columns (i.e. columns added to a DataFrame of the buffer) are
+                filled with NaN.
+            index: the time stamps of the rows, i.e. a DatetimeIndex or a list
+                of datetime objects, in the time zone of the buffer.
+
+        Raises:
+            ValueError if the shapes of the rows and index do not match.
+        """
+        rows  = np.asarray(rows, dtype=float)
+        index = pd.DatetimeIndex(index).values
+        if rows.ndim != 2 or rows.shape[1] > len(self.columns):
+            raise ValueError('bad rows shape: expected = (n, %d), actual = %s'
+                             % (len(self.columns), rows.shape))
+        if len(index) != len(rows):
+            raise ValueError('bad index length: expected = %d, actual = %d' %
+                             (len(rows), len(index)))
+        start = self.num_rows
+        stop  = start + len(rows)
+        self.reserve(stop)
+        self._data[start:stop, :rows.shape[1]] = rows
+        self._data[start:stop, rows.shape[1]:] = np.nan
+        self._index[start:stop] = index
+        self._num_rows = stop
+
+
+    def to_dataframe(self):
+        """Returns a DataFrame view of the filled rows, without copying."""
+        num_rows = self.num_rows
+        index    = self._index[:num_rows]
+
+        # time zone aware indices are stored as UTC times
+        if self.tz is not None:
+            index = pd.arrays.DatetimeArray(index, 
+                        dtype=pd.DatetimeTZDtype('ns', self.tz))
+        return pd.DataFrame(self._data[:num_rows],
+                            index=pd.DatetimeIndex(index, copy=False),
+                            columns=self.columns, copy=False)
+
+
+    def is_view(self, df):
+        """Returns whether a DataFrame is an unmodified view of the buffer.
+
+        A DataFrame returned by to_dataframe stops being a view of the buffer
+        when rows or columns are added or removed, or when a column is
+        assigned (i.e. df['pitch'] = values), which replaces the array of the
+        column instead of writing into the buffer. Values that are written 
+        into the existing arrays (i.e. with df.loc) are written into the
+        buffer, and the DataFrame remains a view.
+        """
+        if df is None or len(df) != self.num_rows or \
+            not df.columns.equals(self.columns):
+            return False
+        address = lambda a: a.__array_interface__['data'][0]
+        if address(df.index.asi8) != address(self._index):
+            return False
+
+        # every column must still be backed by its column of the buffer
+        start  = address(self._data)
+        stride = self._data.strides[1]
+        return all(address(col.values) == start + i*stride 
+                   for i, (_, col) in enumerate(df.items()))
+
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Returns a buffer holding a copy of the rows of a DataFrame."""
+        buffer = cls(df.columns, max(len(df), cls.INITIAL_CAPACITY), 
+                     df.index.tz)
+        buffer.append(df.to_numpy(dtype=float), df.index)
+        return buffer
+
+
+    @classmethod
+    def get_datetime_index(cls, t, tz=None):
+        """Returns the DatetimeIndex of an array of times since the epoch.
+
+        The conversion is vectorized, instead of calling 
+        datetime.fromtimestamp for every time. Times are rounded to the 
+        microsecond like datetime.fromtimestamp.
+
+        Args:
+            t: array of seconds since the epoch (UTC).
+            tz: time zone of the index (i.e. 'UTC'). If None, the index holds
+                naive local times, identical to datetime.fromtimestamp.
+        """
+        US_PER_S = 1000000
+        t   = np.asarray(t, dtype=float)
+        sec = np.trunc(t)
+        us  = sec.astype(np.int64)*US_PER_S + \
+              np.round((t - sec)*US_PER_S).astype(np.int64)
+        if tz is not None:
+            return pd.to_datetime(us, unit='us', utc=True).tz_convert(tz)
+        local = us + cls.get_utc_offsets(us // US_PER_S)*US_PER_S
+        return pd.DatetimeIndex(local.astype('datetime64[us]')
+                                     .astype('datetime64[ns]'))
+
+
+    @classmethod
+    def get_utc_offsets(cls, sec):
+        """Returns the UTC offset of local time at the given times [s].
+
+        The offsets match time.localtime, but localtime is only called at the
+        start and end of each block of OFFSET_BLOCK seconds that holds a time. 
+        Times in a block with a time zone transition are looked up one by one.
+
+        Args:
+            sec: integer array of seconds since the epoch (UTC).
+        """
+        sec = np.asarray(sec, dtype=np.int64)
+        blocks, inverse = np.unique(sec // cls.OFFSET_BLOCK, 
+                                    return_inverse=True)
+        start   = np.array([time.localtime(_).tm_gmtoff for _ in 
+                            blocks*cls.OFFSET_BLOCK], dtype=np.int64)
+        end     = np.array([time.localtime(_).tm_gmtoff for _ in 
+                            (blocks + 1)*cls.OFFSET_BLOCK - 1], dtype=np.int64)
+        offsets = start[inverse]
+        changed = (start != end)[inverse]
+        offsets[changed] = [time.localtime(_).tm_gmtoff for _ in sec[changed]]
+        return offsets
@@ -0,0 +1,49 @@
+# benchmark_construction.py
+#
+# Micro-benchmark for constructing Pathfinder DVL objects. Compares the cost 
+# of the PathfinderDVL constructor (which used to rebuild every label list 
+# and lookup table) against allocating the data array of an ensemble, and 
+# reports the resulting per-ensemble parse time of PathfinderEnsemble.
+#
+# usage: python benchmarks/benchmark_construction.py [num_ensembles]
+
+import numpy as np
+import os
+import sys
+import timeit
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import synthetic_data
+from PathfinderDVL import PathfinderDVL
+from PathfinderEnsemble import PathfinderEnsemble
+
+
+def main(num_ensembles=500, repeat=5):
+    pd0_bytes = synthetic_data.make_pd0(num_ensembles)
+    size      = PathfinderDVL().ensemble_size
+
+    def run_parse():
+        prev_ensemble = None
+        offset        = 0
+        while offset < len(pd0_bytes):
+            ensemble = PathfinderEnsemble(pd0_bytes[offset:], prev_ensemble)
+            offset  += ensemble.num_bytes + 2
+            prev_ensemble = ensemble
+
+    # time the construction of a single object
+    number  = 10000
+    t_dvl   = min(timeit.repeat(PathfinderDVL, number=number,
+                                repeat=repeat)) / number
+    t_array = min(timeit.repeat(lambda: np.zeros(size), number=number,
+                                repeat=repeat)) / number
+    t_parse = min(timeit.repeat(run_parse, number=1,
+                                repeat=repeat)) / num_ensembles
+
+    print('- Construction (per object) ------------')
+    print('    PathfinderDVL: %8.2f us' % (t_dvl*1e6))
+    print('    data array:    %8.2f us' % (t_array*1e6))
+    print('- Ensemble Parsing ---------------------')
+    print('    per ensemble:  %8.2f us' % (t_parse*1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(_) for _ in sys.argv[1:2]])
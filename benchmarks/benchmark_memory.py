@@ -0,0 +1,46 @@
+# benchmark_memory.py
+#
+# Micro-benchmark for the memory footprint of PathfinderEnsemble objects that
+# are kept in memory, either with their own data arrays or as views into the
+# rows of a single preallocated array.
+#
+# usage: python benchmarks/benchmark_memory.py [num_ensembles]
+
+import numpy as np
+import os
+import sys
+import tracemalloc
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import synthetic_data
+from PathfinderDVL import PathfinderDVL
+from PathfinderTimeSeries import PathfinderTimeSeries
+
+
+def get_footprint(pd0_file, data_array=None):
+    """Returns the number of bytes allocated per ensemble kept in memory."""
+    # parse the file once first so that lazy imports are not measured 
+    for _ in PathfinderTimeSeries.iter_ensembles(pd0_file):
+        pass
+    tracemalloc.start()
+    ensembles = list(PathfinderTimeSeries.iter_ensembles(
+        pd0_file, data_array=data_array))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(ensembles)
+
+
+def main(num_ensembles=2000):
+    pd0_file   = memoryview(synthetic_data.make_pd0(num_ensembles))
+    row_size   = PathfinderDVL().ensemble_size * np.dtype(float).itemsize
+    separate   = get_footprint(pd0_file)
+    data_array = np.zeros((num_ensembles, PathfinderDVL().ensemble_size))
+    views      = get_footprint(pd0_file, data_array)
+
+    print('- Memory Footprint (per ensemble) ------')
+    print('    data row:      %8d bytes' % (row_size,))
+    print('    own arrays:    %8d bytes' % (separate,))
+    print('    row views:     %8d bytes (+ preallocated row)' % (views,))
+
+
+if __name__ == '__main__':
+    main(*[int(_) for _ in sys.argv[1:2]])
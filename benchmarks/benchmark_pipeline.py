@@ -0,0 +1,272 @@
+# benchmark_pipeline.py
+#
+# Benchmark of the end-to-end navigation pipeline on synthetic dives. Every
+# stage (parsing the pd0 file, parsing the flight controller log, time
+# synchronization, the water column, odometry and terrain-aided navigation,
+# and the real-time NavigationEngine) is timed over each dive, and the
+# throughput, latency percentiles and peak memory of every stage are written
+# to a JSON file, so that regressions can be tracked between versions.
+#
+# Stages that loop over the pings report the latency of every ping; stages
+# that process a whole dive at once report the latency of every dive. Peak
+# memory is measured with tracemalloc over a separate run of the first dive,
+# so that tracing does not slow down the timed runs.
+#
+# usage: python benchmarks/benchmark_pipeline.py [num_ensembles]
+#            [max_good_bins] [num_dives] [output json]
+
+import datetime
+import json
+import numpy as np
+import os
+import pandas as pd
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import navigation_replay
+import synthetic_data
+from DeadReckoning import DeadReckoning
+from NavigationEngine import NavigationEngine
+from PathfinderTimeSeries import PathfinderTimeSeries
+from SlocumFlightController import SlocumFlightController
+
+
+# search radius of the TAN fixes when timing the TAN stage [m]
+TAN_RADIUS = 100
+
+
+def make_bathy_df(num_cells=200, resolution=10, seed=0):
+    """Returns a synthetic bathymetry map of num_cells x num_cells cells
+    centered on the origin, in the format of NavigationEngine.bathy_df."""
+    rng  = np.random.default_rng(seed)
+    x, y = np.meshgrid((np.arange(num_cells) - num_cells/2)*resolution,
+                       (np.arange(num_cells) - num_cells/2)*resolution)
+    return pd.DataFrame({
+        'utm_x_list'  : x.ravel(),
+        'utm_y_list'  : y.ravel(),
+        'depth_list'  : rng.uniform(0, 100, x.size),
+        'slope_list'  : rng.uniform(0, 40,  x.size),
+        'orient_list' : rng.uniform(-180, 180, x.size),
+    })
+
+
+def make_dive(directory, num_ensembles, max_good_bins, seed):
+    """Writes the pd0 file and flight controller log of a synthetic dive.
+
+    The flight controller cycles every 4 s (twice the ping period) over the
+    whole dive, and logs its present time in EDT.
+
+    Returns:
+        (pd0 filepath, asc filepath) tuple.
+    """
+    pd0_path = os.path.join(directory, 'dive_%d.pd0' % (seed,))
+    asc_path = os.path.join(directory, 'dive_%d.asc' % (seed,))
+    synthetic_data.write_pd0(pd0_path, num_ensembles, seed=seed,
+                             max_good_bins=max_good_bins)
+    start = next(PathfinderTimeSeries.iter_pd0(pd0_path)).time
+    synthetic_data.write_asc(asc_path, num_rows=num_ensembles//2 + 10,
+                             seed=seed, start_time=start - 5*3600 - 10)
+    return pd0_path, asc_path
+
+
+def get_stages(pd0_path, asc_path, bathy_df):
+    """Returns the (name, function) stages of the pipeline of a dive.
+
+    Stages are run in order and share their results through a dictionary.
+    Functions that loop over the pings return the latency of every ping
+    [s], the others return None.
+    """
+    state = {}
+
+    def parse():
+        state['ts'] = PathfinderTimeSeries.from_pd0(pd0_path, save=False,
+                                                    verbose=False)
+
+    def flight_log():
+        state['fc'] = SlocumFlightController.from_asc(asc_path, save=False,
+                                                      verbose=False)
+
+    def time_sync():
+        state['attitude'] = state['ts'].sync_flight_controller(state['fc'])
+
+    def water_column():
+        df        = state['ts'].df
+        ensembles = state['ensembles']
+        engine    = NavigationEngine(
+            water_column=NavigationEngine().get_water_column(ensembles[0]),
+            max_nodes_per_bin=None)
+        latencies = []
+        for i, ensemble in enumerate(ensembles):
+            tic = time.perf_counter()
+            vtw = engine.dead_reckoning.get_through_water_velocities(
+                {var : [ensemble.get_data(var)] for var in
+                 NavigationEngine.ODOMETRY_VARS})[0]
+            engine.update_water_column(ensemble, vtw, df.pitch.values[i],
+                                       df.roll.values[i])
+            latencies.append(time.perf_counter() - tic)
+        state['water_column'] = engine.water_column
+        return latencies
+
+    def odometry():
+        df             = state['ts'].df
+        dead_reckoning = DeadReckoning()
+        voc            = dead_reckoning.get_ocean_currents(
+                             df, state['water_column'])
+        resets         = dead_reckoning.get_gps_resets(df, state['fc'])
+        state['odometry'] = dead_reckoning.compute_odometry(df, voc, resets)
+
+    def tan():
+        df        = state['ts'].df
+        odometry  = state['odometry']
+        position  = odometry[['rel_pos_x', 'rel_pos_y', 'rel_pos_z']].values
+        attitude  = df[['pitch', 'roll', 'heading']].values
+        engine    = NavigationEngine(bathy_df=bathy_df)
+        latencies = []
+        for i, ensemble in enumerate(state['ensembles']):
+            tic     = time.perf_counter()
+            factors = engine.update_point_cloud(ensemble, position[i],
+                                                *attitude[i], time_index=i)
+            if not np.isnan(factors[0]):
+                engine.get_tan_fix(factors[0], factors[1], position[i, :2],
+                                   TAN_RADIUS)
+            latencies.append(time.perf_counter() - tic)
+        return latencies
+
+    def navigation():
+        engine    = NavigationEngine(bathy_df=bathy_df)
+        states    = navigation_replay.get_flight_states(state['fc'])
+        latencies = []
+        for ensemble in state['ensembles']:
+            tic = time.perf_counter()
+            engine.update(ensemble, navigation_replay.get_flight_state(
+                states, ensemble.time))
+            latencies.append(time.perf_counter() - tic)
+        return latencies
+
+    # the per-ping stages are given the parsed ensembles
+    state['ensembles'] = list(PathfinderTimeSeries.iter_pd0(pd0_path))
+    return [
+        ('parse',        parse),
+        ('flight_log',   flight_log),
+        ('time_sync',    time_sync),
+        ('water_column', water_column),
+        ('odometry',     odometry),
+        ('tan',          tan),
+        ('navigation',   navigation),
+    ]
+
+
+def run_dive(pd0_path, asc_path, bathy_df, trace=False):
+    """Runs every stage of the pipeline over a dive.
+
+    Args:
+        trace: boolean flag for measuring the peak memory of every stage
+            with tracemalloc instead of its duration.
+
+    Returns:
+        dictionary of each stage to its (duration [s], latencies) tuple,
+        or to its peak memory [bytes] if trace is used.
+    """
+    results = {}
+    for name, stage in get_stages(pd0_path, asc_path, bathy_df):
+        if trace:
+            tracemalloc.start()
+            start = tracemalloc.get_traced_memory()[0]
+            stage()
+            results[name] = tracemalloc.get_traced_memory()[1] - start
+            tracemalloc.stop()
+            continue
+        tic       = time.perf_counter()
+        latencies = stage()
+        results[name] = (time.perf_counter() - tic, latencies)
+    return results
+
+
+def get_percentiles(latencies):
+    """Returns the mean, percentiles and max of latencies [ms]."""
+    latencies = np.asarray(latencies)*1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'mean' : float(latencies.mean()),
+        'p50'  : float(p50),
+        'p95'  : float(p95),
+        'p99'  : float(p99),
+        'max'  : float(latencies.max()),
+    }
+
+
+def get_environment():
+    """Returns the versions that the benchmark was run with."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date'     : datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit'   : commit,
+        'python'   : platform.python_version(),
+        'numpy'    : np.__version__,
+        'pandas'   : pd.__version__,
+        'platform' : platform.platform(),
+    }
+
+
+def main(num_ensembles=500, max_good_bins=40, num_dives=3,
+         output='benchmark_pipeline.json'):
+    warnings.simplefilter('ignore')
+    bathy_df = make_bathy_df()
+    with tempfile.TemporaryDirectory() as directory:
+        dives   = [make_dive(directory, num_ensembles, max_good_bins, seed)
+                   for seed in range(num_dives)]
+        timings = [run_dive(*dive, bathy_df) for dive in dives]
+        memory  = run_dive(*dives[0], bathy_df, trace=True)
+
+    # combine the stages over the dives
+    stages = {}
+    for name in timings[0]:
+        durations = np.array([_[name][0] for _ in timings])
+        per_ping  = timings[0][name][1] is not None
+        latencies = np.concatenate([_[name][1] for _ in timings]) \
+                    if per_ping else durations
+        stages[name] = {
+            'seconds'        : float(durations.sum()),
+            'pings_per_sec'  : float(num_dives*num_ensembles /
+                                     durations.sum()),
+            'latency_unit'   : 'ping' if per_ping else 'dive',
+            'latency_ms'     : get_percentiles(latencies),
+            'peak_memory_mb' : memory[name] / 2**20,
+        }
+    results = {
+        'environment' : get_environment(),
+        'parameters'  : {
+            'num_ensembles' : num_ensembles,
+            'max_good_bins' : max_good_bins,
+            'num_dives'     : num_dives,
+        },
+        'stages'      : stages,
+    }
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print('- Pipeline (%d dives x %d pings) ------' %
+          (num_dives, num_ensembles))
+    print('    %-13s %9s %9s %9s %9s %9s' % ('stage', 'pings/s', 'p50 ms',
+          'p99 ms', 'per', 'peak MB'))
+    for name, stage in stages.items():
+        print('    %-13s %9.0f %9.3f %9.3f %9s %9.2f' % (name,
+              stage['pings_per_sec'], stage['latency_ms']['p50'],
+              stage['latency_ms']['p99'], stage['latency_unit'],
+              stage['peak_memory_mb']))
+    print('    saved to %s' % (output,))
+    return results
+
+
+if __name__ == '__main__':
+    main(*[int(_) for _ in sys.argv[1:4]], *sys.argv[4:5])
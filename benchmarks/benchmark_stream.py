@@ -0,0 +1,56 @@
+# benchmark_stream.py
+#
+# Benchmark for framing, validating and parsing a live pd0 byte stream with
+# PathfinderStream. The bytes of a synthetic dive are fed in chunks of the
+# given size, as they would arrive from a serial port or a TCP socket, and
+# the ensembles parsed per second are compared with reading the same bytes
+# with PathfinderTimeSeries.iter_ensembles.
+#
+# usage: python benchmarks/benchmark_stream.py [num_ensembles] [chunk_size]
+
+import os
+import sys
+import timeit
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import synthetic_data
+from PathfinderStream import PathfinderStream
+from PathfinderTimeSeries import PathfinderTimeSeries
+
+
+def main(num_ensembles=500, chunk_size=4096, repeat=5):
+    pd0_bytes = synthetic_data.make_pd0(num_ensembles)
+    chunks    = [pd0_bytes[i:i + chunk_size]
+                 for i in range(0, len(pd0_bytes), chunk_size)]
+
+    def run_stream():
+        stream = PathfinderStream()
+        for chunk in chunks:
+            stream.feed(chunk)
+        stream.close()
+        assert stream.stats['num_ensembles'] == num_ensembles
+
+    def run_frame():
+        stream = PathfinderStream()
+        for chunk in chunks:
+            stream.frame(chunk)
+
+    def run_parse():
+        for _ in PathfinderTimeSeries.iter_ensembles(memoryview(pd0_bytes)):
+            pass
+
+    t_stream = min(timeit.repeat(run_stream, number=1, repeat=repeat))
+    t_frame  = min(timeit.repeat(run_frame,  number=1, repeat=repeat))
+    t_parse  = min(timeit.repeat(run_parse,  number=1, repeat=repeat))
+
+    print('- Stream (%d ensembles, %d byte chunks) -----' %
+          (num_ensembles, chunk_size))
+    print('    stream:        %8.0f ensembles/s' % (num_ensembles/t_stream))
+    print('    framing only:  %8.0f ensembles/s' % (num_ensembles/t_frame))
+    print('    file parsing:  %8.0f ensembles/s' % (num_ensembles/t_parse))
+    print('- Per Ensemble -------------------------')
+    print('    stream:        %8.2f us' % (t_stream/num_ensembles*1e6))
+    print('    framing only:  %8.2f us' % (t_frame/num_ensembles*1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(_) for _ in sys.argv[1:3]])
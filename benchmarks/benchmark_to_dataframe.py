@@ -0,0 +1,52 @@
+# benchmark_to_dataframe.py
+#
+# Benchmark for refreshing the DataFrame of a growing time series, as in
+# real-time use where a fresh DataFrame is needed every few pings. Compares 
+# concatenating the new rows to the existing DataFrame (which copies every 
+# existing row on each call) against appending them to a TimeSeriesBuffer.
+#
+# usage: python benchmarks/benchmark_to_dataframe.py [num_rows] [rows_per_call]
+
+import numpy as np
+import os
+import pandas as pd
+import sys
+import time
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from PathfinderDVL import PathfinderDVL
+from TimeSeriesBuffer import TimeSeriesBuffer
+
+
+def main(num_rows=5000, rows_per_call=5):
+    columns = PathfinderDVL().label_list
+    data    = np.random.default_rng(0).random((num_rows, len(columns)))
+    index   = pd.date_range('2019-11-22', periods=num_rows, freq='s')
+    blocks  = range(0, num_rows, rows_per_call)
+
+    # concatenate the new rows to the existing DataFrame
+    start = time.perf_counter()
+    df    = None
+    for i in blocks:
+        new_df = pd.DataFrame(data[i:i+rows_per_call], columns=columns,
+                              index=index[i:i+rows_per_call])
+        df = new_df if df is None else pd.concat([df, new_df])
+    t_concat = time.perf_counter() - start
+
+    # append the new rows to a buffer and view the filled rows
+    start  = time.perf_counter()
+    buffer = TimeSeriesBuffer(columns)
+    for i in blocks:
+        buffer.append(data[i:i+rows_per_call], index[i:i+rows_per_call])
+        df_buffer = buffer.to_dataframe()
+    t_buffer = time.perf_counter() - start
+    assert df.equals(df_buffer)
+
+    print('- Refreshing DataFrame -----------------')
+    print('    # rows:        %8d'    % (num_rows,))
+    print('    # calls:       %8d'    % (len(blocks),))
+    print('    pd.concat:     %8.3f s' % (t_concat,))
+    print('    buffer:        %8.3f s' % (t_buffer,))
+
+
+if __name__ == '__main__':
+    main(*[int(_) for _ in sys.argv[1:3]])
@@ -0,0 +1,76 @@
+# benchmark_unpack.py
+#
+# Micro-benchmark for unpacking the fixed-size sections of a pd0 ensemble.
+# Compares unpacking one variable at a time from the format tuples against
+# unpacking each section with the struct compiled by PathfinderDVL, and 
+# reports the resulting per-ensemble parse time of PathfinderEnsemble.
+#
+# usage: python benchmarks/benchmark_unpack.py [num_ensembles]
+
+import os
+import struct
+import sys
+import timeit
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import synthetic_data
+from PathfinderDVL import PathfinderDVL
+from PathfinderTimeSeries import PathfinderTimeSeries
+
+
+def unpack_per_variable(pd0_bytes, format_tuples, offset=0):
+    """Unpacks a section one variable at a time (the previous method)."""
+    data = {}
+    for var_name, var_format, var_offset in format_tuples:
+        struct.calcsize(var_format)
+        data[var_name] = struct.unpack_from(var_format, pd0_bytes, 
+                                            offset + var_offset)[0]
+    return(data)
+
+
+def unpack_compiled(pd0_bytes, codec, offset=0):
+    """Unpacks a section with a single call to the compiled struct."""
+    var_struct, var_names = codec
+    return(dict(zip(var_names, var_struct.unpack_from(pd0_bytes, offset))))
+
+
+def main(num_ensembles=500, repeat=5):
+    dvl       = PathfinderDVL()
+    pd0_bytes = synthetic_data.make_pd0(num_ensembles)
+    sections  = [
+        (dvl.header_format,          dvl.header_codec,           0),
+        (dvl.fixed_leader_format,    dvl.fixed_leader_codec,    20),
+        (dvl.variable_leader_format, dvl.variable_leader_codec, 78),
+        (dvl.bottom_track_format,    dvl.bottom_track_codec,   963),
+    ]
+
+    def run_per_variable():
+        for format_tuples, _, offset in sections:
+            unpack_per_variable(pd0_bytes, format_tuples, offset)
+
+    def run_compiled():
+        for _, codec, offset in sections:
+            unpack_compiled(pd0_bytes, codec, offset)
+
+    def run_parse():
+        for _ in PathfinderTimeSeries.iter_ensembles(memoryview(pd0_bytes)):
+            pass
+
+    # time the section unpacking for a single ensemble
+    number = 2000
+    t_per_variable = min(timeit.repeat(run_per_variable, number=number,
+                                       repeat=repeat)) / number
+    t_compiled     = min(timeit.repeat(run_compiled,     number=number,
+                                       repeat=repeat)) / number
+    t_parse        = min(timeit.repeat(run_parse, number=1,
+                                       repeat=repeat)) / num_ensembles
+
+    print('- Section Unpacking (per ensemble) -----')
+    print('    per variable:  %8.2f us' % (t_per_variable*1e6))
+    print('    compiled:      %8.2f us' % (t_compiled*1e6))
+    print('    speedup:       %8.2f x'  % (t_per_variable/t_compiled))
+    print('- Ensemble Parsing ---------------------')
+    print('    per ensemble:  %8.2f us' % (t_parse*1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(_) for _ in sys.argv[1:2]])
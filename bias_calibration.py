@@ -0,0 +1,143 @@
+# bias_calibration.py
+#
+# Calibration of the DVL mounting bias angles against GPS surfacing fixes.
+# Every candidate (pitch, roll, heading) bias is scored by how far the DVL
+# odometry of each dive ends up from the GPS fix taken when the glider
+# surfaces, relative to the GPS fix taken before the dive. The candidates are
+# evaluated with PathfinderTimeSeries.reproject, so no pd0 file is parsed
+# again, and the candidates are split over a pool of worker processes.
+
+import copy
+import itertools
+import numpy as np
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+
+def get_gps_fixes(df_dbd, x_var='m_gps_x_lmc', y_var='m_gps_y_lmc'):
+    """Returns the valid GPS fixes of a flight controller log.
+
+    Args:
+        df_dbd: DataFrame of a flight controller log, for example the df of a
+            SlocumFlightController, with a 'time' column in seconds.
+        x_var: variable of the x position of the GPS fixes [m].
+        y_var: variable of the y position of the GPS fixes [m].
+
+    Returns:
+        (time, xy) tuple of the times of the fixes in increasing order and
+        an array of shape (num_fixes, 2) of their positions.
+    """
+    time  = df_dbd['time'].to_numpy(dtype=float)
+    xy    = df_dbd[[x_var, y_var]].to_numpy(dtype=float)
+    valid = ~np.isnan(xy).any(axis=1) & ~np.isnan(time)
+    order = np.argsort(time[valid], kind='mergesort')
+    return time[valid][order], xy[valid][order]
+
+
+def get_odometry_errors(ts, gps_fixes):
+    """Returns the odometry error of each dive against the GPS fixes.
+
+    The displacement of the dead-reckoned position over a dive is compared
+    with the displacement between the last GPS fix before the dive and the
+    first GPS fix after the dive. Dives without a GPS fix on both sides are
+    left out.
+
+    Args:
+        ts: PathfinderTimeSeries with the derived variables.
+        gps_fixes: (time, xy) tuple, see get_gps_fixes.
+
+    Returns:
+        array of the horizontal odometry error of each dive [m].
+    """
+    gps_time, gps_xy = gps_fixes
+    time   = ts.df['time'].to_numpy()
+    pos    = ts.df[['rel_pos_x_dvl_dr', 'rel_pos_y_dvl_dr']].to_numpy()
+    errors = []
+    for rows in ts.get_dive_rows():
+        if len(rows) == 0:
+            continue
+        start = np.searchsorted(gps_time, time[rows[0]],  side='right') - 1
+        end   = np.searchsorted(gps_time, time[rows[-1]], side='left')
+        if start < 0 or end == len(gps_time):
+            continue
+        odometry = pos[rows[-1]]  - pos[rows[0]]
+        gps      = gps_xy[end]    - gps_xy[start]
+        errors.append(np.linalg.norm(odometry - gps))
+    return np.array(errors)
+
+
+def evaluate_biases(args):
+    """Returns the odometry error of a list of candidate bias angles.
+
+    Args:
+        args: (ts, gps_fixes, candidates) tuple, where candidates is a list
+            of (bias_pitch, bias_roll, bias_heading) tuples [deg].
+
+    Returns:
+        list of the root mean square odometry error over the dives for each
+        candidate [m], or NaN if no dive has GPS fixes on both sides.
+    """
+    ts, gps_fixes, candidates = args
+    scores = []
+    for bias_pitch, bias_roll, bias_heading in candidates:
+        # reproject a shallow copy, which leaves the given time series as is
+        candidate = copy.copy(ts)
+        candidate.reproject(bias_pitch=bias_pitch, bias_roll=bias_roll,
+                            bias_heading=bias_heading)
+        errors = get_odometry_errors(candidate, gps_fixes)
+        scores.append(np.sqrt(np.mean(errors**2)) if len(errors) else np.nan)
+    return scores
+
+
+def calibrate_mounting_bias(ts, df_dbd, bias_pitch, bias_roll=(0,),
+    bias_heading=(0,), workers=None):
+    """Finds the mounting bias angles that best match the GPS fixes.
+
+    Every combination of the candidate angles is scored by the root mean
+    square odometry error over the dives of the time series, see
+    get_odometry_errors.
+
+    Args:
+        ts: PathfinderTimeSeries of one or more dives, holding every variable.
+        df_dbd: DataFrame of the flight controller log with the GPS fixes,
+            for example the df of a SlocumFlightController.
+        bias_pitch: candidate values of BIAS_PITCH [deg].
+        bias_roll: candidate values of BIAS_ROLL [deg].
+        bias_heading: candidate values of BIAS_HEADING [deg].
+        workers: number of worker processes. By default one worker per CPU
+            is used, and with workers=1 the candidates are evaluated in the
+            current process.
+
+    Returns:
+        (best, errors) tuple of a dictionary of the best bias angles and
+        their error, and a Series of the error of every candidate indexed by
+        (bias_pitch, bias_roll, bias_heading), i.e. the error surface.
+
+    Raises:
+        ValueError if no dive has GPS fixes before and after it.
+    """
+    gps_fixes  = get_gps_fixes(df_dbd)
+    candidates = list(itertools.product(bias_pitch, bias_roll, bias_heading))
+
+    # evaluate contiguous blocks of candidates in separate processes
+    if workers == 1:
+        scores = evaluate_biases((ts, gps_fixes, candidates))
+    else:
+        num_blocks = min(workers or os.cpu_count() or 1, len(candidates))
+        blocks     = np.array_split(np.arange(len(candidates)), num_blocks)
+        args       = [(ts, gps_fixes, [candidates[i] for i in block])
+                      for block in blocks]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            scores = [score for block_scores in 
+                      executor.map(evaluate_biases, args)
+                      for score in block_scores]
+
+    index  = pd.MultiIndex.from_tuples(candidates, names=['bias_pitch',
+                                       'bias_roll', 'bias_heading'])
+    errors = pd.Series(scores, index=index, name='error')
+    if errors.isna().all():
+        raise ValueError('no dive has GPS fixes before and after it')
+    best = dict(zip(index.names, errors.idxmin()))
+    best['error'] = errors.min()
+    return best, errors
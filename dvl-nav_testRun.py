@@ -34,6 +34,7 @@ import PathfinderTimeSeries
 
 # objects for estimating ocean current velocities
 import VelocityShearPropagation
+import DeadReckoning
 
 # objects for controlling thruster to minimize transport cost 
 import AdaptiveVelocityController
@@ -54,6 +55,7 @@ def reload_modules():
     importlib.reload(PathfinderEnsemble)
     importlib.reload(PathfinderTimeSeries)
     importlib.reload(VelocityShearPropagation)
+    importlib.reload(DeadReckoning)
     importlib.reload(AdaptiveVelocityController)
     importlib.reload(SlocumFlightController)
     importlib.reload(SlocumScienceController)
@@ -143,66 +145,13 @@ ts = tsa
 ts_label = 'A'
 #%% Time Synchronization Fix
 
-#extract the relevant portion of the glider flight computer
-start_t = datetime.datetime.fromtimestamp(ts.df.time[0])
-end_t   = datetime.datetime.fromtimestamp(ts.df.time[-1])
-dur     = end_t - start_t 
-df_dbd  = ts_flight_kolumbo_all.df[str(start_t):str(end_t)].copy()
-
+# interpolate the attitude of the glider flight computer at the DVL times
 RAD_TO_DEG = 180/np.pi
-new_pitch_list = [] 
-new_roll_list = []
-new_heading_list = []
-
-for t in range(len(ts.df)):
-    # extract timestamp from PD0 file and corresponding sections of DBD file
-    time   = ts.df.time[t]
-    target = datetime.datetime.fromtimestamp(time)
-    lower  = df_dbd[:str(target)]
-    upper  = df_dbd[str(target):]
-    
-    # handle edge cases when interpolation is not possible  
-    if len(lower)==0:
-        new_pitch_list.append(upper.m_pitch[0]*RAD_TO_DEG)
-        new_roll_list.append(upper.m_roll[0]*RAD_TO_DEG)
-        new_heading_list.append(upper.m_heading[0]*RAD_TO_DEG)
-        continue
-    if len(upper)==0:
-        new_pitch_list.append(lower.m_pitch[-1]*RAD_TO_DEG)
-        new_roll_list.append(lower.m_roll[-1]*RAD_TO_DEG)
-        new_heading_list.append(lower.m_heading[-1]*RAD_TO_DEG)
-        continue 
-
-    lower_time  = lower.time[-1]
-    lower_pitch = lower.m_pitch[-1]
-    lower_roll  = lower.m_roll[-1]
-    lower_heading   = lower.m_heading[-1]
-    upper_time  = upper.time[0]
-    upper_pitch = upper.m_pitch[0]
-    upper_roll  = upper.m_roll[0]
-    upper_heading   = upper.m_heading[0]
-    delta_t     = upper_time-lower_time
-    
-    # case when DBD data is repeated in successive timestamps
-    if delta_t == 0:
-        new_pitch_list.append(lower.m_pitch[-1]*RAD_TO_DEG)
-        new_roll_list.append(lower.m_roll[-1]*RAD_TO_DEG)
-        new_heading_list.append(lower.m_heading[-1]*RAD_TO_DEG)
-        continue
-        
-    # take linear interpolation between DBD values
-    lower_per   = (time-lower_time)/delta_t
-    upper_per   = 1 - lower_per
-    new_pitch   = lower_pitch*lower_per + upper_pitch*upper_per
-    new_pitch_list.append(new_pitch*RAD_TO_DEG)
-    new_roll   = lower_roll*lower_per + upper_roll*upper_per
-    new_roll_list.append(new_roll*RAD_TO_DEG)
-    new_heading   = lower_heading*lower_per + upper_heading*upper_per
-    new_heading_list.append(new_heading*RAD_TO_DEG)
-    
-ts.df['pitch'] = new_pitch_list
-ts.df['roll']  = new_roll_list
-ts.df['heading']   = new_heading_list
+df_sync    = ts.sync_flight_controller(ts_flight_kolumbo_all, 
+                                       ['m_pitch', 'm_roll', 'm_heading'])
+ts.df['pitch']   = df_sync.m_pitch*RAD_TO_DEG
+ts.df['roll']    = df_sync.m_roll*RAD_TO_DEG
+ts.df['heading'] = df_sync.m_heading*RAD_TO_DEG
 print('> New pitch, roll, and heading data extracted!')
 
 #%% Compute Water Column Currents
@@ -340,20 +289,6 @@ print("> Finished Estimating Water Column Currents!")
 ### Test Run for time updated Ocean currents
 # How long (in mins) will algorithm accept ocean current estimates i.e. forgetting factor
 ocean_current_time_filter = 15 # mins
-    
-# initialize list for new odometry
-rel_pos_x = [0]
-rel_pos_y = [0]
-rel_pos_z = [0]
-delta_x_list = [0]
-delta_y_list = [0]
-
-vel_list_x = []
-vel_list_y = []
-u_list     = []
-v_list     = []
-# set flag for setting GPS updates
-flag_gps_fix_at_surface = False 
 
 # extract the relevant portion of the glider flight computer
 start_t = datetime.datetime.fromtimestamp(ts.df.time[0])
@@ -368,133 +303,19 @@ for t in range(len(df_dbd)):
         dbd_origin_y = df_dbd.m_y_lmc[t]
         break
 
-# iterate through the dive file to update odometry
-for t in range(1,len(ts.df)):
-    time    = ts.df.time[t]
-    prev_x  = rel_pos_x[-1]
-    prev_y  = rel_pos_y[-1]
-    delta_t = ts.df.delta_t[t]
-    depth   = ts.df.depth[t]
-    
-    # only use Vtw from pressure sensor when submerged 
-    depth = ts.df.depth[t]
-    if depth > near_surface_filter:
-        vtw_u = ts.df.rel_vel_pressure_u[t]
-        vtw_v = ts.df.rel_vel_pressure_v[t]
-        flag_gps_fix_at_surface = False
-    # otherwise use the DVL to estimate the Vtw at the surface
-    else:
-        vtw_u = ts.df.rel_vel_dvl_u[t]
-        vtw_v = ts.df.rel_vel_dvl_v[t]
-    
-    # retrieve over ground velocity from DVL in bottom track 
-    vog_u = ts.df.abs_vel_btm_u[t]
-    vog_v = ts.df.abs_vel_btm_v[t]
-    
-    #################################################################
-    # retrieve ocean current estimate from water column 
-    #voc_u = voc_u_list[int(depth)]
-    #voc_v = voc_v_list[int(depth)]
-    good_node_list = []
-    count = 0
-    cum_voc_u = 0
-    cum_voc_v = 0
-    # Extract all shear nodes at current depth
-    wc_depth = water_column.get_wc_bin(depth)
-    node_list = water_column.get_voc_at_depth(wc_depth)
-    
-    #Iterate through shear nodes at depth
-    for shear_node in node_list:
-        voc = shear_node.voc
-        if not(voc.is_none()):
-            # filter out large values when computing averages
-            if voc.mag < voc_mag_filter:
-                good_node_list.append(shear_node)
-            
-    if (len(good_node_list) > 0):
-        for i in range(len(good_node_list)):
-            if i == 0:
-                count += 1
-                cum_voc_u += good_node_list[0].voc.u
-                cum_voc_v += good_node_list[0].voc.v
-            else: 
-                time_between_current_estimates = good_node_list[i].t - good_node_list[0].t
-                if time_between_current_estimates > (ocean_current_time_filter*60):
-                    count += 1 
-                    cum_voc_u += good_node_list[i].voc.u
-                    cum_voc_v += good_node_list[i].voc.v
-        #voc_avg = OceanCurrent(cum_voc_u/count, cum_voc_v/count, 0)
-        voc_u = cum_voc_u/count
-        voc_v = cum_voc_v/count
-        u_list.append(voc_u)
-        v_list.append(voc_v)
-                
-    else:
-        voc_u = np.nan
-        voc_v = np.nan
-        u_list.append(voc_u)
-        v_list.append(voc_v)
-    
-    #################################################################
-    # initialize delta values to zero
-    delta_x, delta_y = 0,0
-    
-    # CASE 1: use bottom track overground velocity if available
-    if (not np.isnan(vog_u)):
-        delta_x = vog_u*delta_t
-        delta_y = vog_v*delta_t
-        vel_list_x.append(vog_u)
-        vel_list_y.append(vog_v)
-        
-    # CASE 2: use through water velocity and ocean current estimate if available
-    elif (not np.isnan(vtw_u)) and (not np.isnan(voc_u)):
-            delta_x = (vtw_u + voc_u)*delta_t
-            delta_y = (vtw_v + voc_v)*delta_t
-            vel_list_x.append(vtw_u + voc_u)
-            vel_list_y.append(vtw_v + voc_v)
-    # CASE 3: use through water velocity if available
-    elif (not np.isnan(vtw_u)):
-            delta_x = vtw_u*delta_t
-            delta_y = vtw_v*delta_t
-            vel_list_x.append(vtw_u)
-            vel_list_y.append(vtw_v)
-    # CASE 4: use ocean current estimate if available
-    elif (not np.isnan(voc_u)):
-            delta_x = voc_u*delta_t
-            delta_y = voc_v*delta_t
-            vel_list_x.append(voc_u)
-            vel_list_y.append(voc_v)
-
-    # set current position to DVL odometry result 
-    cur_x = delta_x + prev_x
-    cur_y = delta_y + prev_y
-    
-    # override current position if GPS fix is given 
-    if depth < near_surface_filter:
-        cur_time = datetime.datetime.fromtimestamp(time)
-        cur_dbd  = df_dbd[str(cur_time):].copy()
-        if (len(cur_dbd.m_gps_x_lmc) != 0):
-            if not np.isnan(cur_dbd.m_gps_x_lmc[0]):
-                cur_x = cur_dbd.m_gps_x_lmc[0] - dbd_origin_x
-                cur_y = cur_dbd.m_gps_y_lmc[0] - dbd_origin_y
-                flag_gps_fix_at_surface = True
-                
-                vel_list_x.append(cur_dbd.m_vx_lmc[0])
-                vel_list_y.append(cur_dbd.m_vy_lmc[0])
-    
-    # update the odometry list of positions
-    rel_pos_x.append(cur_x)
-    rel_pos_y.append(cur_y)
-    rel_pos_z.append(depth)
-    delta_x_list.append(delta_x)
-    delta_y_list.append(delta_y)
+# select the velocity source of every ensemble and integrate the odometry,
+# resetting to the GPS fixes at the surface
+dead_reckoning = DeadReckoning.DeadReckoning(
+    near_surface_filter=near_surface_filter)
+voc      = dead_reckoning.get_ocean_currents(ts.df, water_column, 
+                                             ocean_current_time_filter*60)
+resets   = dead_reckoning.get_gps_resets(ts.df, ts_flight_kolumbo_all,
+                                         (dbd_origin_x, dbd_origin_y))
+odometry = dead_reckoning.compute_odometry(ts.df, voc, resets)
 
 # add new odomety to the data frame
-ts.df['rel_pos_x'] = rel_pos_x
-ts.df['rel_pos_y'] = rel_pos_y
-ts.df['rel_pos_z'] = rel_pos_z
-ts.df['delta_x']   = delta_x_list
-ts.df['delta_y']   = delta_y_list
+for var in ['rel_pos_x', 'rel_pos_y', 'rel_pos_z', 'delta_x', 'delta_y']:
+    ts.df[var] = odometry[var]
 
 print("> Finished Calculating Odometry!")
 
@@ -840,6 +661,10 @@ dbd_utm_x, dbd_utm_y, _, zone_letter = get_utm_coords_from_glider_lat_lon(
     dbd_origin_m_lon
 )
 
+# look up the GPS fix of the next flight controller cycle of every ensemble
+gps_fixes = ts_flight_kolumbo_all.get_next_gps_fix(
+    ts.df.time.values, end=ts.df.time[-1]) - [dbd_origin_x, dbd_origin_y]
+
 
 # iterate over length of Dive 
 for t in range(1,len(ts.df)):
@@ -887,24 +712,20 @@ for t in range(1,len(ts.df)):
     
     # override current position if GPS fix is given 
     if depth < near_surface_filter:
-        cur_time = datetime.datetime.fromtimestamp(time)
-        cur_dbd  = df_dbd[str(cur_time):].copy()
-        if (len(cur_dbd.m_gps_x_lmc) != 0):
-            if not np.isnan(cur_dbd.m_gps_x_lmc[0]):
-                gps_x = cur_dbd.m_gps_x_lmc[0] - dbd_origin_x
-                gps_y = cur_dbd.m_gps_y_lmc[0] - dbd_origin_y
-                flag_gps_fix_at_surface = True
-                pc_bathy_depth.append(np.nan)
-                pc_bathy_slope.append(np.nan)
-                pc_bathy_orient.append(np.nan)
-                tan_pos_x.append(gps_x)
-                tan_pos_y.append(gps_y)
-                tan_pos_z.append(depth)
-                sf_tan_pos_x.append(gps_x)
-                sf_tan_pos_y.append(gps_y)
-                new_r = np.min([prev_r*0.5, 50])
-                tan_pos_r.append(prev_r)
-                continue
+        gps_x, gps_y = gps_fixes[t]
+        if not np.isnan(gps_x):
+            flag_gps_fix_at_surface = True
+            pc_bathy_depth.append(np.nan)
+            pc_bathy_slope.append(np.nan)
+            pc_bathy_orient.append(np.nan)
+            tan_pos_x.append(gps_x)
+            tan_pos_y.append(gps_y)
+            tan_pos_z.append(depth)
+            sf_tan_pos_x.append(gps_x)
+            sf_tan_pos_y.append(gps_y)
+            new_r = np.min([prev_r*0.5, 50])
+            tan_pos_r.append(prev_r)
+            continue
     
     # ignore case when 3 or less slant ranges are present
     # ignore case when glider is not sufficiently pitched
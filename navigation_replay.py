@@ -0,0 +1,141 @@
+# navigation_replay.py
+#
+# Replays a recorded pd0 file through a NavigationEngine as if the ensembles
+# arrived from the DVL in real time. The ensembles are parsed one at a time
+# with PathfinderTimeSeries.iter_pd0, optionally paced at real or accelerated
+# speed, and the latency of every ping (parsing the ensemble and updating the
+# navigation) is measured.
+#
+# usage: python navigation_replay.py <pd0 file> [speed] [flight log directory]
+
+import numpy as np
+import pandas as pd
+import sys
+import time
+from NavigationEngine import NavigationEngine
+from PathfinderTimeSeries import PathfinderTimeSeries
+from SlocumFlightController import SlocumFlightController
+
+
+def get_flight_states(flight_controller):
+    """Returns the cycles of a flight controller log in increasing time.
+
+    Args:
+        flight_controller: SlocumFlightController on the same time base as
+            the DVL (UTC).
+
+    Returns:
+        (time, values) tuple of the times of the cycles and an array of
+        shape (num_cycles, len(NavigationEngine.FLIGHT_VARS)) of their
+        values.
+    """
+    values = flight_controller.df.reindex(
+        columns=NavigationEngine.FLIGHT_VARS).to_numpy(dtype=float)
+    time   = values[:, NavigationEngine.FLIGHT_VARS.index('time')]
+    order  = np.argsort(time, kind='mergesort')
+    return time[order], values[order]
+
+
+def get_flight_state(flight_states, t):
+    """Returns the latest cycle of the flight controller at time t, or None
+    if there is no cycle before t."""
+    time, values = flight_states
+    i = np.searchsorted(time, t, side='right') - 1
+    if i < 0:
+        return None
+    return dict(zip(NavigationEngine.FLIGHT_VARS, values[i]))
+
+
+def replay(filepath, engine=None, flight_controller=None, speed=None):
+    """Replays a pd0 file through a navigation engine, one ping at a time.
+
+    Args:
+        filepath: the file location of the pd0 file.
+        engine: the NavigationEngine to update. By default a new engine.
+        flight_controller: optional SlocumFlightController. Every ping is
+            given the latest cycle of the flight controller before it.
+        speed: factor by which the replay is faster than real time (i.e. 1
+            for real time), or None to process the pings as fast as possible.
+            Pings are released at the time of the ensemble divided by speed.
+
+    Returns:
+        (estimates, latencies) tuple of the DataFrame of the position
+        estimates of every ping (see NavigationEngine.update) and the array
+        of the latency of every ping [s].
+    """
+    engine        = engine or NavigationEngine()
+    flight_states = None
+    if flight_controller is not None:
+        flight_states = get_flight_states(flight_controller)
+
+    estimates = []
+    latencies = []
+    ensembles = PathfinderTimeSeries.iter_pd0(filepath)
+    start     = None
+    while True:
+        tic      = time.perf_counter()
+        ensemble = next(ensembles, None)
+        if ensemble is None:
+            break
+        parse_time = time.perf_counter() - tic
+
+        # wait until the ping is due, which is not part of the latency
+        if speed is not None:
+            if start is None:
+                start = (time.perf_counter(), ensemble.time)
+            due = start[0] + (ensemble.time - start[1])/speed
+            time.sleep(max(0, due - time.perf_counter()))
+
+        tic   = time.perf_counter()
+        state = None
+        if flight_states is not None:
+            state = get_flight_state(flight_states, ensemble.time)
+        estimates.append(engine.update(ensemble, state))
+        latencies.append(parse_time + time.perf_counter() - tic)
+    return pd.DataFrame(estimates), np.array(latencies)
+
+
+def get_latency_stats(latencies):
+    """Returns the mean, percentiles and max of the ping latencies [ms]."""
+    latencies = np.asarray(latencies)*1000
+    if len(latencies) == 0:
+        return {}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'num_pings' : len(latencies),
+        'mean'      : latencies.mean(),
+        'p50'       : p50,
+        'p95'       : p95,
+        'p99'       : p99,
+        'max'       : latencies.max(),
+    }
+
+
+def main(filepath, speed=None, flight_directory=None):
+    flight_controller = None
+    if flight_directory is not None:
+        flight_controller = SlocumFlightController.from_directory(
+            flight_directory, save=False, verbose=False)
+    start = time.perf_counter()
+    estimates, latencies = replay(filepath, NavigationEngine(),
+                                  flight_controller, speed)
+    duration = time.perf_counter() - start
+    stats    = get_latency_stats(latencies)
+
+    print('- Navigation replay --------------------')
+    print('    # pings:       %8d'     % (len(estimates),))
+    print('    duration:      %8.3f s'  % (duration,))
+    if stats:
+        for key in ['mean', 'p50', 'p95', 'p99', 'max']:
+            print('    %-14s %8.3f ms' % (key + ':', stats[key]))
+    return estimates, latencies
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python navigation_replay.py <pd0 file> [speed] '
+              '[flight log directory]')
+        sys.exit(1)
+    main(sys.argv[1],
+         float(sys.argv[2]) if len(sys.argv) > 2 else None,
+         sys.argv[3] if len(sys.argv) > 3 else None)
@@ -0,0 +1,151 @@
+# parse_cache.py
+#
+# On-disk cache of parsed time series, stored as compressed NPZ files.
+# Each cache entry is keyed by the content hash of the source file and by the
+# version of the parser, so that an entry is only used while both the raw
+# file and the parsing code are unchanged. The columns are stored in groups
+# (i.e. one 2D array for all velocity bins), so that a subset of the columns
+# can be loaded without reading (or decompressing) the other groups.
+
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+
+
+# reserved keys of the NPZ file (group keys are prefixed by GROUP_PREFIX)
+INDEX_KEY    = '_index'
+META_KEY     = '_meta'
+GROUP_PREFIX = 'group_'
+
+
+def get_file_hash(filepath, block_size=1<<20):
+    """Returns the hex digest of the contents of a file.
+
+    Args:
+        filepath: the file to hash.
+        block_size: number of bytes read at a time.
+    """
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_cache_path(cache_dir, filepath, version, **options):
+    """Returns the location of the cache entry for a source file.
+
+    Args:
+        cache_dir: directory that holds the cache entries.
+        filepath: the source file that is parsed.
+        version: version of the parser. Increment the version whenever the
+            parsed output changes, which invalidates all previous entries.
+        options: parsing options that change the parsed output. Options
+            that are False or None are left out of the key, and path 
+            separators in the values (i.e. 'Europe/Athens') are replaced.
+    """
+    name = os.path.basename(filepath).split('.')[0]
+    key  = [name, get_file_hash(filepath), 'v%s' % (version,)]
+    key += ['%s-%s' % (k, str(v).replace('/', '-'))
+            for k, v in sorted(options.items())
+            if v is not None and v is not False]
+    return os.path.join(cache_dir, '_'.join(key) + '.npz')
+
+
+def save_frame(cache_path, df, groups=None, meta=None):
+    """Saves a DataFrame with a DatetimeIndex to a cache entry.
+
+    The entry is written to a temporary file first and then moved into
+    place, so that an interrupted write never leaves a corrupt entry.
+
+    Args:
+        cache_path: location of the cache entry.
+        df: DataFrame to store. The columns of a group must share a dtype.
+            A time zone aware index is stored as UTC times.
+        groups: optional dictionary from group name to the list of columns
+            that are stored (and loaded) together. Columns that are not in
+            any group are stored in a group of their own.
+        meta: optional dictionary of JSON serializable values to store.
+    """
+    groups  = {name : list(cols) for name, cols in (groups or {}).items()}
+    grouped = set(col for cols in groups.values() for col in cols)
+    for col in df.columns:
+        if col not in grouped:
+            groups[col] = [col]
+
+    arrays = {GROUP_PREFIX + name : df[cols].to_numpy()
+              for name, cols in groups.items()}
+    arrays[INDEX_KEY] = df.index.values
+    arrays[META_KEY]  = np.array(json.dumps({
+        'columns' : list(df.columns),
+        'tz'      : None if df.index.tz is None else str(df.index.tz),
+        'groups'  : groups,
+        'meta'    : meta or {},
+    }))
+
+    cache_dir = os.path.dirname(cache_path) or '.'
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_frame(cache_path, columns=None):
+    """Loads a DataFrame from a cache entry.
+
+    Args:
+        cache_path: location of the cache entry.
+        columns: optional list of columns to load. Only the groups holding
+            the requested columns are read from the file.
+
+    Returns:
+        (df, meta) tuple of the DataFrame and the stored meta dictionary.
+
+    Raises:
+        KeyError if a requested column is not in the cache entry.
+    """
+    with np.load(cache_path, allow_pickle=False) as npz:
+        info = json.loads(str(npz[META_KEY]))
+        if columns is None:
+            columns = info['columns']
+        columns = list(columns)
+
+        # map each column to its group and position within the group
+        location = {col : (name, i) for name, cols in info['groups'].items()
+                    for i, col in enumerate(cols)}
+        missing  = [col for col in columns if col not in location]
+        if missing:
+            raise KeyError('columns not in cache: %s' % (missing,))
+
+        # read the required groups only
+        index  = pd.DatetimeIndex(npz[INDEX_KEY])
+        if info.get('tz') is not None:
+            index = index.tz_localize('UTC').tz_convert(info['tz'])
+        arrays = {}
+        for col in columns:
+            name = location[col][0]
+            if name not in arrays:
+                arrays[name] = npz[GROUP_PREFIX + name]
+
+    # columns that share a dtype are collected into a single 2D array
+    names = list(arrays)
+    if len(set(arrays[name].dtype for name in names)) == 1:
+        start = np.cumsum([0] + [arrays[name].shape[1] for name in names])
+        first = dict(zip(names, start))
+        data  = np.hstack([arrays[name] for name in names])
+        cols  = [first[location[col][0]] + location[col][1] 
+                 for col in columns]
+        if cols != list(range(data.shape[1])):
+            data = data[:, cols]
+        return pd.DataFrame(data, index=index, columns=columns), info['meta']
+    data = {col : arrays[location[col][0]][:, location[col][1]]
+            for col in columns}
+    return pd.DataFrame(data, index=index, columns=columns), info['meta']
@@ -0,0 +1,123 @@
+# pd0_simulator.py
+#
+# Simulates a live Pathfinder DVL by replaying a recorded pd0 file over a
+# local TCP socket. Every client that connects receives the raw bytes of the
+# file (including any damaged bytes, like a serial line would), with each
+# ensemble released at its recorded time, optionally accelerated. The stream
+# can be consumed with PathfinderStream.read_tcp.
+#
+# usage: python pd0_simulator.py <pd0 file> [port] [speed]
+
+import asyncio
+import numpy as np
+import sys
+import time
+from PathfinderBatchDecoder import PathfinderBatchDecoder
+from PathfinderTimeSeries import PathfinderTimeSeries
+
+
+def get_schedule(pd0_bytes):
+    """Returns when every valid ensemble of a pd0 recording is released.
+
+    Args:
+        pd0_bytes: bytes-like object holding the pd0 data.
+
+    Returns:
+        (ends, times) tuple of the byte offset of the end of every valid
+        ensemble (including its checksum) and of its time [s].
+    """
+    decoder = PathfinderBatchDecoder()
+    buf     = np.frombuffer(pd0_bytes, dtype=np.uint8)
+    starts  = np.fromiter(decoder.iter_ensemble_offsets(buf, resync=True),
+                          dtype=np.int64)
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    num_bytes = buf[starts + 2].astype(np.int64) | \
+                buf[starts + 3].astype(np.int64) << 8
+    ends      = starts + num_bytes + 2
+    times     = decoder.decode_ensembles(buf, starts)[
+                    :, decoder.data_lookup['time']]
+    return ends, times
+
+
+async def replay_pd0(writer, pd0_bytes, speed=None, chunk_size=None):
+    """Writes a pd0 recording to a stream, paced at the recorded times.
+
+    Args:
+        writer: asyncio.StreamWriter to write the bytes to.
+        pd0_bytes: bytes-like object holding the pd0 data.
+        speed: factor by which the replay is faster than real time (i.e. 1
+            for real time), or None to write the bytes as fast as possible.
+        chunk_size: optional number of bytes written at a time, which splits
+            the ensembles across writes like a serial port would.
+    """
+    ends, times = get_schedule(pd0_bytes)
+    ends        = np.append(ends, len(pd0_bytes))
+    times       = np.append(times, times[-1] if len(times) else 0)
+    chunk_size  = chunk_size or len(pd0_bytes)
+    start       = None
+    pos         = 0
+    for end, t in zip(ends, times):
+
+        # wait until the ensemble is due
+        if speed is not None:
+            if start is None:
+                start = (time.perf_counter(), t)
+            due = start[0] + (t - start[1])/speed
+            await asyncio.sleep(max(0, due - time.perf_counter()))
+
+        # bytes before the ensemble (i.e. damaged ones) are written with it
+        for i in range(pos, end, chunk_size):
+            writer.write(pd0_bytes[i:min(i + chunk_size, end)])
+            await writer.drain()
+        pos = end
+
+
+async def start_server(filepath, host='127.0.0.1', port=0, speed=None,
+                       chunk_size=None):
+    """Starts a TCP server that replays a pd0 file to every client.
+
+    Args:
+        filepath: the file location of the pd0 file.
+        host: interface to listen on.
+        port: port to listen on, or 0 for any free port.
+        speed: see replay_pd0.
+        chunk_size: see replay_pd0.
+
+    Returns:
+        the asyncio.Server. The port can be found with
+        server.sockets[0].getsockname()[1].
+    """
+    with PathfinderTimeSeries.open_pd0(filepath) as pd0_file:
+        pd0_bytes = bytes(pd0_file)
+
+    async def handle_client(reader, writer):
+        try:
+            await replay_pd0(writer, pd0_bytes, speed, chunk_size)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_client, host, port)
+
+
+async def main(filepath, port=0, speed=None):
+    server = await start_server(filepath, port=port, speed=speed)
+    host, port = server.sockets[0].getsockname()[:2]
+    print('- pd0 simulator ------------------------')
+    print('    replaying %s on %s:%d' % (filepath, host, port))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python pd0_simulator.py <pd0 file> [port] [speed]')
+        sys.exit(1)
+    try:
+        asyncio.run(main(sys.argv[1],
+                         int(sys.argv[2]) if len(sys.argv) > 2 else 0,
+                         float(sys.argv[3]) if len(sys.argv) > 3 else None))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,399 @@
+# synthetic_data.py
+#
+# Generators for synthetic Pathfinder pd0 data used by tests and benchmarks.
+# The byte layout follows the format tuples defined in PathfinderDVL so that
+# synthetic ensembles can be parsed by the same code as real DVL files. Also
+# generates Slocum flight controller logs, both in the binary .dbd format and
+# in the .asc format of dbd2asc.
+
+import numpy as np
+import struct
+from PathfinderDVL import PathfinderDVL
+from SlocumFlightController import SlocumFlightController
+
+
+# section identifiers, in the order the Pathfinder reports them
+SECTION_IDS = (
+    ('fixed_leader',    0x0000),
+    ('variable_leader', 0x0080),
+    ('velocity',        0x0100),
+    ('correlation',     0x0200),
+    ('echo_intensity',  0x0300),
+    ('percent_good',    0x0400),
+    ('bottom_track',    0x0600),
+)
+
+# settings that make a synthetic file look like the Kolumbo Pathfinder files
+#   + system configuration: 600kHz, convex, 30 degree beams, 4 beam janus
+#   + coordinate transformation: earth coordinates, tilts used
+SYSTEM_CONFIGURATION      = 16971
+COORDINATE_TRANSFORMATION = 31
+
+
+def pack_section(format_tuples, values, size):
+    """Packs a dictionary of values into a pd0 data type.
+
+    Args:
+        format_tuples: PathfinderDVL format tuples for the data type.
+        values: dictionary from variable name to the raw (unconverted) value.
+            Variables that are not given are packed as zero.
+        size: total number of bytes of the data type.
+    """
+    section = bytearray(size)
+    for name, var_format, offset in format_tuples:
+        struct.pack_into(var_format, section, offset, values.get(name, 0))
+    return section
+
+
+def pack_ensemble(fixed_leader, variable_leader, velocity, bottom_track,
+    correlation=None, echo_intensity=None, percent_good=None):
+    """Packs one pd0 ensemble, including header and checksum.
+
+    Args:
+        fixed_leader: dictionary of raw fixed leader values.
+        variable_leader: dictionary of raw variable leader values.
+        velocity: (num_bins, num_beams) array of raw velocities [mm/s].
+        bottom_track: dictionary of raw bottom track values.
+        correlation: (num_bins, num_beams) array of raw correlations.
+        echo_intensity: (num_bins, num_beams) array of raw echo intensities.
+        percent_good: (num_bins, num_beams) array of raw percent good values.
+    """
+    dvl = PathfinderDVL()
+    velocity = np.asarray(velocity)
+    num_cells = velocity.size
+    profile_zeros = np.zeros(velocity.shape, dtype=np.uint8)
+    if correlation    is None: correlation    = profile_zeros
+    if echo_intensity is None: echo_intensity = profile_zeros
+    if percent_good   is None: percent_good   = profile_zeros
+
+    def pack_profile(section_id, values, dtype):
+        return struct.pack('<H', section_id) + \
+               np.asarray(values, dtype=dtype).tobytes()
+
+    sections = [
+        pack_section(dvl.fixed_leader_format,    fixed_leader,    58),
+        pack_section(dvl.variable_leader_format, variable_leader, 77),
+        pack_profile(0x0100, velocity,       '<i2'),
+        pack_profile(0x0200, correlation,    'u1'),
+        pack_profile(0x0300, echo_intensity, 'u1'),
+        pack_profile(0x0400, percent_good,   'u1'),
+        pack_section(dvl.bottom_track_format,    bottom_track,    81),
+    ]
+    struct.pack_into('<H', sections[1], 0, 0x0080)
+    struct.pack_into('<H', sections[6], 0, 0x0600)
+
+    # header is followed by the address offset of each data type
+    header_len = 6 + 2*len(sections)
+    addresses  = []
+    address    = header_len
+    for section in sections:
+        addresses.append(address)
+        address += len(section)
+    num_bytes = address
+
+    header = struct.pack('<BBHBB', 0x7f, 0x7f, num_bytes, 0, len(sections))
+    header += struct.pack('<%dH' % len(addresses), *addresses)
+    ensemble = header + b''.join(bytes(_) for _ in sections)
+    checksum = sum(ensemble) & 0xFFFF
+    return ensemble + struct.pack('<H', checksum)
+
+
+def make_pd0(num_ensembles=100, num_bins=40, num_beams=4, seed=0,
+    start=(19, 11, 22, 3, 0, 0), max_good_bins=None):
+    """Generates a synthetic pd0 byte string resembling a glider dive.
+
+    The glider descends and ascends in a saw-tooth pattern while the number
+    of good velocity bins and the availability of bottom track vary from
+    ensemble to ensemble, so that every branch of the parser is exercised.
+
+    Args:
+        num_ensembles: number of ensembles to generate.
+        num_bins: number of depth bins reported in the fixed leader.
+        num_beams: number of beams reported in the fixed leader.
+        seed: seed for the random number generator.
+        start: (year, month, day, hour, minute, second) of the first ensemble,
+            where year is given relative to 2000 as reported by the DVL.
+        max_good_bins: upper bound (exclusive) of the number of good velocity
+            bins of an ensemble, num_bins by default.
+    """
+    BAD_VELOCITY = -32768
+    rng = np.random.default_rng(seed)
+    max_good_bins = num_bins if max_good_bins is None else max_good_bins
+    year, month, day, hour, minute, second = start
+    start_seconds = hour*3600 + minute*60 + second
+
+    fixed_leader = {
+        'id'                        : 0x0000,
+        'cpu_firmware_version'      : 51,
+        'cpu_firmware_revision'     : 17,
+        'system_configuration'      : SYSTEM_CONFIGURATION,
+        'lag_length'                : 53,
+        'num_beams'                 : num_beams,
+        'num_bins'                  : num_bins,
+        'pings_per_ensemble'        : 1,
+        'depth_bin_length'          : 200,
+        'blanking_distance '        : 88,
+        'profiling_mode'            : 1,
+        'low_correlation_threshold' : 64,
+        'percent_good_minimum'      : 0,
+        'error_velocity_threshold'  : 2000,
+        'coordinate_transformation' : COORDINATE_TRANSFORMATION,
+        'heading_alignment'         : 0,
+        'heading_bias'              : 0,
+        'sensor_source'             : 125,
+        'sensor_available'          : 61,
+        'bin0_distance'             : 291,
+        'transmit_pulse_length'     : 211,
+        'system_serial_number'      : 12345,
+    }
+
+    pd0 = []
+    depth = 5.0
+    heading = rng.uniform(0, 360)
+    for i in range(num_ensembles):
+        # saw-tooth dive profile with a pitch that follows the direction
+        descending = (i // 50) % 2 == 0
+        pitch = -22 + rng.normal(0, 1) if descending else 22 + rng.normal(0,1)
+        depth = max(0.5, depth + (0.2 if descending else -0.2) +
+                    rng.normal(0, 0.02))
+        heading = (heading + rng.normal(0, 2)) % 360
+        roll = rng.normal(0, 1.5)
+        clock = start_seconds + 2*i
+        variable_leader = {
+            'id'                : 0x0080,
+            'ensemble_number'   : (i + 1) % 65536,
+            'ensemble_rollover' : (i + 1) // 65536,
+            'rtc_year'          : year,
+            'rtc_month'         : month,
+            'rtc_day'           : day + clock // 86400,
+            'rtc_hour'          : (clock // 3600) % 24,
+            'rtc_minute'        : (clock // 60) % 60,
+            'rtc_second'        : clock % 60,
+            'rtc_hundredths'    : int(rng.integers(0, 100)),
+            'speed_of_sound'    : 1520,
+            'depth'             : int(depth*10),
+            'heading'           : int(heading*100),
+            'pitch'             : int(pitch*100),
+            'roll'              : int(roll*100),
+            'salinity'          : 35,
+            'temperature'       : int(rng.uniform(1400, 1600)),
+            'pitch_standard_deviation' : int(rng.integers(0, 20)),
+            'roll_standard_deviation'  : int(rng.integers(0, 20)),
+            'adc_rounded_voltage'      : 150,
+            'pressure'          : int(depth*1000),
+            'pressure_variance' : int(rng.integers(0, 50)),
+        }
+
+        # velocity bins beyond the good range are reported as bad values
+        velocity = rng.integers(-400, 400, size=(num_bins, num_beams))
+        num_good = int(rng.integers(0, max_good_bins))
+        velocity[num_good:, :] = BAD_VELOCITY
+        # occasionally report a very fast bin to trigger the speed filter
+        if num_good > 2 and rng.random() < 0.2:
+            velocity[2, 0] = 3000
+
+        # bottom track is lost for some ensembles, and beam ranges can drop
+        bottom_track = {'id' : 0x0600, 'btm_pings_per_ensemble' : 1}
+        if rng.random() < 0.7:
+            for beam in range(4):
+                bottom_track['btm_beam%d_velocity' % beam] = \
+                    int(rng.integers(-400, 400))
+                bottom_track['btm_beam%d_range' % beam] = \
+                    0 if rng.random() < 0.15 else int(rng.integers(500,6000))
+        else:
+            for beam in range(4):
+                bottom_track['btm_beam%d_velocity' % beam] = BAD_VELOCITY
+        for beam in range(4):
+            bottom_track['btm_beam%d_rssi' % beam] = int(rng.integers(0,255))
+        bottom_track['btm_max_error_velocity'] = 2000
+
+        correlation    = rng.integers(0, 256, size=(num_bins, num_beams))
+        echo_intensity = rng.integers(0, 256, size=(num_bins, num_beams))
+        percent_good   = rng.integers(0, 101, size=(num_bins, num_beams))
+        pd0.append(pack_ensemble(fixed_leader, variable_leader, velocity,
+                                 bottom_track, correlation, echo_intensity,
+                                 percent_good))
+    return b''.join(pd0)
+
+
+def write_pd0(filepath, num_ensembles=100, **kwargs):
+    """Writes a synthetic pd0 file to the given filepath."""
+    with open(filepath, 'wb') as f:
+        f.write(make_pd0(num_ensembles, **kwargs))
+    return filepath
+
+
+# variables of a synthetic flight controller log
+#   + includes variables that SlocumFlightController does not extract
+ASC_VARS = (
+    ('m_present_time', 'timestamp', 8),
+    ('m_depth',        'm',         4),
+    ('m_pitch',        'rad',       4),
+    ('m_roll',         'rad',       4),
+    ('m_heading',      'rad',       4),
+    ('m_speed',        'm/s',       4),
+    ('m_gps_x_lmc',    'm',         4),
+    ('m_gps_y_lmc',    'm',         4),
+    ('m_x_lmc',        'm',         4),
+    ('m_y_lmc',        'm',         4),
+    ('m_lat',          'lat',       8),
+    ('m_lon',          'lon',       8),
+    ('m_gps_mag_var',  'rad',       4),
+    ('c_science_on',   'bool',      1),
+    ('m_gps_status',   'enum',      1),
+)
+
+
+def make_flight_log(num_rows=100, seed=0, start_time=1574380800.0, 
+    filename='sentinel-2019-326-3-0', extra_vars=0):
+    """Generates the header, sensors and values of a synthetic flight log.
+
+    Sensors are only reported when they are updated, so values are randomly
+    missing (NaN), and GPS fixes are only reported at the surface before and
+    after the dive. Values are quantized so that they are exact in the 
+    binary size of their sensor and are printed exactly in the .asc format.
+
+    Args:
+        num_rows: number of rows (cycles of the flight controller).
+        seed: seed for the random number generator.
+        start_time: m_present_time of the first row [s].
+        filename: name of the source file reported in the header.
+        extra_vars: number of additional sensors to report, since real logs
+            hold many more sensors than SlocumFlightController extracts.
+
+    Returns:
+        (header, names, data) tuple of the list of (key, value) header tags, 
+        the (name, units, size) tuple of each sensor and an array of shape 
+        (num_rows, num_sensors) of the values.
+    """
+    rng    = np.random.default_rng(seed)
+    names  = ASC_VARS + tuple(('x_sensor_%d' % i, 'nodim', 4) 
+                              for i in range(extra_vars))
+    header = [
+        ('dbd_label',          'DBD_ASC(dinkum_binary_data_ascii)file'),
+        ('encoding_ver',       '2'),
+        ('num_ascii_tags',     '14'),
+        ('all_sensors',        '0'),
+        ('filename',           filename),
+        ('the8x3_filename',    '01960000'),
+        ('filename_extension', 'dbd'),
+        ('filename_label',     '%s-dbd(01960000)' % (filename,)),
+        ('mission_name',       'KOLUMBO.MI'),
+        ('fileopen_time',      'Fri_Nov_22_00:00:00_2019'),
+        ('sensors_per_cycle',  str(len(names))),
+        ('num_label_lines',    '3'),
+        ('num_segments',       '1'),
+        ('segment_filename_0', filename),
+    ]
+
+    data  = rng.normal(size=(num_rows, len(names)))
+    data[:, 1] = np.abs(data[:, 1])*20
+    sizes = np.array([_[2] for _ in names])
+    data[:, sizes == 1] = rng.integers(0, 3, size=(num_rows, 
+                                       (sizes == 1).sum()))
+    data[:, sizes == 4] = np.round(data[:, sizes == 4]*1024)/1024
+    data[:, sizes == 8] = np.round(data[:, sizes == 8], 6)
+    data[rng.random(data.shape) < 0.3] = np.nan
+    data[:, 0] = start_time + 4*np.arange(num_rows) + \
+                 np.round(rng.uniform(0, 1, num_rows), 5)
+
+    # GPS fixes are only available at the surface
+    surface = np.zeros(num_rows, dtype=bool)
+    surface[:3] = surface[-3:] = True
+    data[~surface, 6:8] = np.nan
+    data[surface, 6:8] = np.round(rng.uniform(-500, 500, 
+                                  size=(surface.sum(), 2))*64)/64
+    return header, names, data
+
+
+def make_asc(num_rows=100, **kwargs):
+    """Generates the text of a synthetic Slocum flight controller .asc file.
+
+    Args:
+        num_rows: number of rows (cycles of the flight controller).
+        kwargs: options of make_flight_log.
+    """
+    header, names, data = make_flight_log(num_rows, **kwargs)
+    lines  = ['%s: %s' % _ for _ in header]
+    lines += [' '.join(str(_[i]) for _ in names) + ' ' for i in range(3)]
+    for row in data:
+        lines.append(' '.join('NaN' if np.isnan(_) else repr(float(_)) 
+                              for _ in row) + ' ')
+    return '\n'.join(lines) + '\n'
+
+
+def write_asc(filepath, num_rows=100, **kwargs):
+    """Writes a synthetic flight controller .asc file to the given filepath."""
+    with open(filepath, 'w') as f:
+        f.write(make_asc(num_rows, **kwargs))
+    return filepath
+
+
+def make_sensor_list(names):
+    """Returns the sensor list lines of a binary flight log."""
+    return ''.join('s: T %4d %4d %d %s %s\n' % (i, i, size, name, units)
+                   for i, (name, units, size) in enumerate(names))
+
+
+def make_dbd(num_rows=100, byteorder='>', sensor_list_crc=None, **kwargs):
+    """Generates the bytes of a synthetic binary flight log (.dbd file).
+
+    The log holds the same values as the .asc file of make_asc with the same
+    options. A value is transmitted when it changes, a repeated value is 
+    marked as updated with the same value, and a NaN is marked as not 
+    updated.
+
+    Args:
+        num_rows: number of rows (cycles of the flight controller).
+        byteorder: byte order of the values, '>' or '<'.
+        sensor_list_crc: if given, the sensor list is factored out of the 
+            file under this name, see make_sensor_list.
+        kwargs: options of make_flight_log.
+    """
+    STATE_SAME = 1
+    STATE_NEW  = 2
+    FORMATS    = {1 : 'b', 2 : 'h', 4 : 'f', 8 : 'd'}
+    header, names, data = make_flight_log(num_rows, **kwargs)
+
+    header = [('dbd_label', 'DBD(dinkum_binary_data)file'),
+              ('encoding_ver', '5')] + header[2:]
+    if sensor_list_crc is not None:
+        header.append(('sensor_list_crc',      sensor_list_crc))
+        header.append(('sensor_list_factored', '1'))
+    header[2] = ('num_ascii_tags', str(len(header)))
+    dbd  = ''.join('%s:    %s\n' % _ for _ in header)
+    if sensor_list_crc is None:
+        dbd += make_sensor_list(names)
+    dbd  = [dbd.encode('ascii')]
+
+    # known bytes cycle
+    tag, short, single, double = SlocumFlightController.DBD_KNOWN_BYTES
+    dbd.append(tag + struct.pack(byteorder + 'hfd', short, single, double))
+
+    # data cycles of two bit states, four per byte, followed by new values
+    last = [None]*len(names)
+    for row in data:
+        states = np.zeros(4*((len(names) + 3)//4), dtype=np.uint8)
+        values = []
+        for i, val in enumerate(row):
+            if np.isnan(val):
+                continue
+            if val == last[i]:
+                states[i] = STATE_SAME
+                continue
+            states[i] = STATE_NEW
+            last[i]   = val
+            values.append(struct.pack(byteorder + FORMATS[names[i][2]], 
+                int(val) if names[i][2] <= 2 else val))
+        state_bytes = (states.reshape(-1, 4) << np.array([6, 4, 2, 0],
+                       dtype=np.uint8)).sum(axis=1).astype(np.uint8)
+        dbd.append(b'd' + state_bytes.tobytes() + b''.join(values))
+    dbd.append(b'X')
+    return b''.join(dbd)
+
+
+def write_dbd(filepath, num_rows=100, **kwargs):
+    """Writes a synthetic binary flight log to the given filepath."""
+    with open(filepath, 'wb') as f:
+        f.write(make_dbd(num_rows, **kwargs))
+    return filepath
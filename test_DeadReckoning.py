@@ -0,0 +1,167 @@
+# test_DeadReckoning.py
+#
+# Unit tests for the dead-reckoned odometry of a dive.
+
+
+import datetime
+import os
+import tempfile
+import types
+import unittest
+import numpy as np
+import pandas as pd
+import synthetic_data
+import VelocityShearPropagation
+from DeadReckoning import DeadReckoning
+from PathfinderTimeSeries import PathfinderTimeSeries
+from SlocumFlightController import SlocumFlightController
+
+
+class TestDeadReckoning(unittest.TestCase):
+    """Test the odometry against the loop of dvl-nav_testRun.py."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        pd0_path    = os.path.join(cls.tmp_dir.name, 'dive.pd0')
+        asc_path    = os.path.join(cls.tmp_dir.name, 'dive.asc')
+        synthetic_data.write_pd0(pd0_path, num_ensembles=200)
+        ts = PathfinderTimeSeries.from_pd0(pd0_path, save=False,
+                                           verbose=False, batch=True)
+
+        # every velocity source is used somewhere in the dive
+        rng = np.random.default_rng(0)
+        cls.df = ts.df.copy()
+        cls.df.loc[cls.df.index[rng.random(200) < 0.3],
+                   ['rel_vel_pressure_u', 'rel_vel_pressure_v']] = np.nan
+        cls.df.loc[cls.df.index[rng.random(200) < 0.3],
+                   ['rel_vel_dvl_u', 'rel_vel_dvl_v']] = np.nan
+        cls.ocean_current = rng.normal(scale=0.1, size=(200, 2))
+        cls.ocean_current[rng.random(200) < 0.4] = np.nan
+
+        # GPS fixes of the flight controller at the start and end of the dive
+        start = cls.df.time.iloc[0] - 5*3600 + 5
+        synthetic_data.write_asc(asc_path, num_rows=100, start_time=start)
+        cls.fc     = SlocumFlightController.from_asc(asc_path, save=False,
+                                                     verbose=False)
+        cls.df_dbd = cls.fc.df
+        cls.df_dbd.loc[cls.df_dbd.index[[1, -2]],
+                       ['m_gps_x_lmc', 'm_gps_y_lmc']] = np.nan
+        cls.df['depth'] = np.where(np.arange(200) < 190,
+                                   cls.df['depth'], 2.0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def compute_odometry(self, near_surface_filter=10):
+        """Odometry loop of dvl-nav_testRun.py, with the ocean current of
+        each ensemble given."""
+        df, df_dbd = self.df, self.df_dbd
+        start_t = datetime.datetime.fromtimestamp(df.time.iloc[0])
+        end_t   = datetime.datetime.fromtimestamp(df.time.iloc[-1])
+        df_dbd  = df_dbd[str(start_t):str(end_t)]
+        origin  = df_dbd[df_dbd.m_x_lmc.notna()].iloc[0]
+        rel_pos_x, rel_pos_y = [0], [0]
+        for t in range(1, len(df)):
+            depth   = df.depth.iloc[t]
+            delta_t = df.delta_t.iloc[t]
+            if depth > near_surface_filter:
+                vtw_u = df.rel_vel_pressure_u.iloc[t]
+                vtw_v = df.rel_vel_pressure_v.iloc[t]
+            else:
+                vtw_u = df.rel_vel_dvl_u.iloc[t]
+                vtw_v = df.rel_vel_dvl_v.iloc[t]
+            vog_u = df.abs_vel_btm_u.iloc[t]
+            vog_v = df.abs_vel_btm_v.iloc[t]
+            voc_u, voc_v = self.ocean_current[t]
+
+            delta_x, delta_y = 0, 0
+            if not np.isnan(vog_u):
+                delta_x, delta_y = vog_u*delta_t, vog_v*delta_t
+            elif not np.isnan(vtw_u) and not np.isnan(voc_u):
+                delta_x = (vtw_u + voc_u)*delta_t
+                delta_y = (vtw_v + voc_v)*delta_t
+            elif not np.isnan(vtw_u):
+                delta_x, delta_y = vtw_u*delta_t, vtw_v*delta_t
+            elif not np.isnan(voc_u):
+                delta_x, delta_y = voc_u*delta_t, voc_v*delta_t
+            cur_x = delta_x + rel_pos_x[-1]
+            cur_y = delta_y + rel_pos_y[-1]
+
+            if depth < near_surface_filter:
+                cur_time = datetime.datetime.fromtimestamp(df.time.iloc[t])
+                cur_dbd  = df_dbd[str(cur_time):]
+                if len(cur_dbd) and not np.isnan(cur_dbd.m_gps_x_lmc.iloc[0]):
+                    cur_x = cur_dbd.m_gps_x_lmc.iloc[0] - origin.m_x_lmc
+                    cur_y = cur_dbd.m_gps_y_lmc.iloc[0] - origin.m_y_lmc
+            rel_pos_x.append(cur_x)
+            rel_pos_y.append(cur_y)
+        return np.array(rel_pos_x), np.array(rel_pos_y)
+
+    def test_matches_odometry_loop(self):
+        dead_reckoning = DeadReckoning()
+        resets   = dead_reckoning.get_gps_resets(self.df, self.fc)
+        odometry = dead_reckoning.compute_odometry(self.df,
+                                                   self.ocean_current, resets)
+        expected = self.compute_odometry()
+        np.testing.assert_allclose(odometry.rel_pos_x, expected[0],
+                                   rtol=0, atol=1e-9)
+        np.testing.assert_allclose(odometry.rel_pos_y, expected[1],
+                                   rtol=0, atol=1e-9)
+
+        # the dive uses every velocity source, and resets to GPS fixes
+        self.assertLessEqual({0, 1, 2, 3}, set(odometry.velocity_source))
+        self.assertGreater(np.isnan(resets[:,0]).sum(), 0)
+        self.assertLess(np.isnan(resets[:,0]).sum(), 195)
+
+    def test_velocity_source_policy(self):
+        policy = (DeadReckoning.WATER, DeadReckoning.BOTTOM_TRACK)
+        velocities, sources = DeadReckoning(policy).get_velocities(
+            self.df, self.ocean_current)
+        water = DeadReckoning().get_through_water_velocities(self.df)
+        valid = ~np.isnan(water[:,0])
+        np.testing.assert_array_equal(velocities[valid], water[valid])
+        np.testing.assert_array_equal(sources[valid], 0)
+
+        # the ocean current is never used, so some ensembles have no source
+        no_source = ~valid & np.isnan(self.df.abs_vel_btm_u.values)
+        self.assertTrue(no_source.any())
+        self.assertTrue((sources[no_source] == -1).all())
+        self.assertTrue(np.isnan(velocities[no_source]).all())
+        with self.assertRaises(ValueError):
+            DeadReckoning(('bottom_track', 'gps'))
+
+    def test_missing_time_step_is_held_until_reset(self):
+        df = self.df.copy()
+        df.loc[df.index[50], 'delta_t'] = np.nan
+        resets   = np.full((len(df), 2), np.nan)
+        resets[120] = [3.0, 4.0]
+        odometry = DeadReckoning().compute_odometry(df, self.ocean_current,
+                                                    resets)
+        self.assertFalse(odometry.rel_pos_x[:50].isna().any())
+        self.assertTrue(odometry.rel_pos_x[50:120].isna().all())
+        self.assertEqual(odometry.rel_pos_x.iloc[120], 3.0)
+        self.assertFalse(odometry.rel_pos_x[120:].isna().any())
+
+    def test_ocean_currents_of_water_column(self):
+        OceanCurrent = VelocityShearPropagation.OceanCurrent
+        water_column = VelocityShearPropagation.WaterColumn(voc_mag_filter=1)
+        nodes = [(4, 0, OceanCurrent(0.1, 0.2, 0)),
+                 (4, 500, OceanCurrent(0.5, 0.5, 0)),
+                 (4, 1000, OceanCurrent(0.3, 0.0, 0)),
+                 (4, 1200, OceanCurrent(2.0, 0.0, 0)),
+                 (6, 10, OceanCurrent()),
+                 (8, 10, OceanCurrent(-0.2, 0.1, 0))]
+        for z, t, voc in nodes:
+            water_column.shear_node_dict[z].append(
+                types.SimpleNamespace(t=t, voc=voc))
+        df  = pd.DataFrame({'depth' : [4.0, 5.9, 6.5, 9.99, 12, np.nan]})
+        voc = DeadReckoning().get_ocean_currents(df, water_column)
+        np.testing.assert_allclose(voc, [[0.2, 0.1], [0.2, 0.1],
+                                         [np.nan]*2, [-0.2, 0.1],
+                                         [np.nan]*2, [np.nan]*2])
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored','-v'], exit=False)
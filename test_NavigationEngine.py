@@ -0,0 +1,226 @@
+# test_NavigationEngine.py
+#
+# Unit tests for the real-time navigation of one DVL ensemble at a time.
+
+
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+import pandas as pd
+import navigation_replay
+import synthetic_data
+import VelocityShearPropagation
+from DeadReckoning import DeadReckoning
+from NavigationEngine import NavigationEngine
+from PathfinderTimeSeries import PathfinderTimeSeries
+from SlocumFlightController import SlocumFlightController
+
+
+class TestNavigationEngine(unittest.TestCase):
+    """Test the incremental navigation against the offline processing."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir  = tempfile.TemporaryDirectory()
+        cls.filepath = os.path.join(cls.tmp_dir.name, 'dive.pd0')
+        synthetic_data.write_pd0(cls.filepath, num_ensembles=300)
+        cls.ts = PathfinderTimeSeries.from_pd0(cls.filepath, save=False,
+                                               verbose=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def run_engine(self, engine, flight_states=None):
+        estimates = []
+        for i, ensemble in enumerate(
+            PathfinderTimeSeries.iter_pd0(self.filepath)):
+            state = None if flight_states is None else flight_states[i]
+            estimates.append(engine.update(ensemble, state))
+        return pd.DataFrame(estimates, index=self.ts.df.index)
+
+    def compute_water_column(self):
+        """Water column loop of dvl-nav_testRun.py, with shear nodes timed
+        by the ensemble time."""
+        df           = self.ts.df
+        engine       = NavigationEngine()
+        water_column = engine.get_water_column(
+            next(PathfinderTimeSeries.iter_pd0(self.filepath)))
+        vtw          = DeadReckoning().get_through_water_velocities(df)
+        vog          = df[['abs_vel_btm_u', 'abs_vel_btm_v']].values
+        dvl_x        = df[list(self.ts.velocity_vars[0::4])]
+        dvl_y        = df[list(self.ts.velocity_vars[1::4])]
+        for t in range(len(df)):
+            row = df.iloc[t]
+            if not np.isnan(vog[t, 0]):
+                voc_ref = VelocityShearPropagation.OceanCurrent(
+                    vog[t, 0] - vtw[t, 0], vog[t, 1] - vtw[t, 1], 0)
+            else:
+                voc_ref = VelocityShearPropagation.OceanCurrent()
+            direction  = 'descending' if row.delta_z > 0 else 'ascending'
+            shear_list = []
+            if row.num_good_vel_bins > 4:
+                for bin_num in range(int(row.num_good_vel_bins)):
+                    shear_list.append(VelocityShearPropagation.OceanCurrent(
+                        vtw[t, 0] + dvl_x.values[t, bin_num], 
+                        vtw[t, 1] + dvl_y.values[t, bin_num], 0))
+            elif voc_ref.is_none():
+                continue
+            water_column.add_shear_node(z_true=row.depth, t=row.time,
+                shear_list=shear_list, voc_ref=voc_ref, direction=direction,
+                pitch=row.pitch, roll=row.roll)
+        return water_column
+
+    def test_odometry_matches_dead_reckoning(self):
+        engine    = NavigationEngine(max_nodes_per_bin=None)
+        estimates = self.run_engine(engine)
+        voc       = estimates[['voc_u', 'voc_v']].to_numpy()
+        self.assertTrue(np.isfinite(voc).any())
+
+        # the odometry integrates the ocean current estimate of each ping
+        odometry  = DeadReckoning().compute_odometry(self.ts.df, voc)
+        for var in ['rel_pos_x', 'rel_pos_y', 'rel_pos_z', 'velocity_source']:
+            np.testing.assert_allclose(estimates[var], odometry[var],
+                                       rtol=0, atol=1e-9)
+
+        # without TAN fixes, the TAN position follows the odometry
+        np.testing.assert_allclose(estimates.tan_pos_x, estimates.rel_pos_x)
+        self.assertTrue(estimates.tan_pos_r.is_monotonic_increasing)
+
+        # the water column matches the offline water column
+        expected = self.compute_water_column()
+        for z, nodes in expected.shear_node_dict.items():
+            self.assertEqual([str(_) for _ in nodes],
+                             [str(_) for _ in
+                              engine.water_column.shear_node_dict[z]])
+
+    def test_gps_resets(self):
+        rng    = np.random.default_rng(3)
+        states = [{'time'        : t,
+                   'm_heading'   : np.nan,
+                   'm_x_lmc'     : 100.0 + i,
+                   'm_y_lmc'     : 200.0 - i,
+                   'm_gps_x_lmc' : rng.normal(110, 5),
+                   'm_gps_y_lmc' : rng.normal(190, 5)}
+                  for i, t in enumerate(self.ts.df.time)]
+        for i in rng.choice(len(states), 150, replace=False):
+            states[i]['m_gps_x_lmc'] = np.nan
+        engine    = NavigationEngine()
+        estimates = self.run_engine(engine, states)
+        np.testing.assert_array_equal(engine.origin, [100, 200])
+        self.assertEqual(engine.get_attitude(
+            next(PathfinderTimeSeries.iter_pd0(self.filepath)))[2],
+            self.ts.df.heading.iloc[0])
+
+        # near the surface, the position is reset to the GPS fix of the cycle
+        resets  = np.array([[_['m_gps_x_lmc'], _['m_gps_y_lmc']]
+                            for _ in states]) - [100, 200]
+        resets[self.ts.df.depth.values >= 10] = np.nan
+        odometry = DeadReckoning().compute_odometry(
+            self.ts.df, estimates[['voc_u', 'voc_v']].to_numpy(), resets)
+        for var in ['rel_pos_x', 'rel_pos_y']:
+            np.testing.assert_allclose(estimates[var], odometry[var],
+                                       rtol=0, atol=1e-9)
+        reset = ~np.isnan(resets[:,0])
+        reset[0] = False
+        self.assertTrue(reset.any())
+        np.testing.assert_array_equal(estimates.tan_pos_x[reset],
+                                      resets[reset, 0])
+
+    def test_water_column_is_bounded(self):
+        engine    = NavigationEngine(max_nodes_per_bin=3)
+        estimates = self.run_engine(engine)
+        self.assertTrue(estimates.voc_u.notna().any())
+        kept = [node for nodes in engine.water_column.shear_node_dict.values()
+                for node in nodes]
+        for nodes in engine.water_column.shear_node_dict.values():
+            self.assertLessEqual(len(nodes), 3)
+
+        # dropped nodes are detached, so the kept nodes only reach a few
+        # other nodes through the propagation graph
+        reachable = {}
+        stack     = list(kept)
+        while stack:
+            node = stack.pop()
+            if id(node) not in reachable:
+                reachable[id(node)] = node
+                stack.extend(node.children)
+                if node.parent is not None:
+                    stack.append(node.parent)
+        self.assertLess(len(reachable), 2*len(kept))
+
+    def test_tan_fix(self):
+        bathy_df = pd.DataFrame({
+            'utm_x_list'  : [1000.0, 1010.0, 1020.0, 1500.0],
+            'utm_y_list'  : [2000.0, 2000.0, 2010.0, 2000.0],
+            'depth_list'  : [50.0, 51.0, 60.0, 50.0],
+            'slope_list'  : [10.0, 20.0, 10.0, 10.0],
+            'orient_list' : [0.0, 0.0, 0.0, 0.0],
+        })
+        engine   = NavigationEngine(bathy_df=bathy_df, origin_utm=(1000, 2000))
+        position = np.array([5.0, 0.0])
+        np.testing.assert_array_equal(
+            engine.get_tan_fix(50.5, 19, position, 30), [10, 0])
+        np.testing.assert_array_equal(
+            engine.get_tan_fix(50.5, 30, position, 30), [5, 0])
+        self.assertTrue(np.isnan(engine.get_tan_fix(50.5, 19, position, 1))
+                        .all())
+        self.assertTrue(np.isnan(NavigationEngine().get_tan_fix(
+            50.5, 19, position, 30)).all())
+
+        # bathymetry factors are found over the point cloud of the dive
+        estimates = self.run_engine(engine)
+        self.assertTrue(estimates.bathy_depth.notna().any())
+
+
+class TestNavigationReplay(unittest.TestCase):
+    """Test replaying a pd0 file through the navigation engine."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir  = tempfile.TemporaryDirectory()
+        cls.filepath = os.path.join(cls.tmp_dir.name, 'dive.pd0')
+        asc_path     = os.path.join(cls.tmp_dir.name, 'dive.asc')
+        synthetic_data.write_pd0(cls.filepath, num_ensembles=60)
+        cls.ts = PathfinderTimeSeries.from_pd0(cls.filepath, save=False,
+                                               verbose=False)
+        synthetic_data.write_asc(asc_path, num_rows=40,
+                                 start_time=cls.ts.df.time.iloc[0] - 5*3600 - 10)
+        cls.fc = SlocumFlightController.from_asc(asc_path, save=False,
+                                                 verbose=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_replay(self):
+        estimates, latencies = navigation_replay.replay(self.filepath,
+            flight_controller=self.fc)
+        self.assertEqual(len(estimates), 60)
+        np.testing.assert_array_equal(estimates.time, self.ts.df.time)
+        self.assertTrue((latencies > 0).all())
+        stats = navigation_replay.get_latency_stats(latencies)
+        self.assertEqual(stats['num_pings'], 60)
+        self.assertLessEqual(stats['p50'], stats['max'])
+
+        # every ping is given the latest cycle of the flight controller
+        states = navigation_replay.get_flight_states(self.fc)
+        self.assertIsNone(navigation_replay.get_flight_state(
+            states, self.fc.df.time.iloc[0] - 1))
+        state  = navigation_replay.get_flight_state(states,
+                                                    self.fc.df.time.iloc[5] + 1)
+        self.assertEqual(state['time'], self.fc.df.time.iloc[5])
+
+    def test_replay_is_paced(self):
+        # 120 s of pings at 1000 times real time
+        start = time.perf_counter()
+        estimates, _ = navigation_replay.replay(self.filepath, speed=1000)
+        duration = self.ts.df.time.iloc[-1] - self.ts.df.time.iloc[0]
+        self.assertGreaterEqual(time.perf_counter() - start, duration/1000)
+        self.assertEqual(len(estimates), 60)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored','-v'], exit=False)
@@ -0,0 +1,207 @@
+# test_PathfinderStream.py
+#
+# Unit tests for reading Pathfinder ensembles from a live pd0 byte stream.
+
+
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+import numpy as np
+import pd0_simulator
+import synthetic_data
+from PathfinderStream import PathfinderStream
+from PathfinderTimeSeries import PathfinderTimeSeries
+
+
+class TestPathfinderStream(unittest.TestCase):
+    """Test framing, validating and dispatching ensembles from a stream."""
+
+    ENSEMBLE_LEN = 1046
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir  = tempfile.TemporaryDirectory()
+        cls.filepath = os.path.join(cls.tmp_dir.name, 'dive.pd0')
+        synthetic_data.write_pd0(cls.filepath, num_ensembles=60)
+        with open(cls.filepath, 'rb') as f:
+            cls.pd0_bytes = f.read()
+        cls.expected = [_.data_array for _ in
+                        PathfinderTimeSeries.iter_pd0(cls.filepath)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def stream_chunks(self, chunks, maxsize=1000):
+        """Feeds chunks of bytes to a stream and returns the ensembles."""
+        async def run():
+            stream = PathfinderStream()
+            queue  = stream.subscribe(maxsize)
+            for chunk in chunks:
+                stream.feed(chunk)
+            stream.close()
+            ensembles = []
+            while True:
+                ensemble = await queue.get()
+                if ensemble is None:
+                    return stream, ensembles
+                ensembles.append(ensemble)
+        return asyncio.run(run())
+
+    def assertEnsemblesEqual(self, ensembles, expected):
+        self.assertEqual(len(ensembles), len(expected))
+        for ensemble, data_array in zip(ensembles, expected):
+            np.testing.assert_array_equal(ensemble.data_array, data_array)
+
+    def test_frames_across_chunks(self):
+        rng = np.random.default_rng(0)
+        for chunk_size in [1, 2, 7, 1000, 1046, 4096, len(self.pd0_bytes)]:
+            chunks = [self.pd0_bytes[i:i + chunk_size]
+                      for i in range(0, len(self.pd0_bytes), chunk_size)]
+            stream, ensembles = self.stream_chunks(chunks)
+            self.assertEnsemblesEqual(ensembles, self.expected)
+            self.assertEqual(stream.stats['num_ensembles'], 60)
+            self.assertEqual(stream.stats['num_skipped_bytes'], 0)
+
+        # chunks of random sizes
+        splits = np.sort(rng.choice(len(self.pd0_bytes), 200, replace=False))
+        chunks = [self.pd0_bytes[i:j] for i, j in
+                  zip(np.r_[0, splits], np.r_[splits, len(self.pd0_bytes)])]
+        self.assertEnsemblesEqual(self.stream_chunks(chunks)[1], self.expected)
+
+    def test_skips_damaged_ensembles(self):
+        # corrupt a byte of ensemble 10, insert a dropout after ensemble 30,
+        # start with garbage and truncate the last ensemble
+        pd0_bytes = bytearray(self.pd0_bytes)
+        pd0_bytes[10*self.ENSEMBLE_LEN + 500] ^= 0xff
+        pd0_bytes[31*self.ENSEMBLE_LEN:31*self.ENSEMBLE_LEN] = \
+            b'\x7f\x7f\x00' * 7
+        pd0_bytes = b'\x00\x7f\xff\x7f' + pd0_bytes[:-100]
+        for chunk_size in [1, 500, len(pd0_bytes)]:
+            chunks = [pd0_bytes[i:i + chunk_size]
+                      for i in range(0, len(pd0_bytes), chunk_size)]
+            stream, ensembles = self.stream_chunks(chunks)
+            self.assertEqual(stream.stats['num_ensembles'], 58)
+            self.assertEqual(stream.stats['num_skipped_bytes'],
+                             4 + self.ENSEMBLE_LEN + 21 +
+                             self.ENSEMBLE_LEN - 100)
+            self.assertGreaterEqual(stream.stats['num_bad_checksums'], 1)
+            self.assertEqual([_.ensemble_number for _ in ensembles],
+                             [_ for _ in range(1, 60) if _ != 11])
+
+    def test_drops_oldest_ensembles(self):
+        stream, ensembles = self.stream_chunks([self.pd0_bytes], maxsize=10)
+        self.assertEqual(stream.stats['num_dropped'], 51)
+        self.assertEqual([_.ensemble_number for _ in ensembles],
+                         list(range(52, 61)))
+
+        # every subscriber gets every ensemble, without holding on to the
+        # chain of previous ensembles
+        async def run():
+            stream = PathfinderStream()
+            queues = [stream.subscribe(), stream.subscribe()]
+            stream.feed(self.pd0_bytes)
+            return [[queue.get_nowait() for _ in range(queue.qsize())]
+                    for queue in queues]
+        ensembles1, ensembles2 = asyncio.run(run())
+        self.assertEqual(ensembles1, ensembles2)
+        self.assertEnsemblesEqual(ensembles1, self.expected)
+        self.assertIsNone(ensembles1[-2].prev_ensemble)
+
+    def test_read_pipe(self):
+        async def run():
+            stream = PathfinderStream()
+            queue  = stream.subscribe()
+            read_fd, write_fd = os.pipe()
+
+            async def write():
+                with os.fdopen(write_fd, 'wb', buffering=0) as f:
+                    for i in range(0, len(self.pd0_bytes), 777):
+                        f.write(self.pd0_bytes[i:i + 777])
+                        await asyncio.sleep(0)
+
+            with os.fdopen(read_fd, 'rb', buffering=0) as f:
+                await asyncio.gather(stream.read_device(f), write())
+            return [queue.get_nowait() for _ in range(queue.qsize())]
+        ensembles = asyncio.run(run())
+        self.assertIsNone(ensembles[-1])
+        self.assertEnsemblesEqual(ensembles[:-1], self.expected)
+
+    def test_read_tcp_simulator(self):
+        async def run():
+            server = await pd0_simulator.start_server(self.filepath,
+                                                      speed=1000,
+                                                      chunk_size=300)
+            port   = server.sockets[0].getsockname()[1]
+            stream = PathfinderStream()
+            queue  = stream.subscribe()
+            start  = time.perf_counter()
+            async with server:
+                await stream.read_tcp('127.0.0.1', port)
+            duration  = time.perf_counter() - start
+            ensembles = [queue.get_nowait() for _ in range(queue.qsize())]
+            return duration, ensembles
+        duration, ensembles = asyncio.run(run())
+        self.assertIsNone(ensembles[-1])
+        self.assertEnsemblesEqual(ensembles[:-1], self.expected)
+
+        # the ensembles are released at 1000 times their recorded times
+        times = [_.time for _ in ensembles[:-1]]
+        self.assertGreaterEqual(duration, (times[-1] - times[0])/1000)
+
+    @unittest.skipUnless(hasattr(os, 'openpty'), 'requires a pty')
+    def test_read_terminal(self):
+        import termios
+        master_fd, slave_fd = os.openpty()
+        self.addCleanup(os.close, master_fd)
+        self.addCleanup(os.close, slave_fd)
+        attrs = termios.tcgetattr(slave_fd)
+
+        async def run():
+            stream = PathfinderStream()
+            queue  = stream.subscribe(1000)
+            task   = asyncio.ensure_future(
+                stream.read_device(os.ttyname(slave_fd)))
+
+            # write once the terminal is in raw mode, and yield to the
+            # stream while the few kB buffered by the terminal are full
+            while termios.tcgetattr(slave_fd) == attrs:
+                await asyncio.sleep(0.01)
+            os.set_blocking(master_fd, False)
+            data = memoryview(self.pd0_bytes)
+            while data:
+                try:
+                    data = data[os.write(master_fd, data):]
+                except BlockingIOError:
+                    await asyncio.sleep(0.001)
+            ensembles = [await queue.get() for _ in self.expected]
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return ensembles
+        self.assertEnsemblesEqual(asyncio.run(run()), self.expected)
+        self.assertEqual(termios.tcgetattr(slave_fd), attrs)
+
+    def test_read_device_closes_on_error(self):
+        opened = []
+        def open_device(*args, **kwargs):
+            opened.append(open(*args, **kwargs))
+            return opened[-1]
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            with unittest.mock.patch('PathfinderStream.open', open_device,
+                                     create=True), \
+                 unittest.mock.patch.object(loop, 'connect_read_pipe',
+                                            side_effect=OSError):
+                await PathfinderStream().read_device(self.filepath)
+        with self.assertRaises(OSError):
+            asyncio.run(run())
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored','-v'], exit=False)
@@ -0,0 +1,405 @@
+# test_PathfinderTimeSeries.py
+#
+# Unit tests for parsing Pathfinder pd0 files into a time series.
+
+
+import datetime
+import os
+import struct
+import tempfile
+import unittest
+import unittest.mock
+import numpy as np
+import pandas as pd
+import synthetic_data
+from PathfinderChecksumError import PathfinderChecksumError
+from PathfinderDVL import PathfinderDVL
+from PathfinderTimeSeries import PathfinderTimeSeries
+from SlocumFlightController import SlocumFlightController
+
+
+class TestPathfinderParsing(unittest.TestCase):
+    """Test parsing of synthetic pd0 files."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir  = tempfile.TemporaryDirectory()
+        cls.filepath = os.path.join(cls.tmp_dir.name, 'dive.pd0')
+        synthetic_data.write_pd0(cls.filepath, num_ensembles=120)
+        cls.ts = PathfinderTimeSeries.from_pd0(cls.filepath, save=False,
+                                               verbose=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def assertFramesEqual(self, df1, df2):
+        self.assertEqual(list(df1.columns), list(df2.columns))
+        self.assertTrue((df1.index == df2.index).all())
+        np.testing.assert_allclose(df1.values, df2.values, rtol=1e-9,
+                                   atol=1e-9, equal_nan=True)
+
+    def test_batch_decoder_matches_ensemble_parser(self):
+        ts = PathfinderTimeSeries.from_pd0(self.filepath, save=False,
+                                           verbose=False, batch=True)
+        self.assertFramesEqual(self.ts.df, ts.df)
+
+    def test_chunks_carry_previous_ensemble(self):
+        for batch in [False, True]:
+            chunks = list(PathfinderTimeSeries.iter_pd0(
+                self.filepath, chunk_size=50, batch=batch))
+            self.assertEqual([len(_) for _ in chunks], [50, 50, 20])
+            self.assertFramesEqual(self.ts.df, pd.concat(chunks))
+
+    def test_iterate_ensembles(self):
+        ensembles = list(PathfinderTimeSeries.iter_pd0(self.filepath))
+        self.assertEqual(len(ensembles), 120)
+        np.testing.assert_allclose(ensembles[-1].data_array,
+                                   self.ts.df.values[-1], equal_nan=True)
+
+    def test_compiled_formats_match_format_tuples(self):
+        dvl = PathfinderDVL()
+        with open(self.filepath, 'rb') as f:
+            pd0_bytes = f.read()
+        sections = [
+            (dvl.header_format,          dvl.header_codec,           0),
+            (dvl.fixed_leader_format,    dvl.fixed_leader_codec,    20),
+            (dvl.variable_leader_format, dvl.variable_leader_codec, 78),
+            (dvl.bottom_track_format,    dvl.bottom_track_codec,   963),
+        ]
+        for format_tuples, (codec, names), offset in sections:
+            values = dict(zip(names, codec.unpack_from(pd0_bytes, offset)))
+            for name, var_format, var_offset in format_tuples:
+                expected = struct.unpack_from(var_format, pd0_bytes,
+                                              offset + var_offset)[0]
+                self.assertEqual(values[name], expected)
+
+    def test_parse_cache(self):
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        ts1 = PathfinderTimeSeries.from_pd0(self.filepath, save=False,
+            verbose=False, batch=True, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        ts2 = PathfinderTimeSeries.from_pd0(self.filepath, save=False,
+            verbose=False, cache_dir=cache_dir)
+        self.assertFramesEqual(self.ts.df, ts1.df)
+        self.assertFramesEqual(self.ts.df, ts2.df)
+
+        # selective column loads only return the requested columns
+        columns = ['time', 'pitch'] + list(ts1.bottom_track_vars_short)
+        ts3 = PathfinderTimeSeries.from_pd0(self.filepath, save=False,
+            verbose=False, cache_dir=cache_dir, columns=columns)
+        self.assertFramesEqual(self.ts.df[columns], ts3.df)
+
+        # time zone aware indices are cached in their own entry
+        with unittest.mock.patch.object(PathfinderTimeSeries, 'TIME_ZONE',
+                                        'Europe/Athens'):
+            for _ in range(2):
+                ts4 = PathfinderTimeSeries.from_pd0(self.filepath, save=False,
+                    verbose=False, cache_dir=cache_dir)
+                self.assertEqual(str(ts4.df.index.tz), 'Europe/Athens')
+                self.assertFramesEqual(self.ts.df.reset_index(drop=True),
+                                       ts4.df.reset_index(drop=True))
+        tz_entries = [_ for _ in os.listdir(cache_dir) if '_tz-' in _]
+        self.assertEqual(len(tz_entries), 1)
+        os.remove(os.path.join(cache_dir, tz_entries[0]))
+
+        # changing the mounting bias angles misses the cache
+        with unittest.mock.patch.object(PathfinderDVL, 'BIAS_HEADING', 20):
+            ts5 = PathfinderTimeSeries.from_pd0(self.filepath, save=False,
+                verbose=False, cache_dir=cache_dir)
+            expected = PathfinderTimeSeries.from_pd0(self.filepath,
+                save=False, verbose=False)
+        self.assertFramesEqual(expected.df, ts5.df)
+        for var in ['abs_vel_btm_u', 'rel_pos_x_dvl_dr']:
+            self.assertFalse(np.allclose(self.ts.df[var], ts5.df[var],
+                                         equal_nan=True))
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        bias_entries = [_ for _ in os.listdir(cache_dir)
+                        if '_bias_heading-20_' in _]
+        self.assertEqual(len(bias_entries), 1)
+        os.remove(os.path.join(cache_dir, bias_entries[0]))
+
+        # a different file (or parser version) is a different cache entry
+        filepath = os.path.join(self.tmp_dir.name, 'dive2.pd0')
+        synthetic_data.write_pd0(filepath, num_ensembles=10, seed=1)
+        PathfinderTimeSeries.from_pd0(filepath, save=False, verbose=False,
+                                      cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_decode_profiles_on_demand(self):
+        ENSEMBLE_LEN = 1046
+        with open(self.filepath, 'rb') as f:
+            pd0_bytes = np.frombuffer(f.read(), dtype=np.uint8)
+        for var_type, offset, mult in [('correlation',    479, 1),
+                                       ('echo_intensity', 641, 0.61),
+                                       ('percent_good',   803, 1)]:
+            index    = np.arange(120)[:,None]*ENSEMBLE_LEN + offset
+            expected = pd0_bytes[index + np.arange(160)] * mult
+            profiles = self.ts.get_profiles(var_type)
+            self.assertTrue((profiles.index == self.ts.df.index).all())
+            self.assertEqual(profiles.columns[1], '%s_bin0_beam1' % 
+                             (self.ts.data_abbreviations[var_type],))
+            np.testing.assert_allclose(profiles.values, expected)
+        self.assertIs(self.ts.get_profiles('correlation'), 
+                      self.ts.get_profiles('correlation'))
+
+    def test_parse_directory_in_parallel(self):
+        directory = os.path.join(self.tmp_dir.name, 'cruise')
+        os.mkdir(directory)
+        starts = [(19, 11, 22, 5, 0, 0), (19, 11, 22, 3, 0, 0)]
+        for i, start in enumerate(starts):
+            synthetic_data.write_pd0(os.path.join(directory, 'dive%d.pd0' % i),
+                                     num_ensembles=60, start=start, seed=i)
+        dives = [PathfinderTimeSeries.from_pd0(
+                    os.path.join(directory, 'dive%d.pd0' % i), save=False, 
+                    verbose=False).df for i in [1, 0]]
+
+        ts = PathfinderTimeSeries.from_directory(directory, workers=2)
+        self.assertFramesEqual(ts.df, pd.concat(dives))
+        ts.compute_derived_variables()
+        self.assertFramesEqual(ts.df, pd.concat(dives))
+        by_dive = PathfinderTimeSeries.from_directory(directory, workers=1,
+                                                      by_dive=True)
+        self.assertEqual(list(by_dive), ['dive1', 'dive0'])
+        self.assertFramesEqual(by_dive['dive0'].df, dives[1])
+
+        # profiles are decoded from the source file of each dive 
+        profiles = [by_dive[_].get_profiles('percent_good') for _ in by_dive]
+        self.assertFramesEqual(ts.get_profiles('percent_good'), 
+                               pd.concat(profiles))
+
+    def test_ensembles_are_views_into_data_array(self):
+        data_array = np.full((100, PathfinderDVL().ensemble_size), np.inf)
+        with PathfinderTimeSeries.open_pd0(self.filepath) as pd0_file:
+            ensembles = list(PathfinderTimeSeries.iter_ensembles(
+                pd0_file, data_array=data_array))
+        self.assertEqual(len(ensembles), 100)
+        np.testing.assert_allclose(data_array, self.ts.df.values[:100],
+                                   equal_nan=True)
+        ensemble = ensembles[-1]
+        self.assertFalse(hasattr(ensemble, '__dict__'))
+        self.assertTrue(np.shares_memory(ensemble.data_array, data_array))
+        self.assertEqual(ensemble.pitch, ensemble.get_data('pitch'))
+        self.assertEqual(ensemble.pitch, self.ts.df.pitch.iloc[99])
+        with self.assertRaises(AttributeError):
+            ensemble.pitch = 0
+
+    def test_label_metadata_is_shared(self):
+        dvl1, dvl2 = PathfinderDVL(), PathfinderDVL()
+        self.assertIs(dvl1.label_list, dvl2.label_list)
+        self.assertIs(dvl1.data_lookup, dvl2.data_lookup)
+        self.assertEqual(dvl1.data_lookup['time'], 0)
+        self.assertEqual(len(dvl1.velocity_vars), 160)
+        with self.assertRaises(TypeError):
+            dvl1.data_lookup['time'] = 1
+
+    def test_incremental_to_dataframe(self):
+        ts = PathfinderTimeSeries('incremental')
+        for i, ensemble in enumerate(PathfinderTimeSeries.iter_pd0(
+                self.filepath)):
+            ts.add_ensemble(ensemble)
+            if i % 7 == 0:
+                prev_df = ts.df
+                ts.to_dataframe()
+        ts.to_dataframe()
+        self.assertFramesEqual(self.ts.df, ts.df)
+
+        # earlier DataFrames are views of the same rows, not copies
+        self.assertTrue(np.shares_memory(prev_df.values, ts.df.values))
+        self.assertFramesEqual(ts.df.iloc[:len(prev_df)], prev_df)
+
+        # ensembles added to a replaced DataFrame are appended to it
+        ts._df = self.ts.df.iloc[:60]
+        ts.add_ensembles(self.ts.df.values[60:])
+        ts.to_dataframe()
+        self.assertFramesEqual(self.ts.df, ts.df)
+
+        # edits to the DataFrame are kept when ensembles are appended: an 
+        # assigned column replaces the array of the column in the buffer, 
+        # and added columns are NaN for the new ensembles
+        ts._df = self.ts.df.iloc[:60]
+        ts.add_ensembles(self.ts.df.values[60:90])
+        ts.to_dataframe()
+        ts.df['ocn_vel_u'] = 5.0
+        ts.df['extra']     = 1.0
+        ts.add_ensembles(self.ts.df.values[90:])
+        ts.to_dataframe()
+        self.assertEqual(list(ts.df.columns), list(self.ts.df.columns) + 
+                         ['extra'])
+        np.testing.assert_array_equal(ts.df.ocn_vel_u.iloc[:90], 5.0)
+        np.testing.assert_array_equal(ts.df.ocn_vel_u.iloc[90:],
+                                      self.ts.df.ocn_vel_u.iloc[90:])
+        np.testing.assert_array_equal(ts.df.extra.iloc[:90], 1.0)
+        self.assertTrue(ts.df.extra.iloc[90:].isna().all())
+        self.assertFramesEqual(self.ts.df.drop(columns='ocn_vel_u'),
+            ts.df.drop(columns=['ocn_vel_u', 'extra']))
+
+    def test_recompute_derived_variables(self):
+        ts = PathfinderTimeSeries.from_pd0(self.filepath, save=False, 
+                                           verbose=False, batch=True)
+        ts.compute_derived_variables()
+        self.assertFramesEqual(self.ts.df, ts.df)
+
+        # a lower max speed selects other bins, as if parsed with it
+        ts.compute_derived_variables(max_speed=0.4)
+        with unittest.mock.patch.object(PathfinderDVL, 'MAX_SPEED', 0.4):
+            expected = PathfinderTimeSeries.from_pd0(self.filepath, 
+                save=False, verbose=False).df
+        self.assertFramesEqual(expected, ts.df)
+        self.assertFalse(np.allclose(ts.df.rel_pos_x_dvl_dr, 
+                                     self.ts.df.rel_pos_x_dvl_dr))
+
+    def test_reproject_mounting_bias(self):
+        ts = PathfinderTimeSeries.from_pd0(self.filepath, save=False, 
+                                           verbose=False, batch=True)
+        biases = {'BIAS_PITCH' : 8.0, 'BIAS_ROLL' : 4.0, 'BIAS_HEADING' : -3.0}
+        ts.reproject(bias_pitch=8.0, bias_roll=4.0, bias_heading=-3.0)
+        with unittest.mock.patch.multiple(PathfinderDVL, **biases):
+            expected = PathfinderTimeSeries.from_pd0(self.filepath, 
+                save=False, verbose=False).df
+        self.assertFramesEqual(expected, ts.df)
+
+        # reprojecting back to the original angles undoes the change
+        ts.reproject(bias_pitch=PathfinderDVL.BIAS_PITCH, 
+                     bias_roll=PathfinderDVL.BIAS_ROLL,
+                     bias_heading=PathfinderDVL.BIAS_HEADING)
+        self.assertFramesEqual(self.ts.df, ts.df)
+
+    def test_mounting_bias_rotation(self):
+        dvl      = PathfinderDVL()
+        heading  = np.array([0., 45., 271.5])
+        rad      = lambda deg: deg*dvl.DEG_TO_RAD
+        R        = dvl.get_mounting_bias_rotation(heading)
+        self.assertEqual(R.shape, (3, 3, 3))
+        self.assertIs(dvl.get_bias_rotation(),
+                      PathfinderDVL().get_bias_rotation())
+        for h, R_h in zip(heading, R):
+            expected = dvl.Qz(-rad(h - dvl.BIAS_HEADING)) @ \
+                       dvl.Qy(rad(dvl.BIAS_ROLL)) @ \
+                       dvl.Qx(rad(dvl.BIAS_PITCH)) @ dvl.Qz(rad(h))
+            np.testing.assert_allclose(R_h, expected, atol=1e-15)
+            np.testing.assert_allclose(dvl.get_mounting_bias_rotation(h), R_h)
+
+    def test_resync_skips_damaged_ensembles(self):
+        ENSEMBLE_LEN = 1046
+        with open(self.filepath, 'rb') as f:
+            pd0_bytes = bytearray(f.read())
+
+        # corrupt a byte of ensemble 10, insert a dropout after ensemble 30,
+        # and truncate the last ensemble
+        pd0_bytes[10*ENSEMBLE_LEN + 500] ^= 0xff
+        pd0_bytes[31*ENSEMBLE_LEN:31*ENSEMBLE_LEN] = b'\x7f\x7f\x00' * 7
+        pd0_bytes = pd0_bytes[:-100]
+        filepath = os.path.join(self.tmp_dir.name, 'damaged.pd0')
+        with open(filepath, 'wb') as f:
+            f.write(pd0_bytes)
+
+        with self.assertRaises(PathfinderChecksumError):
+            PathfinderTimeSeries.from_pd0(filepath, save=False, verbose=False)
+        frames = []
+        for batch in [False, True]:
+            ts = PathfinderTimeSeries.from_pd0(filepath, save=False,
+                verbose=False, batch=batch, resync=True)
+            self.assertEqual(ts.resync_stats['num_ensembles'], 118)
+            self.assertEqual(ts.resync_stats['num_skipped_bytes'],
+                             ENSEMBLE_LEN + 21 + ENSEMBLE_LEN - 100)
+            self.assertEqual(len(ts.resync_stats['skipped']), 3)
+            frames.append(ts.df)
+        expected = [_ for _ in range(1, 120) if _ != 11]
+        self.assertEqual(list(frames[0].ensemble_number), expected)
+        self.assertFramesEqual(frames[0], frames[1])
+
+        # the diagnostics of a verbose parse use the first valid ensemble,
+        # also when the first ensemble of the file is damaged
+        pd0_bytes[500] ^= 0xff
+        with open(filepath, 'wb') as f:
+            f.write(pd0_bytes)
+        with unittest.mock.patch('builtins.print') as mock_print:
+            ts = PathfinderTimeSeries.from_pd0(filepath, save=False,
+                verbose=True, resync=True)
+        self.assertEqual(ts.resync_stats['num_ensembles'], 117)
+        self.assertEqual(list(ts.df.ensemble_number), expected[1:])
+        mock_print.assert_any_call('- Sensor Configuration -----------------')
+
+    def test_num_ensembles(self):
+        self.assertEqual(len(self.ts.df), 120)
+        self.assertEqual(list(self.ts.df.ensemble_number),
+                         list(range(1, 121)))
+
+
+class TestFlightControllerSync(unittest.TestCase):
+    """Test synchronizing flight controller variables to the DVL times."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        pd0_path    = os.path.join(cls.tmp_dir.name, 'dive.pd0')
+        asc_path    = os.path.join(cls.tmp_dir.name, 'dive.asc')
+        synthetic_data.write_pd0(pd0_path, num_ensembles=120)
+        cls.ts = PathfinderTimeSeries.from_pd0(pd0_path, save=False,
+                                               verbose=False, batch=True)
+
+        # the flight controller starts after and ends before the DVL, and
+        # logs its present time in EDT
+        start = cls.ts.df.time.iloc[0] - 5*3600 + 5
+        synthetic_data.write_asc(asc_path, num_rows=55, start_time=start)
+        cls.fc = SlocumFlightController.from_asc(asc_path, save=False,
+                                                 verbose=False)
+
+        # a sample logged twice at the same time
+        repeated = cls.fc.df.iloc[[20]].copy()
+        repeated[['m_pitch', 'm_roll']] = [0.5, -0.5]
+        cls.fc._df = pd.concat([cls.fc.df, repeated]).sort_index(
+            kind='mergesort')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def sync_variable(self, var):
+        """Time synchronization loop of dvl-nav_testRun.py for a variable,
+        with the interpolation weights of the two samples the right way
+        around."""
+        df_dbd = self.fc.df.dropna(subset=[var])
+        values = []
+        for t in self.ts.df.time:
+            target = datetime.datetime.fromtimestamp(t)
+            lower  = df_dbd[:str(target)]
+            upper  = df_dbd[str(target):]
+            if len(lower) == 0:
+                values.append(upper[var].iloc[0])
+                continue
+            if len(upper) == 0:
+                values.append(lower[var].iloc[-1])
+                continue
+            delta_t = upper.time.iloc[0] - lower.time.iloc[-1]
+            if delta_t == 0:
+                values.append(lower[var].iloc[-1])
+                continue
+            upper_per = (t - lower.time.iloc[-1])/delta_t
+            lower_per = 1 - upper_per
+            values.append(lower[var].iloc[-1]*lower_per +
+                          upper[var].iloc[0]*upper_per)
+        return np.array(values)
+
+    def test_matches_time_synchronization_loop(self):
+        df_sync = self.ts.sync_flight_controller(self.fc,
+            ['m_pitch', 'm_roll', 'm_depth'])
+        self.assertTrue(df_sync.index.equals(self.ts.df.index))
+        self.assertFalse(df_sync.isna().any().any())
+        for var in df_sync.columns:
+            np.testing.assert_allclose(df_sync[var], self.sync_variable(var),
+                                       rtol=0, atol=1e-12)
+
+    def test_heading_wraps_around(self):
+        deg = np.deg2rad([350, 359, 1, 20, 340])
+        t   = [0, 10, 20, 30, 40]
+        synced = PathfinderTimeSeries.interpolate([5, 15, 25, 35, 50], t,
+                                                  deg, circular=True)
+        np.testing.assert_allclose(np.rad2deg(synced), [354.5, 0, 10.5, 0,
+                                   340], atol=1e-9)
+        self.assertTrue(((synced >= 0) & (synced < 2*np.pi)).all())
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored','-v'], exit=False)
@@ -0,0 +1,282 @@
+# test_SlocumFlightController.py
+#
+# Unit tests for parsing Slocum flight controller logs into a time series.
+
+
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+import numpy as np
+import pandas as pd
+import synthetic_data
+from datetime import datetime
+from SlocumFlightController import SlocumFlightController
+from TimeSeriesBuffer import TimeSeriesBuffer
+
+
+class TestSlocumParsing(unittest.TestCase):
+    """Test parsing of synthetic flight controller .asc files."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir  = tempfile.TemporaryDirectory()
+        cls.filepath = os.path.join(cls.tmp_dir.name, 'dive.asc')
+        synthetic_data.write_asc(cls.filepath, num_rows=200, extra_vars=20)
+        cls.ts = SlocumFlightController.from_asc(cls.filepath, save=False,
+                                                 verbose=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_time_is_converted_to_utc(self):
+        df = self.ts.df
+        self.assertEqual(len(df), 200)
+        np.testing.assert_array_equal(df.time, df.m_present_time + 5*3600)
+        expected = pd.DatetimeIndex([datetime.fromtimestamp(_)
+                                     for _ in df.time])
+        self.assertTrue((df.index == expected).all())
+
+    def test_selected_columns(self):
+        with open(self.filepath) as f:
+            lines = f.read().splitlines()
+        names  = lines[14].split()
+        values = np.array([[float(_) for _ in line.split()] 
+                           for line in lines[17:]])
+        df = self.ts.df
+        for var in df.columns:
+            if var in names:
+                np.testing.assert_array_equal(df[var], 
+                                              values[:, names.index(var)])
+
+        # variables that are not in the file are NaN
+        self.assertTrue(df.c_heading.isna().all())
+        self.assertNotIn('x_sensor_0', df.columns)
+        self.assertEqual(df.m_filename_hash.nunique(), 1)
+
+    def test_incremental_to_dataframe_keeps_edits(self):
+        ts = SlocumFlightController()
+        ts.add_ensembles(self.ts.df.values[:100])
+        ts.to_dataframe()
+        ts.df['m_depth'] = -1.0
+        ts.df['extra']   = 1.0
+        ts.add_ensembles(self.ts.df.values[100:])
+        ts.to_dataframe()
+        np.testing.assert_array_equal(ts.df.m_depth.iloc[:100], -1.0)
+        np.testing.assert_array_equal(ts.df.m_depth.iloc[100:],
+                                      self.ts.df.m_depth.iloc[100:])
+        np.testing.assert_array_equal(ts.df.extra.iloc[:100], 1.0)
+        self.assertTrue(ts.df.extra.iloc[100:].isna().all())
+        pd.testing.assert_frame_equal(
+            ts.df.drop(columns=['m_depth', 'extra']).iloc[100:],
+            self.ts.df.drop(columns='m_depth').iloc[100:])
+
+        # an unmodified DataFrame is a view of the buffer, not rebuilt
+        df = ts.df
+        ts.add_ensembles(self.ts.df.values[:1])
+        ts.to_dataframe()
+        self.assertTrue(np.shares_memory(df.m_depth.values,
+                                         ts.df.m_depth.values))
+
+    def test_time_zone_aware_index(self):
+        with unittest.mock.patch.object(SlocumFlightController,
+                                        'TIME_ZONE', 'UTC'):
+            ts = SlocumFlightController.from_asc(self.filepath, save=False,
+                                                 verbose=False)
+        self.assertEqual(str(ts.df.index.tz), 'UTC')
+        np.testing.assert_allclose(ts.df.index.asi8 / 1e9, ts.df.time,
+                                   rtol=0, atol=1e-6)
+
+    def test_next_gps_fix(self):
+        df   = self.ts.df
+        rng  = np.random.default_rng(1)
+        t    = np.sort(rng.uniform(df.time.iloc[0] - 10, df.time.iloc[-1] + 10,
+                                   300))
+        t    = np.concatenate((t, df.time.iloc[[0, 2, -3]]))
+        end  = df.time.iloc[-2]
+        fixes = self.ts.get_next_gps_fix(t, end=end)
+
+        # the first cycle at or after each time, up to the end
+        for i, time in enumerate(t):
+            cycles = df[(df.time >= time) & (df.time <= end)]
+            expected = cycles[['m_gps_x_lmc', 'm_gps_y_lmc']].values[0] \
+                       if len(cycles) else [np.nan, np.nan]
+            np.testing.assert_array_equal(fixes[i], expected)
+        self.assertLess(np.isnan(fixes[:,0]).sum(), len(t))
+        np.testing.assert_array_equal(self.ts.get_next_gps_fix(t[-3]),
+                                      fixes[-3])
+
+        # the index is rebuilt when the DataFrame is replaced, or when its
+        # GPS fixes are assigned or written in place
+        index = self.ts.get_gps_index()
+        self.assertIs(self.ts.get_gps_index(), index)
+        ts = SlocumFlightController()
+        ts._df = df.copy()
+        ts.get_gps_index()
+        ts._df.loc[:, 'm_gps_x_lmc'] = 1.0
+        ts._df = ts._df.copy()
+        np.testing.assert_array_equal(ts.get_next_gps_fix(t)[:,0], 
+                                      np.where(t <= df.time.iloc[-1], 1.0,
+                                               np.nan))
+        ts.df['m_gps_x_lmc'] = 2.0
+        np.testing.assert_array_equal(ts.get_next_gps_fix(t[:5])[:,0], 2.0)
+        ts.df.loc[:, 'm_gps_y_lmc'] = 3.0
+        np.testing.assert_array_equal(ts.get_next_gps_fix(t[:5])[:,1], 3.0)
+
+    def test_datetime_index_matches_fromtimestamp(self):
+        # local times around the end of daylight saving time
+        t  = 1572755000 + np.cumsum(np.random.default_rng(0).random(20000))
+        t  = np.concatenate((np.round(t, 2), [1.9999996, -5.25]))
+        tz = os.environ.get('TZ')
+        try:
+            for zone in ['America/New_York', 'Australia/Lord_Howe', 'UTC']:
+                os.environ['TZ'] = zone
+                time.tzset()
+                expected = pd.DatetimeIndex([datetime.fromtimestamp(_)
+                                             for _ in t])
+                index    = TimeSeriesBuffer.get_datetime_index(t)
+                self.assertTrue((index == expected).all(), zone)
+        finally:
+            if tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = tz
+            time.tzset()
+
+
+class TestSlocumBinaryParsing(unittest.TestCase):
+    """Test parsing synthetic binary flight logs against their .asc files."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.options = dict(num_rows=300, seed=4, extra_vars=25)
+        asc_path    = os.path.join(cls.tmp_dir.name, 'dive.asc')
+        synthetic_data.write_asc(asc_path, **cls.options)
+        cls.ts = SlocumFlightController.from_asc(asc_path, save=False,
+                                                 verbose=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def write_dbd(self, name, **kwargs):
+        filepath = os.path.join(self.tmp_dir.name, name)
+        return synthetic_data.write_dbd(filepath, **self.options, **kwargs)
+
+    def test_matches_asc(self):
+        for byteorder in '><':
+            filepath = self.write_dbd('dive.dbd', byteorder=byteorder)
+            ts = SlocumFlightController.from_dbd(filepath, save=False,
+                                                 verbose=False)
+            pd.testing.assert_frame_equal(ts.df, self.ts.df)
+            self.assertEqual(ts.var_names, self.ts.var_names)
+            self.assertEqual(ts.var_sizes, self.ts.var_sizes)
+
+        # repeated values are only stored once, but reported in every cycle
+        status = ts.df.m_gps_status
+        self.assertTrue((status.notna() & (status == status.shift())).any())
+
+    def test_factored_sensor_list(self):
+        filepath = self.write_dbd('factored.dbd', sensor_list_crc='1A2B3C4D')
+        with self.assertRaises(ValueError):
+            SlocumFlightController.from_dbd(filepath, save=False,
+                                            verbose=False)
+
+        # the sensor list is read from the sensor cache
+        _, names, _ = synthetic_data.make_flight_log(**self.options)
+        sensor_cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        os.makedirs(sensor_cache_dir, exist_ok=True)
+        with open(os.path.join(sensor_cache_dir, '1a2b3c4d.cac'), 'w') as f:
+            f.write(synthetic_data.make_sensor_list(names))
+        ts = SlocumFlightController.from_dbd(filepath, save=False,
+            verbose=False, sensor_cache_dir=sensor_cache_dir)
+        pd.testing.assert_frame_equal(ts.df, self.ts.df)
+
+    def test_truncated_and_damaged_logs(self):
+        filepath = self.write_dbd('dive.dbd')
+        with open(filepath, 'rb') as f:
+            dbd = f.read()
+
+        # a log cut off in the last cycle keeps the complete cycles
+        with open(filepath, 'wb') as f:
+            f.write(dbd[:-5])
+        ts = SlocumFlightController.from_dbd(filepath, save=False,
+                                             verbose=False)
+        pd.testing.assert_frame_equal(ts.df, self.ts.df.iloc[:-1])
+
+        # a bad cycle tag is an error
+        start = dbd.index(b'sa\x12\x34') + 16
+        with open(filepath, 'wb') as f:
+            f.write(dbd[:start] + b'q' + dbd[start+1:])
+        with self.assertRaises(ValueError):
+            SlocumFlightController.from_dbd(filepath, save=False,
+                                            verbose=False)
+
+
+class TestSlocumDirectory(unittest.TestCase):
+    """Test parsing a directory of .asc files in parallel with a cache."""
+
+    def setUp(self):
+        self.tmp_dir   = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, 'asc')
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        os.makedirs(self.directory)
+
+        # dives are written out of order of their file names
+        for dive, start in [(2, 1574391600.0), (0, 1574380800.0),
+                            (1, 1574386200.0)]:
+            synthetic_data.write_asc(
+                os.path.join(self.directory, 'dive-%d.asc' % (dive,)),
+                num_rows=150, seed=dive, start_time=start,
+                filename='sentinel-2019-326-3-%d' % (dive,))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def parse_directory(self, **kwargs):
+        with unittest.mock.patch('builtins.print'):
+            return SlocumFlightController.from_directory(self.directory,
+                                                         **kwargs)
+
+    def test_parallel_matches_serial(self):
+        serial   = self.parse_directory(workers=1)
+        parallel = self.parse_directory(workers=2)
+        self.assertEqual(len(serial.df), 450)
+        self.assertTrue(serial.df.index.is_monotonic_increasing)
+        self.assertEqual(serial.df.m_filename_hash.nunique(), 3)
+        self.assertEqual(serial.df.m_mission_hash.nunique(), 1)
+        pd.testing.assert_frame_equal(serial.df, parallel.df)
+
+    def test_prints_extension_if_verbose(self):
+        with unittest.mock.patch('builtins.print') as mock_print:
+            SlocumFlightController.from_directory(self.directory, workers=1)
+            mock_print.assert_not_called()
+            SlocumFlightController.from_directory(self.directory, workers=1,
+                verbose=True, extension='dbd')
+            mock_print.assert_any_call('>> Parsing folder of DBD Files')
+
+    def test_cache_parses_new_files_only(self):
+        expected = self.parse_directory(workers=1)
+        cached   = self.parse_directory(workers=1, cache_dir=self.cache_dir)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+        pd.testing.assert_frame_equal(expected.df, cached.df)
+
+        # only the new file is parsed, the others are loaded from the cache
+        synthetic_data.write_asc(os.path.join(self.directory, 'dive-3.asc'),
+                                 num_rows=150, seed=3, start_time=1574397000.0,
+                                 filename='sentinel-2019-326-3-3')
+        with unittest.mock.patch.object(pd, 'read_csv',
+                                        wraps=pd.read_csv) as read_csv:
+            cached = self.parse_directory(workers=1, cache_dir=self.cache_dir)
+        self.assertEqual(read_csv.call_count, 1)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 4)
+        self.assertEqual(len(cached.df), 600)
+        self.assertTrue(cached.df.index.is_monotonic_increasing)
+        pd.testing.assert_frame_equal(cached.df.iloc[:450], expected.df)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored','-v'], exit=False)
@@ -0,0 +1,73 @@
+# test_bias_calibration.py
+#
+# Unit tests for calibrating the DVL mounting bias against GPS fixes.
+
+
+import copy
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import synthetic_data
+import bias_calibration
+from PathfinderTimeSeries import PathfinderTimeSeries
+
+
+class TestBiasCalibration(unittest.TestCase):
+    """Test the grid search over mounting bias angles on a synthetic dive."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir  = tempfile.TemporaryDirectory()
+        cls.filepath = os.path.join(cls.tmp_dir.name, 'dive.pd0')
+        synthetic_data.write_pd0(cls.filepath, num_ensembles=120)
+        cls.ts = PathfinderTimeSeries.from_pd0(cls.filepath, save=False,
+                                               verbose=False, batch=True)
+
+        # GPS fixes before and after the dive that match the true biases
+        truth = copy.copy(cls.ts)
+        truth.reproject(bias_pitch=8.0, bias_roll=4.0, bias_heading=-3.0)
+        time  = truth.df.time.values
+        end   = truth.df[['rel_pos_x_dvl_dr', 'rel_pos_y_dvl_dr']].values[-1]
+        cls.df_dbd = pd.DataFrame({
+            'time'        : time[[0, 0, -1, -1]] + [-30, -10, 10, 30],
+            'm_gps_x_lmc' : [np.nan, 100.0, 100.0 + end[0], np.nan],
+            'm_gps_y_lmc' : [np.nan,  50.0,  50.0 + end[1], np.nan],
+        })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_gps_fixes(self):
+        time, xy = bias_calibration.get_gps_fixes(self.df_dbd)
+        self.assertEqual(len(time), 2)
+        np.testing.assert_allclose(xy[0], [100.0, 50.0])
+
+    def test_grid_search_finds_true_biases(self):
+        grid = ([4.0, 8.0, 12.5], [0.0, 4.0], [-3.0, 0.0])
+        best, errors = bias_calibration.calibrate_mounting_bias(
+            self.ts, self.df_dbd, *grid, workers=1)
+        self.assertEqual(len(errors), 12)
+        self.assertEqual((best['bias_pitch'], best['bias_roll'],
+                          best['bias_heading']), (8.0, 4.0, -3.0))
+        self.assertLess(best['error'], 1e-9)
+        self.assertGreater(errors.drop(errors.idxmin()).min(), 0.1)
+
+        # candidates evaluated in parallel give the same error surface
+        _, parallel = bias_calibration.calibrate_mounting_bias(
+            self.ts, self.df_dbd, *grid, workers=2)
+        pd.testing.assert_series_equal(errors, parallel)
+
+        # the given time series is left unchanged
+        self.assertEqual(self.ts.BIAS_PITCH, 12.5)
+
+    def test_no_gps_fixes(self):
+        with self.assertRaises(ValueError):
+            bias_calibration.calibrate_mounting_bias(
+                self.ts, self.df_dbd.iloc[:2], [8.0], workers=1)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored','-v'], exit=False)